@@ -0,0 +1,133 @@
+"""
+/gitlab-hook 入口微基准：在进程内直接以ASGI协议调用应用，测量每秒可处理的请求数
+
+不经过网络和HTTP客户端，队列的 add_task 被替换为空操作，
+只测量入口本身（中间件、鉴权、解析、过滤、响应）的开销。
+
+用法:
+    poetry run python benchmarks/bench_ingress.py --requests 5000
+"""
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import time
+from pathlib import Path
+
+root_dir = str(Path(__file__).parent.parent)
+if root_dir not in sys.path:
+    sys.path.insert(0, root_dir)
+
+from src.config import settings
+from src.main import app
+from src.utils.queue_handler import webhook_queue
+
+def build_payload(index: int, target_branch: str) -> dict:
+    """构造一个接近真实大小的 Merge Request Hook 请求体"""
+    user = {"id": 3, "name": "张三", "username": "zhangsan", "avatar_url": "https://example.com/avatar.png"}
+    return {
+        "object_kind": "merge_request",
+        "event_type": "merge_request",
+        "user": user,
+        "project": {
+            "id": 110,
+            "name": "demo",
+            "namespace": "group",
+            "path_with_namespace": "group/demo",
+            "web_url": "https://gitlab.example.com/group/demo",
+            "description": "示例项目" * 20,
+        },
+        "object_attributes": {
+            "id": 100000 + index,
+            "iid": index,
+            "title": f"feat: benchmark change {index}",
+            "description": "修改说明\n" * 50,
+            "state": "opened",
+            "action": "update",
+            "target_branch": target_branch,
+            "source_branch": f"feature/{index}",
+            "author_id": 3,
+            "created_at": "2024-06-01 10:00:00 UTC",
+            "updated_at": "2024-06-01 10:00:00 UTC",
+            "url": f"https://gitlab.example.com/group/demo/-/merge_requests/{index}",
+            "last_commit": {"id": "a" * 40, "message": "commit message\n" * 10, "author": user},
+        },
+        "labels": [{"id": i, "title": f"label-{i}", "color": "#ffffff"} for i in range(5)],
+        "changes": {"updated_at": {"previous": "2024-06-01 09:00:00 UTC", "current": "2024-06-01 10:00:00 UTC"}},
+        "assignees": [user],
+        "reviewers": [user],
+    }
+
+async def run(total: int, concurrency: int, target_ratio: float):
+    async def accept(*args, **kwargs):
+        return True
+    webhook_queue.add_task = accept
+
+    headers = {
+        "X-Gitlab-Token": settings.gitlab.webhook_secret,
+        "X-Gitlab-Event": "Merge Request Hook",
+        "Content-Type": "application/json",
+    }
+    target_every = max(1, round(1 / target_ratio)) if target_ratio > 0 else 0
+    bodies = [
+        json.dumps(build_payload(i, "main" if target_every and i % target_every == 0 else "feature/x")).encode()
+        for i in range(min(total, 1000))
+    ]
+
+    async def call(body: bytes, delivery_id: str) -> int:
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "POST",
+            "scheme": "http",
+            "path": "/gitlab-hook",
+            "raw_path": b"/gitlab-hook",
+            "query_string": b"",
+            "root_path": "",
+            "headers": [(k.lower().encode(), v.encode()) for k, v in {**headers, "Idempotency-Key": delivery_id}.items()],
+            "client": ("127.0.0.1", 50000),
+            "server": ("bench", 80),
+        }
+        received = False
+        status_code = 0
+
+        async def receive():
+            nonlocal received
+            if received:
+                return {"type": "http.disconnect"}
+            received = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def send(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+
+        await app(scope, receive, send)
+        return status_code
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send(i: int):
+        async with semaphore:
+            status_code = await call(bodies[i % len(bodies)], f"bench-{i}")
+            if status_code >= 400:
+                raise RuntimeError(f"unexpected status {status_code}")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(send(i) for i in range(total)))
+    elapsed = time.perf_counter() - start
+
+    print(f"requests: {total}, concurrency: {concurrency}, target ratio: {target_ratio}")
+    print(f"elapsed: {elapsed:.3f}s, {total / elapsed:.0f} req/s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--target-ratio", type=float, default=0.2, help="目标分支事件的比例")
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+    asyncio.run(run(args.requests, args.concurrency, args.target_ratio))
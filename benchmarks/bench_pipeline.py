@@ -0,0 +1,352 @@
+"""
+端到端压测：在子进程中启动应用，连接本地GitLab/企业微信桩服务，按指定速率回放webhook语料
+
+每个事件的MR标题/评论内容中附加 [bench#序号] 标记，企业微信桩收到消息时按标记计算
+从发出webhook到收到通知的端到端延迟。结果包含吞吐、p50/p90/p99延迟和内存峰值，
+可以保存为JSON并与之前的结果对比。
+
+用法:
+    poetry run python benchmarks/bench_pipeline.py --events 5000 --rate 500 --output results/new.json
+    poetry run python benchmarks/bench_pipeline.py --corpus logs/webhook_data --compare results/old.json
+    poetry run python benchmarks/bench_pipeline.py --gitlab-latency 0.05 --gitlab-error-rate 0.01
+"""
+import argparse
+import asyncio
+import copy
+import json
+import os
+import re
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from itertools import cycle, islice
+from pathlib import Path
+from typing import Dict, List, Optional
+
+root_dir = str(Path(__file__).parent.parent)
+if root_dir not in sys.path:
+    sys.path.insert(0, root_dir)
+
+MARKER = re.compile(r"\[bench#(\d+)\]")
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def write_config(path: Path, gitlab_port: int, wechat_port: int, args) -> None:
+    """生成指向桩服务的配置文件"""
+    path.write_text(f"""
+[gitlab]
+api_url = "http://127.0.0.1:{gitlab_port}/api/v4"
+url = "http://127.0.0.1:{gitlab_port}"
+access_token = "bench"
+webhook_secret = "bench-secret"
+
+[wechat]
+bot_key = "bench"
+base_url = "http://127.0.0.1:{wechat_port}"
+rate_limit = {args.wechat_rate_limit}
+
+[server]
+host = "127.0.0.1"
+port = 0
+workers = {args.app_workers}
+
+[log]
+level = "warning"
+max_size = 10485760
+backup_count = 1
+
+[app]
+debug = false
+
+[branches_regex]
+versions = [".*"]
+
+[queue]
+workers = {args.workers}
+capacity = {args.capacity}
+high_watermark = {args.capacity}
+low_watermark = {args.capacity}
+""", encoding="utf-8")
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=root_dir, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def add_marker(event_type: str, data: dict, seq: int) -> dict:
+    """复制事件并在会出现在通知中的字段附加标记"""
+    data = copy.copy(data)
+    attributes = data["object_attributes"] = dict(data.get("object_attributes") or {})
+    if event_type == "Note Hook":
+        attributes["description"] = f"{attributes.get('description') or ''} [bench#{seq}]"
+    else:
+        attributes["title"] = f"{attributes.get('title') or ''} [bench#{seq}]"
+    return data
+
+class WebhookConnection:
+    """
+    最小的HTTP/1.1长连接客户端
+
+    压测客户端与桩服务在同一进程中，使用通用HTTP客户端时客户端自身的开销会成为瓶颈
+    """
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+
+    async def post(self, event_type: str, delivery_id: str, body: bytes) -> str:
+        """发送webhook请求，返回响应中的status字段（非JSON响应时返回状态码）"""
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        head = (
+            f"POST /gitlab-hook HTTP/1.1\r\nHost: {self.host}\r\n"
+            f"X-Gitlab-Token: bench-secret\r\nX-Gitlab-Event: {event_type}\r\n"
+            f"Idempotency-Key: {delivery_id}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n"
+        )
+        self._writer.write(head.encode("utf-8") + body)
+        status_line = await self._reader.readline()
+        if not status_line:
+            raise ConnectionResetError("连接已关闭")
+        status_code = int(status_line.split()[1])
+        length = 0
+        while True:
+            line = await self._reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            if name.strip().lower() == "content-length":
+                length = int(value.strip())
+        content = await self._reader.readexactly(length) if length else b""
+        try:
+            return json.loads(content).get("status") or str(status_code)
+        except ValueError:
+            return str(status_code)
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._reader = self._writer = None
+
+async def start_app(args) -> asyncio.subprocess.Process:
+    """在子进程中启动应用，与压测客户端和桩服务隔离，等待端口可连接"""
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, "-m", "uvicorn", "src.main:app",
+        "--host", "127.0.0.1", "--port", str(args.app_port),
+        "--workers", str(args.app_workers), "--log-level", "warning", "--no-access-log",
+        cwd=root_dir, stdout=asyncio.subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.returncode is not None:
+            raise SystemExit(f"应用启动失败，退出码: {process.returncode}")
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", args.app_port)
+            writer.close()
+            return process
+        except OSError:
+            await asyncio.sleep(0.1)
+    process.kill()
+    raise SystemExit("应用启动超时")
+
+def process_peak_rss_mb(pid: int) -> Optional[float]:
+    """进程及其子进程(uvicorn worker)的内存峰值之和(MB)，仅支持Linux"""
+    total_kb = 0
+    pids = [pid]
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            pids.extend(int(child) for child in f.read().split())
+        for process_id in pids:
+            with open(f"/proc/{process_id}/status") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        total_kb += int(line.split()[1])
+    except OSError:
+        return None
+    return round(total_kb / 1024, 1)
+
+async def run(args) -> Dict:
+    from corpus import iter_corpus, synthetic_corpus
+    from stubs import GitLabStub, StubBehavior, WeChatStub, start_server, stop_server
+    from src.utils import fast_json
+
+    source = iter_corpus(args.corpus) if args.corpus else synthetic_corpus(args.events, seed=args.seed)
+    events = list(islice(source, args.events))
+    if not events:
+        raise SystemExit("语料为空")
+    if len(events) < args.events:
+        events = list(islice(cycle(events), args.events))
+
+    sent_at: Dict[int, float] = {}
+    latencies: List[float] = []
+
+    def on_message(received_at: float, content: str):
+        for match in MARKER.finditer(content):
+            started = sent_at.pop(int(match.group(1)), None)
+            if started is not None:
+                latencies.append(received_at - started)
+
+    gitlab = GitLabStub(StubBehavior(args.gitlab_latency, args.gitlab_jitter, args.gitlab_error_rate, args.seed))
+    wechat = WeChatStub(
+        StubBehavior(args.wechat_latency, args.wechat_jitter, args.wechat_error_rate, args.seed),
+        rate_limited_rate=args.wechat_rate_limited_rate,
+        on_message=on_message,
+    )
+    servers = [
+        await start_server(gitlab, args.gitlab_port),
+        await start_server(wechat, args.wechat_port),
+    ]
+    app_process = await start_app(args)
+
+    statuses: Dict[str, int] = {}
+    pending: "asyncio.Queue[Optional[int]]" = asyncio.Queue()
+
+    async def sender():
+        """单个长连接：依次发送队列中的事件"""
+        connection = WebhookConnection("127.0.0.1", args.app_port)
+        try:
+            while True:
+                seq = await pending.get()
+                if seq is None:
+                    return
+                event_type, data = events[seq]
+                body = fast_json.dumps(add_marker(event_type, data, seq))
+                sent_at[seq] = time.monotonic()
+                try:
+                    result = await connection.post(event_type, f"bench-{seq}", body)
+                except (OSError, asyncio.IncompleteReadError) as e:
+                    result = type(e).__name__
+                    await connection.close()
+                statuses[result] = statuses.get(result, 0) + 1
+                if result != "accepted":
+                    sent_at.pop(seq, None)
+        finally:
+            await connection.close()
+
+    start = time.perf_counter()
+    senders = [asyncio.create_task(sender()) for _ in range(args.concurrency)]
+    for seq in range(len(events)):
+        if args.rate > 0:
+            delay = start + seq / args.rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        pending.put_nowait(seq)
+    for _ in senders:
+        pending.put_nowait(None)
+    await asyncio.gather(*senders)
+    ingress_elapsed = time.perf_counter() - start
+
+    # 等待已接收的事件全部送达企业微信桩
+    deadline = time.monotonic() + args.drain_timeout
+    while sent_at and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+    total_elapsed = time.perf_counter() - start
+
+    peak_rss_mb = process_peak_rss_mb(app_process.pid)
+    app_process.send_signal(signal.SIGINT)
+    await app_process.wait()
+    for server, task in servers:
+        await stop_server(server, task)
+
+    return {
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "params": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "events": len(events),
+        "statuses": statuses,
+        "ingress_rps": round(len(events) / ingress_elapsed, 1),
+        "notifications": len(latencies),
+        "lost": len(sent_at),
+        "throughput": round(len(latencies) / total_elapsed, 1),
+        "latency_p50_ms": _ms(percentile(latencies, 0.5)),
+        "latency_p90_ms": _ms(percentile(latencies, 0.9)),
+        "latency_p99_ms": _ms(percentile(latencies, 0.99)),
+        "latency_max_ms": _ms(max(latencies) if latencies else None),
+        "peak_rss_mb": peak_rss_mb,
+        "gitlab_requests": gitlab.request_count,
+        "wechat_messages": wechat.message_count,
+        "wechat_rate_limited": wechat.rate_limited_count,
+    }
+
+def _ms(seconds: Optional[float]) -> Optional[float]:
+    return None if seconds is None else round(seconds * 1000, 2)
+
+# 对比时展示的指标及其方向(True表示越大越好)
+COMPARE_METRICS = {
+    "ingress_rps": True,
+    "throughput": True,
+    "latency_p50_ms": False,
+    "latency_p99_ms": False,
+    "peak_rss_mb": False,
+    "lost": False,
+}
+
+def compare(baseline: Dict, result: Dict):
+    print(f"\n{'metric':<16}{'baseline':>12}{'current':>12}{'change':>10}")
+    print(f"{'revision':<16}{baseline.get('revision', '-'):>12}{result['revision']:>12}")
+    for metric, higher_is_better in COMPARE_METRICS.items():
+        old, new = baseline.get(metric), result.get(metric)
+        if old is None or new is None:
+            print(f"{metric:<16}{str(old):>12}{str(new):>12}")
+            continue
+        change = (new - old) / old * 100 if old else 0.0
+        better = (change > 0) == higher_is_better if change else True
+        print(f"{metric:<16}{old:>12}{new:>12}{change:>+9.1f}%{'' if better else '  !'}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", nargs="*", help="语料文件或目录（旧版JSON文件或归档分段），默认使用合成语料")
+    parser.add_argument("--events", type=int, default=2000, help="发送的事件数，语料不足时循环使用")
+    parser.add_argument("--rate", type=float, default=0, help="每秒发送的事件数，0表示不限速")
+    parser.add_argument("--concurrency", type=int, default=50, help="同时进行中的webhook请求数")
+    parser.add_argument("--app-workers", type=int, default=1, help="uvicorn worker进程数")
+    parser.add_argument("--workers", type=int, default=4, help="队列worker数")
+    parser.add_argument("--capacity", type=int, default=100000, help="队列容量")
+    parser.add_argument("--wechat-rate-limit", type=int, default=0, help="企业微信每分钟限流条数，0表示不限流")
+    parser.add_argument("--gitlab-latency", type=float, default=0.005)
+    parser.add_argument("--gitlab-jitter", type=float, default=0.0)
+    parser.add_argument("--gitlab-error-rate", type=float, default=0.0)
+    parser.add_argument("--wechat-latency", type=float, default=0.01)
+    parser.add_argument("--wechat-jitter", type=float, default=0.0)
+    parser.add_argument("--wechat-error-rate", type=float, default=0.0)
+    parser.add_argument("--wechat-rate-limited-rate", type=float, default=0.0, help="企业微信返回45009的比例")
+    parser.add_argument("--drain-timeout", type=float, default=60, help="发送结束后等待通知送达的最长时间(秒)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="结果保存路径(JSON)")
+    parser.add_argument("--compare", help="与之前保存的结果对比")
+    args = parser.parse_args()
+    args.app_port, args.gitlab_port, args.wechat_port = free_port(), free_port(), free_port()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config_path = Path(tmp) / "config.toml"
+        write_config(config_path, args.gitlab_port, args.wechat_port, args)
+        os.environ["GITLAB_WEBHOOK_CONFIG"] = str(config_path)
+        result = asyncio.run(run(args))
+
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.output:
+        output = Path(args.output)
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+    if args.compare:
+        compare(json.loads(Path(args.compare).read_text(encoding="utf-8")), result)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+通知消息渲染微基准：比较每个事件的渲染开销
+
+- legacy: 原来的做法，每个事件用md()拼出全部7种MR消息再取其中一条
+- template: 预编译模板，只渲染当前动作需要的一条
+
+两种方式的输出会先做一致性校验（默认模板未被配置覆盖时）。
+
+用法:
+    poetry run python benchmarks/bench_templates.py --events 20000
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+root_dir = str(Path(__file__).parent.parent)
+if root_dir not in sys.path:
+    sys.path.insert(0, root_dir)
+
+from src.config import settings
+from src.utils.markdown import md
+from src.utils.router import MR_ACTIONS
+from src.utils.templates import load_templates
+
+def build_fields(index: int) -> dict:
+    return {
+        "project": "demo",
+        "branch": "1.2.3.x",
+        "title": f"feat: benchmark change {index}",
+        "description": "修改说明\n" * 20,
+        "link": f"https://gitlab.example.com/group/demo/-/merge_requests/{index}",
+        "author": "张三",
+        "reviewer": "李四",
+        "assignee": "王五",
+    }
+
+def render_legacy(action: str, f: dict) -> str:
+    """原 handle_merge_request 中的消息构建方式"""
+    messages = {
+        "open": (
+            md("有新的合并请求").info().bold().new_line() +
+            md(f"项目: {f['project']}").quote().new_line() +
+            md(f"分支: {f['branch']}").quote().new_line() +
+            md(f"标题: {f['title']}").quote().new_line() +
+            md(f"内容：{f['description']}").quote().new_line() +
+            md(f"链接: {f['link']}").quote().new_line() +
+            md(f"申请人:").info().quote() + md(f['author']).mark().new_line() +
+            md(f"评审:").info().quote() + md(f['reviewer']).mark().new_line() +
+            md(f"经办人:").info().quote() + md(f['assignee']).mark().new_line()
+        ),
+        "close": (
+            md("你的MR已关闭").warning().bold().new_line() +
+            md(f"项目: {f['project']}").quote().new_line() +
+            md(f"分支: {f['branch']}").quote().new_line() +
+            md(f"标题: {f['title']}").quote().new_line() +
+            md(f"内容：{f['description']}").quote().new_line() +
+            md(f"链接: {f['link']}").quote().new_line() +
+            md(f"申请人:").info().quote() + md(f['author']).mark().new_line()
+        ),
+        "reopen": (
+            md("你的MR已重新打开").warning().bold().new_line() +
+            md(f"项目: {f['project']}").quote().new_line() +
+            md(f"分支: {f['branch']}").quote().new_line() +
+            md(f"标题: {f['title']}").quote().new_line() +
+            md(f"内容：{f['description']}").quote().new_line() +
+            md(f"链接: {f['link']}").quote().new_line() +
+            md(f"申请人:").info().quote() + md(f['author']).mark().new_line() +
+            md(f"评审人:").info().quote() + md(f['reviewer']).mark().new_line() +
+            md(f"经办人:").info().quote() + md(f['assignee']).mark().new_line()
+        ),
+        "update": (
+            md("MR存在更新，请拨冗查看").warning().bold().new_line() +
+            md(f"项目: {f['project']}").quote().new_line() +
+            md(f"分支: {f['branch']}").quote().new_line() +
+            md(f"标题: {f['title']}").quote().new_line() +
+            md(f"内容：{f['description']}").quote().new_line() +
+            md(f"链接: {f['link']}").quote().new_line() +
+            md(f"评审:").info().quote() + md(f['reviewer']).mark().new_line()
+        ),
+        "merge": (
+            md("MR请求已合并").success().bold().new_line() +
+            md(f"项目: {f['project']}").quote().new_line() +
+            md(f"分支: {f['branch']}").quote().new_line() +
+            md(f"标题: {f['title']}").quote().new_line() +
+            md(f"内容：{f['description']}").quote().new_line() +
+            md(f"链接: {f['link']}").quote().new_line() +
+            md(f"申请人:").info().quote() + md(f['author']).mark().new_line()
+        ),
+        "approved": (
+            md("MR请求已评审通过，请您合并").success().bold().new_line() +
+            md(f"项目: {f['project']}").quote().new_line() +
+            md(f"分支: {f['branch']}").quote().new_line() +
+            md(f"标题: {f['title']}").quote().new_line() +
+            md(f"内容：{f['description']}").quote().new_line() +
+            md(f"链接: {f['link']}").quote().new_line() +
+            md(f"经办人:").info().quote() + md(f['assignee']).mark().new_line()
+        ),
+        "unapproved": (
+            md("MR请求未评审通过，请根据评审意见修改代码").error().bold().new_line() +
+            md(f"项目: {f['project']}").quote().new_line() +
+            md(f"分支: {f['branch']}").quote().new_line() +
+            md(f"标题: {f['title']}").quote().new_line() +
+            md(f"内容：{f['description']}").quote().new_line() +
+            md(f"链接: {f['link']}").quote().new_line() +
+            md(f"申请人:").info().quote() + md(f['author']).mark().new_line()
+        ),
+    }
+    return str(messages[action])
+
+def run(name: str, render, events: list) -> float:
+    start = time.perf_counter()
+    for action, fields in events:
+        render(action, fields)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<10} {len(events) / elapsed:>12,.0f} events/s  {elapsed / len(events) * 1e6:>8.2f} us/event")
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="通知消息渲染微基准")
+    parser.add_argument("--events", type=int, default=20000, help="渲染的事件数")
+    args = parser.parse_args()
+
+    templates = load_templates()
+    events = [(MR_ACTIONS[i % len(MR_ACTIONS)], build_fields(i)) for i in range(args.events)]
+
+    for action in MR_ACTIONS:
+        fields = build_fields(0)
+        if render_legacy(action, fields) != templates[action].render(fields):
+            raise SystemExit(f"模板输出与原消息不一致: {action}")
+    if settings.templates:
+        print("注意: 配置中的[templates]不参与本基准，使用默认模板")
+
+    legacy = run("legacy", render_legacy, events)
+    template = run("template", lambda action, fields: templates[action].render(fields), events)
+    print(f"speedup    {legacy / template:>12.1f}x")
+
+if __name__ == "__main__":
+    main()
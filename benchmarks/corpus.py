@@ -0,0 +1,73 @@
+"""
+压测/回放用的webhook数据语料
+
+支持两种来源:
+- 旧版 log_webhook_data 写出的单个JSON文件: logs/webhook_data/20240601_100000_Merge_Request_Hook.json
+- PayloadArchive 写出的gzip JSONL分段: logs/webhook_data/payloads-*.jsonl.gz
+
+没有语料时可以用 synthetic_corpus 生成接近真实分布的MR和评论事件
+"""
+import random
+from pathlib import Path
+from typing import Iterable, Iterator, Tuple, Union
+from src.utils.payload_archive import iter_payloads
+
+def iter_corpus(paths: Iterable[Union[str, Path]]) -> Iterator[Tuple[str, dict]]:
+    """按时间顺序流式读取语料，返回(事件类型, 数据)"""
+    for record in iter_payloads(paths):
+        yield record["event_type"], record["data"]
+
+# 合成语料中各动作的权重，update最多
+_MR_ACTION_WEIGHTS = {"update": 50, "open": 10, "approved": 10, "merge": 8, "close": 3, "reopen": 1, "unapproved": 3}
+
+def synthetic_corpus(count: int, projects: int = 20, seed: int = 0) -> Iterator[Tuple[str, dict]]:
+    """生成MR事件(80%)和评论事件(20%)"""
+    rng = random.Random(seed)
+    actions = list(_MR_ACTION_WEIGHTS)
+    weights = list(_MR_ACTION_WEIGHTS.values())
+    for index in range(count):
+        project_id = rng.randrange(projects) + 1
+        iid = rng.randrange(200) + 1
+        author = {"id": rng.randrange(50) + 1, "name": "张三", "username": "zhangsan"}
+        project = {
+            "id": project_id,
+            "name": f"demo-{project_id}",
+            "namespace": "group",
+            "path_with_namespace": f"group/demo-{project_id}",
+            "web_url": f"https://gitlab.example.com/group/demo-{project_id}",
+        }
+        mr = {
+            "id": project_id * 1000 + iid,
+            "iid": iid,
+            "title": f"feat: change {iid}",
+            "description": "修改说明\n" * rng.randrange(1, 30),
+            "state": "opened",
+            "target_branch": "main",
+            "source_branch": f"feature/{iid}",
+            "author_id": author["id"],
+            "created_at": "2024-06-01 10:00:00 UTC",
+            "updated_at": "2024-06-01 10:00:00 UTC",
+            "url": f"{project['web_url']}/-/merge_requests/{iid}",
+        }
+        if rng.random() < 0.2:
+            yield "Note Hook", {
+                "object_kind": "note",
+                "user": author,
+                "project": project,
+                "object_attributes": {
+                    "id": index,
+                    "note": "请看一下这里",
+                    "description": "请看一下这里",
+                    "noteable_type": "MergeRequest",
+                },
+                "merge_request": mr,
+            }
+        else:
+            yield "Merge Request Hook", {
+                "object_kind": "merge_request",
+                "user": author,
+                "project": project,
+                "object_attributes": {**mr, "action": rng.choices(actions, weights)[0]},
+                "assignees": [author],
+                "reviewers": [author],
+            }
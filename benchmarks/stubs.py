@@ -0,0 +1,154 @@
+"""
+压测用的GitLab REST API和企业微信机器人接口桩服务
+
+两个桩都是最小的ASGI应用，支持注入固定延迟、随机抖动和错误率：
+- GitLab: /api/v4/users/<id> 返回用户信息，.../merge_requests 返回空列表，其余路径返回 {}
+- 企业微信: /cgi-bin/webhook/send 记录收到的消息，可按比例返回限流(45009)或其他错误码
+
+单独启动（手动联调时使用）:
+    poetry run python benchmarks/stubs.py --gitlab-port 9001 --wechat-port 9002 --latency 0.05
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+from typing import Callable, List, Optional, Tuple
+import uvicorn
+
+class StubBehavior:
+    """桩服务的响应行为"""
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0, seed: Optional[int] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+
+    async def delay(self):
+        latency = self.latency + (self._random.uniform(-self.jitter, self.jitter) if self.jitter else 0.0)
+        if latency > 0:
+            await asyncio.sleep(latency)
+
+    def should_fail(self) -> bool:
+        return self.error_rate > 0 and self._random.random() < self.error_rate
+
+async def _send_json(send, status: int, payload, headers: Optional[List[Tuple[bytes, bytes]]] = None):
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())] + (headers or []),
+    })
+    await send({"type": "http.response.body", "body": body})
+
+async def _read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+class GitLabStub:
+    """GitLab REST API桩"""
+
+    _USER_PATH = re.compile(r"^/api/v4/users/(\d+)$")
+
+    def __init__(self, behavior: StubBehavior):
+        self.behavior = behavior
+        self.request_count = 0
+        self.error_count = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return
+        self.request_count += 1
+        await _read_body(receive)
+        await self.behavior.delay()
+        if self.behavior.should_fail():
+            self.error_count += 1
+            await _send_json(send, 500, {"message": "500 Internal Server Error"})
+            return
+        path = scope["path"]
+        match = self._USER_PATH.match(path)
+        if match:
+            user_id = int(match.group(1))
+            await _send_json(send, 200, {"id": user_id, "name": f"用户{user_id}", "username": f"user{user_id}"})
+        elif path.endswith("/merge_requests"):
+            await _send_json(send, 200, [], [(b"x-total-pages", b"1"), (b"x-page", b"1")])
+        else:
+            await _send_json(send, 200, {})
+
+class WeChatStub:
+    """
+    企业微信机器人接口桩
+
+    每收到一条消息调用 on_message(收到时间, 消息内容)，用于统计端到端延迟
+    """
+
+    def __init__(
+        self,
+        behavior: StubBehavior,
+        rate_limited_rate: float = 0.0,
+        on_message: Optional[Callable[[float, str], None]] = None,
+    ):
+        self.behavior = behavior
+        self.rate_limited_rate = rate_limited_rate
+        self.on_message = on_message
+        self.message_count = 0
+        self.error_count = 0
+        self.rate_limited_count = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return
+        body = await _read_body(receive)
+        await self.behavior.delay()
+        if self.behavior.should_fail():
+            self.error_count += 1
+            await _send_json(send, 200, {"errcode": -1, "errmsg": "system error"})
+            return
+        if self.rate_limited_rate > 0 and self.behavior._random.random() < self.rate_limited_rate:
+            self.rate_limited_count += 1
+            await _send_json(send, 200, {"errcode": 45009, "errmsg": "api freq out of limit"})
+            return
+        self.message_count += 1
+        if self.on_message is not None:
+            content = json.loads(body).get("markdown", {}).get("content", "")
+            self.on_message(time.monotonic(), content)
+        await _send_json(send, 200, {"errcode": 0, "errmsg": "ok"})
+
+async def start_server(app, port: int, host: str = "127.0.0.1", lifespan: str = "off") -> Tuple[uvicorn.Server, asyncio.Task]:
+    """在当前事件循环中启动uvicorn服务，返回(服务, 运行任务)"""
+    server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, lifespan=lifespan, log_level="warning", access_log=False))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        if task.done():
+            task.result()
+        await asyncio.sleep(0.01)
+    return server, task
+
+async def stop_server(server: uvicorn.Server, task: asyncio.Task):
+    server.should_exit = True
+    await task
+
+async def _main(args):
+    gitlab = GitLabStub(StubBehavior(args.latency, args.jitter, args.error_rate))
+    wechat = WeChatStub(StubBehavior(args.latency, args.jitter, args.error_rate), args.rate_limited_rate,
+                        on_message=lambda received_at, content: print(content, end="\n\n"))
+    servers = [await start_server(gitlab, args.gitlab_port), await start_server(wechat, args.wechat_port)]
+    print(f"GitLab stub: http://127.0.0.1:{args.gitlab_port}/api/v4")
+    print(f"WeChat stub: http://127.0.0.1:{args.wechat_port}")
+    await asyncio.gather(*(task for _, task in servers))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--gitlab-port", type=int, default=9001)
+    parser.add_argument("--wechat-port", type=int, default=9002)
+    parser.add_argument("--latency", type=float, default=0.0, help="固定响应延迟(秒)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="延迟随机抖动(秒)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回错误的比例")
+    parser.add_argument("--rate-limited-rate", type=float, default=0.0, help="企业微信返回45009限流的比例")
+    asyncio.run(_main(parser.parse_args()))
@@ -1,20 +1,43 @@
 from pydantic import BaseModel
 import tomli
 import logging
+import os
 from pathlib import Path
-from typing import Optional
+from typing import Dict, List, Optional, Union
 
 logger = logging.getLogger(__name__)
 
+# 指定配置文件路径的环境变量
+CONFIG_PATH_ENV = "GITLAB_WEBHOOK_CONFIG"
+
 class GitLabConfig(BaseModel):
     api_url: str
     url: str
     access_token: str
     webhook_secret: str
-    project_id: int
+    project_id: Optional[int] = None
+    project_ids: List[int] = []  # 周报包含的更多项目
+    group_ids: List[int] = []  # 周报包含的群组（含子群组下的全部项目）
+    timeout: float = 10.0  # 读取超时(秒)
+    connect_timeout: float = 5.0  # 连接超时(秒)
+    max_connections: int = 20  # 连接池最大连接数
+    max_keepalive_connections: int = 10  # 保持长连接的最大数量
+    http2: bool = True  # 安装了h2时启用HTTP/2
+    page_concurrency: int = 4  # 分页接口并发获取的最大页数
+    bulk_max_connections: int = 8  # 批量事件和后台任务(周报、对账)最多同时占用的连接数，其余留给实时事件
 
 class WeChatConfig(BaseModel):
     bot_key: str
+    base_url: str = "https://qyapi.weixin.qq.com"  # 测试/压测时可指向本地替身服务
+    connect_timeout: float = 5.0  # 连接超时(秒)
+    read_timeout: float = 10.0  # 读取超时(秒)
+    max_connections: int = 50  # 连接池最大连接数，即最大并发投递数
+    max_keepalive_connections: int = 20  # 保持长连接的最大数量
+    rate_limit: int = 20  # 每个机器人每分钟最多发送的消息数，0表示不限流
+    digest_threshold: int = 5  # 剩余配额低于该值时把待发送通知合并成摘要
+    bulk_max_wait: float = 60  # 批量消息最多等待的秒数，超过后不再让实时通知优先
+    rate_limit_path: Optional[str] = "data/wechat_rate_limit.db"  # 同一主机所有worker共享令牌桶的SQLite路径，为空时按worker数平分rate_limit
+    bots: Dict[str, str] = {}  # 具名机器人 {名称: key}，供路由规则引用
 
 class ServerConfig(BaseModel):
     host: str
@@ -26,25 +49,134 @@ class LogConfig(BaseModel):
     max_size: int
     backup_count: int
 
+class ArchiveConfig(BaseModel):
+    enabled: bool = False  # 归档webhook原始数据，调试模式下总是启用
+    path: str = "logs/webhook_data"  # 归档目录，保存gzip压缩的JSONL分段
+    segment_size: int = 64 * 1024 * 1024  # 单个分段的最大字节数(压缩后)
+    max_segments: int = 20  # 最多保留的分段数
+    flush_interval: float = 5  # 刷新到磁盘的间隔(秒)
+    max_pending: int = 10000  # 等待写入的记录上限，超过时丢弃
+
+class ResilienceConfig(BaseModel):
+    failure_threshold: int = 5  # 上游连续失败多少次后熔断
+    recovery_timeout: float = 30  # 熔断持续时间(秒)，之后放行一个试探请求
+    max_attempts: int = 5  # 事件/消息最多尝试次数，用完后转入死信
+    retry_base_delay: float = 1  # 重试退避的初始等待(秒)，每次翻倍并加随机抖动
+    retry_max_delay: float = 60  # 重试退避的最大等待(秒)
+    dead_letter_path: Optional[str] = None  # 死信存储(SQLite)路径，为空时重试用完的事件只记录日志
+
+class LeaderConfig(BaseModel):
+    backend: str = "sqlite"  # 租约存储: sqlite(同一主机的worker之间)、redis(多个节点之间)、memory(单进程)
+    path: str = "data/leader.db"  # sqlite租约数据库路径
+    redis_url: str = "redis://localhost:6379/0"  # redis租约地址
+    name: str = "scheduler"  # 租约名，共用同一存储的多套部署需要区分
+    ttl: float = 30  # 租约有效期(秒)，leader崩溃后最多经过该时间由其他worker接管
+    renew_interval: float = 10  # 续约/竞争间隔(秒)
+
+class MetricsConfig(BaseModel):
+    multiproc_dir: str = "data/metrics"  # 多worker时各进程写入指标文件的目录，启动时清空
+
+class SummaryConfig(BaseModel):
+    concurrency: int = 8  # 同时获取的项目/群组数量上限
+    project_timeout: float = 60  # 单个项目/群组的获取超时(秒)
+
+class IndexConfig(BaseModel):
+    enabled: bool = False  # 启用后周报直接查询本地MR索引
+    path: str = "data/mr_index.db"  # 索引数据库(SQLite)路径
+    reconcile_interval: int = 21600  # 与GitLab API对账的间隔(秒)
+
+class RemindersConfig(BaseModel):
+    enabled: bool = False  # MR超过timeout仍未评审/合并/关闭时发送提醒
+    path: str = "data/reminders.db"  # 提醒存储(SQLite)路径，所有worker共享，重启后恢复
+    timeout: float = 86400  # 提醒时间(秒)
+    max_reminders: int = 1  # 同一MR最多提醒次数，每次间隔timeout
+    arm_actions: List[str] = ["open", "reopen", "update"]  # 开始计时的MR动作，update不推迟已有的提醒
+    cancel_actions: List[str] = ["approved", "merge", "close"]  # 取消提醒的MR动作，approved之后直到unapproved/merge/close/reopen前不再重新计时
+    sweep_interval: float = 300  # 扫描其他worker遗留的到期提醒的间隔(秒)
+
+class QueueConfig(BaseModel):
+    workers: int = 4  # 并发worker数量，同一MR的事件始终由同一worker按序处理
+    capacity: int = 1000  # 队列容量，达到后拒绝新事件并返回503
+    high_watermark: int = 800  # 队列长度达到该值后开始丢弃低价值事件
+    low_watermark: int = 500  # 队列长度回落到该值后停止丢弃
+    shed_actions: List[str] = ["update"]  # 可被丢弃的低价值MR动作
+    retry_after: int = 30  # 拒绝时返回的Retry-After(秒)
+    debounce_window: float = 0  # 同一MR连续更新事件的合并窗口(秒)，0表示不合并
+    debounce_max_wait: float = 30  # 持续有更新时最多延迟发送的时间(秒)
+    debounce_actions: List[str] = ["update"]  # 参与合并的MR动作
+    bulk_actions: List[str] = ["update"]  # 低优先级的MR动作，其他事件优先处理
+    realtime_weight: int = 8  # 同时有积压时，每处理多少个实时事件处理一个批量事件，避免批量事件饿死
+    journal_path: Optional[str] = None  # 持久化事件日志(SQLite)路径，为空则不启用
+    journal_lease: float = 300  # 事件租约(秒)，持有进程每半个租约续约一次，超时未续约的事件会被重新认领
+    journal_max_attempts: int = 5  # 持有进程退出后事件最多被认领重放的次数(处理失败的事件转入死信，不重放)
+
+class DedupConfig(BaseModel):
+    enabled: bool = True  # 按投递ID(Idempotency-Key/X-Gitlab-Event-UUID)丢弃重复的webhook
+    window: float = 3600  # 去重时间窗口(秒)
+    max_size: int = 10000  # 每个worker最多记录的投递数
+    shared_path: Optional[str] = None  # 在同一主机的worker之间共享去重状态的SQLite路径
+
+class CacheConfig(BaseModel):
+    user_ttl: float = 3600  # 用户信息缓存时间(秒)
+    user_max_size: int = 2048  # 用户信息缓存最大条目数
+    user_negative_ttl: float = 60  # 查询失败结果的缓存时间(秒)
+
+class HttpCacheConfig(BaseModel):
+    enabled: bool = False  # 缓存GitLab GET响应，过期后用ETag/Last-Modified条件请求重新验证
+    max_entries: int = 2048  # 内存层最大条目数
+    max_bytes: int = 67108864  # 内存层最大字节数(按序列化后的JSON估算)，64MB
+    max_entry_size: int = 1048576  # 超过该大小的响应不缓存
+    disk_path: Optional[str] = None  # 磁盘层(SQLite)路径，为空则只使用内存层；多worker部署时必须配置，用于同步清除缓存
+    disk_max_entries: int = 50000  # 磁盘层最大条目数
+    stale_if_error: bool = True  # GitLab暂时不可用(超时、5xx、熔断)时返回已缓存的数据
+    # 各接口的缓存时间(秒)：TTL内直接使用缓存，之后发送条件请求；0表示每次都重新验证；未列出的接口不缓存
+    ttl: Dict[str, float] = {
+        "/users/:id": 3600,
+        "/projects/:id/merge_requests/:id": 0,
+        "/projects/:id/merge_requests/:id/approvals": 0,
+        "/projects/:id/merge_requests/:id/changes": 0,
+    }
+
 class AppConfig(BaseModel):
     debug: bool
 
 class BranchesRegexConfig(BaseModel):
     versions: list[str]
 
+class RouteConfig(BaseModel):
+    projects: List[Union[int, str]] = []  # 项目ID或路径(group/project)，为空匹配所有项目
+    branches: List[str] = []  # 目标分支正则，为空匹配所有分支
+    actions: List[str] = []  # MR动作(open/update/merge/...)或note，为空匹配所有动作
+    authors: List[Union[int, str]] = []  # MR作者ID或用户名，为空匹配所有作者
+    bots: List[str] = []  # 投递的机器人名称或key，为空使用wechat.bot_key
+
 class Settings(BaseModel):
     gitlab: GitLabConfig
     wechat: WeChatConfig
     server: ServerConfig
     log: LogConfig
+    archive: ArchiveConfig = ArchiveConfig()
     app: AppConfig
     branches_regex: BranchesRegexConfig
+    routes: List[RouteConfig] = []  # 通知路由规则，为空时按branches_regex发送到默认机器人
+    summary: SummaryConfig = SummaryConfig()
+    index: IndexConfig = IndexConfig()
+    reminders: RemindersConfig = RemindersConfig()
+    queue: QueueConfig = QueueConfig()
+    cache: CacheConfig = CacheConfig()
+    http_cache: HttpCacheConfig = HttpCacheConfig()
+    dedup: DedupConfig = DedupConfig()
+    metrics: MetricsConfig = MetricsConfig()
+    resilience: ResilienceConfig = ResilienceConfig()
+    leader: LeaderConfig = LeaderConfig()
+    templates: Dict[str, str] = {}  # 自定义消息模板，键为MR动作或note
 
     @classmethod
     def load_settings(cls, config_path: Optional[str] = None) -> 'Settings':
         try:
             if config_path is None:
-                config_path = str(Path(__file__).parent.parent / "config.toml")
+                # 环境变量可以指定其他配置文件（压测、回放等场景）
+                config_path = os.environ.get(CONFIG_PATH_ENV) or str(Path(__file__).parent.parent / "config.toml")
 
             config_file = Path(config_path)
             if not config_file.exists():
@@ -1,137 +1,197 @@
 from src.utils.wechat_bot import WeChatBot
 from src.utils.gitlab_api import GitlabAPI
-from src.utils.markdown import md
-import logging
-import re
+from src.utils.mr_index import mr_index
+from src.utils.reminders import reminders
+from src.utils.router import MR_ACTIONS, NOTE_ACTION, route_event, unresolved_author
+from src.utils.templates import REMINDER_ACTION, templates
 from src.config import settings
+import logging
+from typing import Optional, Sequence, Tuple
 
 
 logger = logging.getLogger(__name__)
 
-def is_target_branch(branch_name: str) -> bool:
-    """检查分支是否是目标分支"""
-    return any(re.match(pattern, branch_name) for pattern in settings.branches_regex.versions)
+# 会发送通知的MR动作
+SUPPORTED_MR_ACTIONS = frozenset(MR_ACTIONS)
+# 评审通过后不再提醒；撤销通过、合并、关闭或重新打开后清除该标记
+APPROVED_ACTION = "approved"
+UNSUPPRESS_ACTIONS = frozenset({"unapproved", "merge", "close", "reopen"})
+
+def get_first_name(users: Optional[list]) -> str:
+    """获取评审人/经办人列表中第一个人的名字"""
+    if not users:
+        return "无"
+    return users[0].get('name') or "无"
+
+def tracks_state(action: str) -> bool:
+    """没有匹配通知规则的MR事件是否仍需处理：维护MR索引、取消超时提醒"""
+    if mr_index is not None:
+        return True
+    return reminders is not None and (
+        action in settings.reminders.cancel_actions or action == APPROVED_ACTION or action in UNSUPPRESS_ACTIONS
+    )
+
+def get_ignore_reason(event_type: str, data: dict) -> Optional[str]:
+    """
+    在入队前检查事件是否需要处理
+
+    Returns:
+        Optional[str]: 不需要处理时返回原因，否则返回None
+    """
+    if event_type == "Merge Request Hook":
+        mr = data.get("object_attributes") or {}
+        if mr.get("action") not in SUPPORTED_MR_ACTIONS:
+            return "unsupported action"
+        if not route_event(data, mr["action"], mr.get("target_branch") or "") and not tracks_state(mr["action"]):
+            return "no matching route"
+    elif event_type == "Note Hook":
+        if (data.get("object_attributes") or {}).get("noteable_type") != "MergeRequest":
+            return "unsupported noteable"
+        if not route_event(data, NOTE_ACTION, (data.get("merge_request") or {}).get("target_branch") or ""):
+            return "no matching route"
+    return None
 
-async def handle_merge_request(data: dict):
-    """处理合并请求事件"""
+async def resolve_route(data: dict, action: str, branch: str) -> Tuple[str, ...]:
+    """
+    获取webhook事件需要投递的机器人key
+
+    路由规则按用户名匹配作者、而操作者不是MR作者时，通过GitLab用户接口(带缓存)把author_id解析成用户名；
+    GitLab暂时不可用时抛出RetryableError，由队列稍后重试
+    """
+    author_id = unresolved_author(data)
+    if author_id is None:
+        return route_event(data, action, branch)
+    GitlabAPI.cache_users_from_webhook(data)
+    author_username = (await GitlabAPI.get_user_info(author_id)).get("username")
+    return route_event(data, action, branch, author_username, resolved=True)
+
+def format_duration(seconds: float) -> str:
+    """提醒消息中的等待时间: 2天 / 24小时 / 30分钟"""
+    if seconds >= 86400 * 2 and seconds % 86400 == 0:
+        return f"{int(seconds // 86400)}天"
+    if seconds >= 3600:
+        return f"{seconds / 3600:g}小时"
+    return f"{max(seconds / 60, 1):g}分钟"
+
+def update_reminder(data: dict, action: str, values: dict, bot_keys: Sequence[str]):
+    """
+    根据MR动作设置或取消超时提醒，提醒发送到与本次通知相同的机器人
+
+    没有匹配通知规则(bot_keys为空)的事件只取消提醒；评审通过后撤销通过之前不再设置提醒
+    """
+    key = (data['project']['id'], data['object_attributes']['iid'])
+    if action in UNSUPPRESS_ACTIONS:
+        reminders.unsuppress(key)
+    if action in settings.reminders.cancel_actions or action == APPROVED_ACTION:
+        reminders.cancel(key, suppress=action == APPROVED_ACTION)
+    elif action in settings.reminders.arm_actions and bot_keys:
+        template = templates[REMINDER_ACTION]
+        reminder_values = {
+            "waiting": format_duration(settings.reminders.timeout),
+            "reviewer": get_first_name(data.get('reviewers')),
+            "assignee": get_first_name(data.get('assignees')),
+            **values,
+        }
+        payload = {
+            "values": {field: reminder_values.get(field) for field in template.fields},
+            "bot_keys": list(bot_keys),
+        }
+        # open/reopen重新计时；update只更新提醒内容，不推迟已有的提醒
+        reminders.arm(key, payload, reset=action != "update")
+
+async def handle_merge_request(data: dict, replay: bool = False, dry_run: bool = False):
+    """
+    处理合并请求事件
+
+    Args:
+        replay: 离线回放的历史事件：不设置或取消超时提醒(到期时间按当前时间计算，旧事件会给早已合并的MR设置提醒)，
+            MR索引只接受比已有记录新的数据
+        dry_run: 演练，只渲染消息，不修改MR索引和超时提醒
+    """
+    update_index = mr_index is not None and not dry_run
+    update_reminders = reminders is not None and not replay and not dry_run
     try:
         action = data["object_attributes"]["action"]
         mr = data["object_attributes"]
         project = data["project"]
         target_branch = mr['target_branch']
         
-        if not is_target_branch(target_branch):
-            logger.info(f"跳过非master分支的MR: {mr['title']}")
+        bot_keys = await resolve_route(data, action, target_branch)
+        template = templates.get(action)
+        if not bot_keys or template is None:
+            # 不发送通知的事件同样要更新MR索引、取消提醒，否则已合并/关闭的MR仍显示为未完成并被提醒
+            if update_index:
+                mr_index.upsert_from_webhook(data, web_url=GitlabAPI.get_merge_request_url_from_webhook(data))
+            if update_reminders:
+                update_reminder(data, action, {}, ())
+            if template is None:
+                logger.warning(f"未知的MR动作类型: {action}")
+            else:
+                logger.info(f"没有匹配的通知规则，跳过MR: {mr['title']}")
             return
         logger.info(f"处理合并请求事件: {action}")
         logger.info(f"MR标题: {mr['title']}, 项目: {project['name']}")
-        assignee = data['assignees'][0]['name']
-        reviewer = data['reviewers'][0]['name']
-        author = GitlabAPI.get_user_info(data['object_attributes']['author_id'])['name']
+
+        GitlabAPI.cache_users_from_webhook(data)
         gitlab_link = GitlabAPI.get_merge_request_url_from_webhook(data)
-        messages = {
-            "open": (
-                md("有新的合并请求").info().bold().new_line() +
-                md(f"项目: {project['name']}").quote().new_line() +
-                md(f"分支: {target_branch}").quote().new_line() +
-                md(f"标题: {mr['title']}").quote().new_line() +
-                md(f"内容：{mr['description']}").quote().new_line() +
-                md(f"链接: {gitlab_link}").quote().new_line() +
-                md(f"申请人:").info().quote() + md(author).mark().new_line() +
-                md(f"评审:").info().quote() + md(reviewer).mark().new_line() +
-                md(f"经办人:").info().quote() + md(assignee).mark().new_line()
-            ),
-            "close": (
-                md("你的MR已关闭").warning().bold().new_line() +
-                md(f"项目: {project['name']}").quote().new_line() +
-                md(f"分支: {target_branch}").quote().new_line() +
-                md(f"标题: {mr['title']}").quote().new_line() +
-                md(f"内容：{mr['description']}").quote().new_line() +
-                md(f"链接: {gitlab_link}").quote().new_line() +
-                md(f"申请人:").info().quote() + md(author).mark().new_line()
-            ),
-            "reopen": (
-                md("你的MR已重新打开").warning().bold().new_line() +
-                md(f"项目: {project['name']}").quote().new_line() +
-                md(f"分支: {target_branch}").quote().new_line() +
-                md(f"标题: {mr['title']}").quote().new_line() +
-                md(f"内容：{mr['description']}").quote().new_line() +
-                md(f"链接: {gitlab_link}").quote().new_line() +
-                md(f"申请人:").info().quote() + md(author).mark().new_line() +
-                md(f"评审人:").info().quote() + md(reviewer).mark().new_line() +
-                md(f"经办人:").info().quote() + md(assignee).mark().new_line()
-            ),
-            "update": (
-                md("MR存在更新，请拨冗查看").warning().bold().new_line() +
-                md(f"项目: {project['name']}").quote().new_line() +
-                md(f"分支: {target_branch}").quote().new_line() +
-                md(f"标题: {mr['title']}").quote().new_line() +
-                md(f"内容：{mr['description']}").quote().new_line() +
-                md(f"链接: {gitlab_link}").quote().new_line() +
-                md(f"评审:").info().quote() + md(reviewer).mark().new_line()
-            ),
-            "merge": (
-                md("MR请求已合并").success().bold().new_line() +
-                md(f"项目: {project['name']}").quote().new_line() +
-                md(f"分支: {target_branch}").quote().new_line() +
-                md(f"标题: {mr['title']}").quote().new_line() +
-                md(f"内容：{mr['description']}").quote().new_line() +
-                md(f"链接: {gitlab_link}").quote().new_line() +
-                md(f"申请人:").info().quote() + md(author).mark().new_line()
-            ),
-            "approved": (
-                md("MR请求已评审通过，请您合并").success().bold().new_line() +
-                md(f"项目: {project['name']}").quote().new_line() +
-                md(f"分支: {target_branch}").quote().new_line() +
-                md(f"标题: {mr['title']}").quote().new_line() +
-                md(f"内容：{mr['description']}").quote().new_line() +
-                md(f"链接: {gitlab_link}").quote().new_line() +
-                md(f"经办人:").info().quote() + md(assignee).mark().new_line()
-            ),
-            "unapproved": (
-                md("MR请求未评审通过，请根据评审意见修改代码").error().bold().new_line() +
-                md(f"项目: {project['name']}").quote().new_line() +
-                md(f"分支: {target_branch}").quote().new_line() +
-                md(f"标题: {mr['title']}").quote().new_line() +
-                md(f"内容：{mr['description']}").quote().new_line() +
-                md(f"链接: {gitlab_link}").quote().new_line() +
-                md(f"申请人:").info().quote() + md(author).mark().new_line()
-            )
+        values = {
+            "project": project['name'],
+            "branch": target_branch,
+            "title": mr['title'],
+            "description": mr['description'],
+            "link": gitlab_link,
         }
-        
-        if action in messages:
-            message = messages[action]
-            logger.info(f"发送MR {action}通知: {mr['title']}")
-            await WeChatBot.send_message(str(message))
-        else:
-            logger.warning(f"未知的MR动作类型: {action}")
-            
+        # 只获取当前模板用到的人员信息
+        if "reviewer" in template.fields:
+            values["reviewer"] = get_first_name(data.get('reviewers'))
+        if "assignee" in template.fields:
+            values["assignee"] = get_first_name(data.get('assignees'))
+        author = None
+        if "author" in template.fields or update_index or (
+            update_reminders and "author" in templates[REMINDER_ACTION].fields
+        ):
+            author = (await GitlabAPI.get_user_info(mr['author_id']))['name']
+            values["author"] = author
+        if update_index:
+            mr_index.upsert_from_webhook(data, author_name=author, web_url=gitlab_link)
+
+        if update_reminders:
+            update_reminder(data, action, values, bot_keys)
+
+        logger.info(f"发送MR {action}通知: {mr['title']}")
+        await WeChatBot.broadcast(template.render(values), bot_keys)
+
     except Exception as e:
         logger.error(f"处理MR消息时出错: {str(e)}", exc_info=True)
         raise
 
-async def handle_note(data: dict):
-    """处理评论事件"""
+async def handle_note(data: dict, replay: bool = False, dry_run: bool = False):
+    """处理评论事件(没有本地状态，replay/dry_run与handle_merge_request参数一致，不影响处理)"""
     try:
         note = data["object_attributes"]
         project = data["project"]
         mr = data['merge_request']
         target_branch = mr['target_branch']
         
+        bot_keys = await resolve_route(data, NOTE_ACTION, target_branch)
+        if not bot_keys:
+            logger.info(f"没有匹配的通知规则，跳过评论: {mr['title']}")
+            return
+        
         gitlab_link = GitlabAPI.get_merge_request_url_from_webhook(data)
         auther_id = data['merge_request']['author_id']
-        author = GitlabAPI.get_user_info(auther_id)['name']
+        GitlabAPI.cache_users_from_webhook(data)
+        author = (await GitlabAPI.get_user_info(auther_id))['name']
         if note["noteable_type"] == "MergeRequest":
             logger.info(f"处理评论事件: {note['note']}")
-            message = (
-                md("你的MR有新的评论，请及时查看").error().bold().new_line() +
-                md(f"项目: {project['name']}").quote().new_line() +
-                md(f"目标分支: {target_branch}").quote().new_line() +
-                md(f"评论内容：{note['description']}").quote().new_line() +
-                md(f"MR链接: {gitlab_link}").quote().new_line() +
-                md(f"申请人:").info().quote() + md(author).mark().new_line()
-            )
-            await WeChatBot.send_message(str(message))
+            message = templates[NOTE_ACTION].render({
+                "project": project['name'],
+                "branch": target_branch,
+                "note": note['description'],
+                "link": gitlab_link,
+                "author": author,
+            })
+            await WeChatBot.broadcast(message, bot_keys)
     except Exception as e:
         logger.error(f"处理评论消息时出错: {str(e)}", exc_info=True)
         raise
@@ -3,12 +3,30 @@ from fastapi import FastAPI, Request, HTTPException, Response, status
 from fastapi.middleware.cors import CORSMiddleware
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
-from src.tasks.mr_summary import send_mr_summary
+from apscheduler.triggers.interval import IntervalTrigger
+from datetime import datetime
+from src.tasks.mr_summary import reconcile_mr_index, send_mr_summary
 from src.config import settings
 from src.handlers import webhook_handler
-from src.utils.queue_handler import webhook_queue
-from src.utils.logger import setup_logger
+from src.utils.queue_handler import QueueFullError, webhook_queue
+from src.utils.event_journal import EventJournal
+from src.utils.mr_index import mr_index
+from src.utils.dedup import delivery_deduplicator, get_delivery_key
+from src.utils.gitlab_api import GitlabAPI, user_cache
+from src.utils.http_cache import http_cache
+from src.utils.wechat_bot import WeChatBot, wechat_dispatcher
+from src.utils.logger import setup_logger, stop_logger
+from src.utils.payload_archive import payload_archive
+from src.utils.dead_letter import KIND_EVENT, dead_letters, redact
+from src.utils.resilience import RetryableError, gitlab_breaker, wechat_breaker
+from src.utils.leader import leader_elector
+from src.utils.reminders import reminders
+from src.utils.metrics import mark_process_dead, observe_ingress, render_metrics
+from src.utils import fast_json
+from typing import Optional, Tuple
+import hmac
 import json
+import time
 
 logger = setup_logger()
 scheduler = AsyncIOScheduler()
@@ -21,8 +39,9 @@ if not settings.wechat.bot_key or settings.wechat.bot_key == "your-wechat-bot-ke
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     logger.info("启动应用")
+    # 每个worker都运行调度器，但定时任务只在持有leader租约的worker上执行
     scheduler.add_job(
-            send_mr_summary,
+            leader_elector.leader_only(send_mr_summary),
             CronTrigger(
                 day_of_week='mon',
                 hour=16,
@@ -34,8 +53,33 @@ async def lifespan(app: FastAPI):
             coalesce=True,
             max_instances=1
         )
+    if settings.index.enabled:
+        scheduler.add_job(
+            leader_elector.leader_only(reconcile_mr_index),
+            IntervalTrigger(seconds=settings.index.reconcile_interval),
+            id='mr_index_reconcile',
+            name='MR索引对账',
+            coalesce=True,
+            max_instances=1
+        )
     scheduler.start()
     logger.info("调度器已启动")
+    leader_elector.start(on_elected=on_elected)
+    
+    if settings.queue.journal_path:
+        webhook_queue.attach_journal(
+            EventJournal(
+                settings.queue.journal_path,
+                lease_seconds=settings.queue.journal_lease,
+                max_attempts=settings.queue.journal_max_attempts
+            ),
+            webhook_handler.get_event_handler,
+            dispatcher=wechat_dispatcher,
+        )
+        await webhook_queue.replay_journal()
+    
+    if reminders is not None:
+        await reminders.start()
     
     yield
     
@@ -43,9 +87,49 @@ async def lifespan(app: FastAPI):
     logger.info("应用关闭，停止调度器...")
     scheduler.shutdown()
     logger.info("调度器已停止")
+    await leader_elector.stop()
+    await webhook_queue.stop()
+    if reminders is not None:
+        await reminders.stop()
+    if webhook_queue.journal is not None:
+        webhook_queue.journal.close()
+    if mr_index is not None:
+        mr_index.close()
+    if delivery_deduplicator is not None:
+        delivery_deduplicator.close()
+    if http_cache is not None:
+        http_cache.close()
+    await GitlabAPI.close()
+    if wechat_dispatcher is not None:
+        await wechat_dispatcher.close()
+    await WeChatBot.close()
+    logger.info("HTTP连接池已关闭")
+    if dead_letters is not None:
+        dead_letters.close()
+    if payload_archive is not None:
+        payload_archive.close()
+    mark_process_dead()
+    stop_logger()
+
+def on_elected():
+    """成为leader时先对账一次，用API数据补全索引（包括上一任leader退出前遗漏的事件）"""
+    if settings.index.enabled:
+        scheduler.modify_job('mr_index_reconcile', next_run_time=datetime.now())
 
 app = FastAPI(lifespan=lifespan)
 
+# 预先序列化的固定响应体
+RESPONSE_ACCEPTED = fast_json.dumps({"status": "accepted"})
+RESPONSE_NOT_SUPPORTED = fast_json.dumps({"status": "event not supported"})
+RESPONSE_IGNORED = fast_json.dumps({"status": "ignored"})
+RESPONSE_DUPLICATE = fast_json.dumps({"status": "duplicate"})
+RESPONSE_SHED = fast_json.dumps({"status": "shed"})
+RESPONSE_QUEUE_FULL = fast_json.dumps({"status": "queue full"})
+WEBHOOK_SECRET = settings.gitlab.webhook_secret.encode("utf-8")
+
+def json_response(content: bytes, status_code: int = status.HTTP_202_ACCEPTED, headers: dict = None) -> Response:
+    return Response(content=content, media_type="application/json", status_code=status_code, headers=headers)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -54,19 +138,52 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+def verify_token(request: Request):
+    """验证 Gitlab Secret Token（常量时间比较）"""
+    gitlab_token = request.headers.get("X-Gitlab-Token", "")
+    if not hmac.compare_digest(gitlab_token.encode("utf-8"), WEBHOOK_SECRET):
+        logger.warning(f"无效的 Webhook Token: {gitlab_token}")
+        raise HTTPException(status_code=403, detail="Invalid token")
+
 @app.post("/gitlab-hook")
 async def gitlab_webhook(request: Request):
+    started_at = time.perf_counter()
+    outcome = "error"
+    try:
+        outcome, response = await handle_webhook(request)
+        return response
+    except HTTPException:
+        outcome = "unauthorized"
+        raise
+    finally:
+        observe_ingress(outcome, time.perf_counter() - started_at)
+
+async def handle_webhook(request: Request) -> Tuple[str, Response]:
+    """
+    处理webhook请求
+
+    Returns:
+        Tuple[str, Response]: (处理结果，用于统计指标, 响应)
+    """
     logger.info("收到新的 GitLab Webhook 请求")
     
-    # 验证 Gitlab Secret Token
-    gitlab_token = request.headers.get("X-Gitlab-Token")
-    if gitlab_token != settings.gitlab.webhook_secret:
-        logger.warning(f"无效的 Webhook Token: {gitlab_token}")
-        raise HTTPException(status_code=403, detail="Invalid token")
+    verify_token(request)
     
-    data = await request.json()
     event_type = request.headers.get("X-Gitlab-Event")
     
+    # 获取对应的处理函数
+    handler = webhook_handler.get_event_handler(event_type)
+    if not handler:
+        logger.warning(f"不支持的事件类型: {event_type}")
+        return "not_supported", json_response(RESPONSE_NOT_SUPPORTED)
+    
+    body = await request.body()
+    data = fast_json.loads(body)
+    
+    # 原始数据交给后台线程归档
+    if payload_archive is not None:
+        payload_archive.record(event_type, body, data)
+    
     # 调试模式日志记录
     if settings.app.debug:
         logger.debug("Webhook Headers:")
@@ -75,29 +192,159 @@ async def gitlab_webhook(request: Request):
         
         logger.debug("Webhook Data:")
         logger.debug(json.dumps(data, ensure_ascii=False, indent=2))
-        
-        from src.utils.logger import log_webhook_data
-        log_webhook_data(data, event_type)
     
     logger.info(f"处理事件类型: {event_type}")
     
-    # 获取对应的处理函数
-    handler = webhook_handler.get_event_handler(event_type)
-    if not handler:
-        logger.warning(f"不支持的事件类型: {event_type}")
-        return Response(
-            content=json.dumps({"status": "event not supported"}),
-            media_type="application/json",
-            status_code=status.HTTP_202_ACCEPTED
-        )
+    # MR状态可能已变化，被过滤的事件也要清除该MR的GitLab响应缓存
+    if http_cache is not None:
+        http_cache.invalidate_from_webhook(data)
+    
+    # 非目标分支、不发送通知的动作等在入队前直接过滤
+    ignore_reason = webhook_handler.get_ignore_reason(event_type, data)
+    if ignore_reason:
+        logger.info(f"忽略 {event_type} 事件: {ignore_reason}")
+        return "ignored", json_response(RESPONSE_IGNORED)
+    
+    # 丢弃GitLab重试或手动重发的重复投递
+    delivery_key = None
+    if delivery_deduplicator is not None:
+        delivery_key = get_delivery_key(request.headers, body)
+        if delivery_deduplicator.check_and_mark(delivery_key):
+            logger.info(f"忽略重复投递的 {event_type} 事件: {delivery_key}")
+            return "duplicate", json_response(RESPONSE_DUPLICATE)
     
     # 将任务添加到队列
-    await webhook_queue.add_task(handler, data)
+    try:
+        queued = await webhook_queue.add_task(handler, data, event_type)
+    except QueueFullError:
+        # 未接收的事件需要允许GitLab重试
+        if delivery_key is not None:
+            delivery_deduplicator.forget(delivery_key)
+        logger.warning(f"队列已满，拒绝 {event_type} 事件")
+        return "queue_full", json_response(
+            RESPONSE_QUEUE_FULL,
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            headers={"Retry-After": str(settings.queue.retry_after)}
+        )
+    
+    if not queued:
+        return "shed", json_response(RESPONSE_SHED)
     logger.info(f"成功将 {event_type} 事件添加到处理队列")
     
     # 明确返回 202 Accepted 状态码
-    return Response(
-        content=json.dumps({"status": "accepted"}),
-        media_type="application/json",
-        status_code=status.HTTP_202_ACCEPTED
-    )
\ No newline at end of file
+    return "accepted", json_response(RESPONSE_ACCEPTED)
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus指标，多worker时汇总所有进程"""
+    content, content_type = render_metrics()
+    return Response(content=content, media_type=content_type)
+
+@app.get("/leader/stats")
+async def leader_stats():
+    """定时任务leader选举状态"""
+    return await leader_elector.stats()
+
+@app.get("/reminders/stats")
+async def reminders_stats():
+    """MR超时提醒统计"""
+    return reminders.stats() if reminders is not None else {}
+
+@app.get("/queue/stats")
+async def queue_stats():
+    """队列深度与丢弃统计，用于容量规划"""
+    return webhook_queue.stats()
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """用户信息缓存、GitLab响应缓存命中统计和投递去重统计"""
+    return {
+        "user": user_cache.stats(),
+        "http": http_cache.stats() if http_cache is not None else None,
+        "dedup": delivery_deduplicator.stats() if delivery_deduplicator is not None else None,
+    }
+
+@app.get("/wechat/stats")
+async def wechat_stats():
+    """企业微信消息发送统计"""
+    return wechat_dispatcher.stats() if wechat_dispatcher is not None else {}
+
+@app.get("/archive/stats")
+async def archive_stats():
+    """webhook原始数据归档统计"""
+    return payload_archive.stats() if payload_archive is not None else {}
+
+@app.get("/resilience/stats")
+async def resilience_stats():
+    """熔断器状态和死信数量"""
+    return {
+        "gitlab": gitlab_breaker.stats(),
+        "wechat": wechat_breaker.stats(),
+        "dead_letters": dead_letters.count() if dead_letters is not None else None,
+    }
+
+def get_dead_letter_store():
+    if dead_letters is None:
+        raise HTTPException(status_code=404, detail="Dead letter store is not enabled")
+    return dead_letters
+
+@app.get("/dead-letters")
+async def list_dead_letters(request: Request, kind: Optional[str] = None, limit: int = 50, after_id: int = 0):
+    """
+    按ID顺序分页列出死信摘要，下一页传入本页最后一条的ID作为after_id
+
+    需要与webhook相同的 X-Gitlab-Token
+    """
+    verify_token(request)
+    return get_dead_letter_store().list(kind=kind, limit=min(limit, 500), after_id=after_id)
+
+@app.get("/dead-letters/{letter_id}")
+async def get_dead_letter(letter_id: int, request: Request):
+    """死信的完整数据（隐藏机器人key），需要与webhook相同的 X-Gitlab-Token"""
+    verify_token(request)
+    letter = get_dead_letter_store().get(letter_id)
+    if letter is None:
+        raise HTTPException(status_code=404, detail="Dead letter not found")
+    return redact(letter)
+
+@app.post("/dead-letters/{letter_id}/redrive")
+async def redrive_dead_letter(letter_id: int, request: Request):
+    """
+    重新投递死信：事件重新放入处理队列，企业微信消息重新发送，成功后删除死信
+
+    需要与webhook相同的 X-Gitlab-Token
+    """
+    verify_token(request)
+    store = get_dead_letter_store()
+    letter = store.get(letter_id)
+    if letter is None:
+        raise HTTPException(status_code=404, detail="Dead letter not found")
+
+    payload = letter["payload"]
+    if letter["kind"] == KIND_EVENT:
+        handler = webhook_handler.get_event_handler(letter["event_type"])
+        if handler is None:
+            raise HTTPException(status_code=400, detail=f"Unsupported event type: {letter['event_type']}")
+        try:
+            queued = await webhook_queue.add_task(handler, payload, letter["event_type"])
+        except QueueFullError:
+            raise HTTPException(status_code=503, detail="Webhook queue is full")
+        if not queued:
+            raise HTTPException(status_code=503, detail="Webhook queue is shedding")
+    else:
+        try:
+            await WeChatBot.send_message(payload["content"], payload.get("mentioned_users"), payload["bot_key"])
+        except RetryableError as e:
+            raise HTTPException(status_code=503, detail=str(e))
+
+    store.delete(letter_id)
+    logger.info(f"已重新投递死信 #{letter_id}({letter['kind']})")
+    return {"status": "redriven", "id": letter_id}
+
+@app.delete("/dead-letters/{letter_id}")
+async def delete_dead_letter(letter_id: int, request: Request):
+    """放弃死信，需要与webhook相同的 X-Gitlab-Token"""
+    verify_token(request)
+    if not get_dead_letter_store().delete(letter_id):
+        raise HTTPException(status_code=404, detail="Dead letter not found")
+    return {"status": "deleted", "id": letter_id}
@@ -0,0 +1,291 @@
+"""
+离线回放归档的webhook数据
+
+按时间顺序流式读取 PayloadArchive 的归档分段和旧版 log_webhook_data 的JSON文件，
+经过与线上相同的过滤和处理函数重新发送通知。同一MR的事件在同一通道中按序处理，
+不同MR之间并发；断点文件记录已完成且通知已发出的连续位置，中断后再次执行相同命令从断点继续。
+
+用法:
+    poetry run python -m src.replay logs/webhook_data --since 2024-06-01T08:00 --until 2024-06-01T12:00
+    poetry run python -m src.replay logs/webhook_data --project 110 --dry-run --output preview.md
+    poetry run python -m src.replay logs/webhook_data --checkpoint data/replay.ckpt --concurrency 8
+"""
+import argparse
+import asyncio
+import hashlib
+import heapq
+import json
+import logging
+import os
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
+
+root_dir = str(Path(__file__).parent.parent)
+if root_dir not in sys.path:
+    sys.path.insert(0, root_dir)
+
+from src.handlers import webhook_handler
+from src.utils.gitlab_api import GitlabAPI
+from src.utils.logger import setup_logger, stop_logger
+from src.utils.payload_archive import iter_payloads
+from src.utils.queue_handler import get_event_key
+from src.utils.wechat_bot import WeChatBot, wechat_dispatcher
+from src.utils.wechat_dispatcher import WeChatDispatcher
+
+logger = logging.getLogger(__name__)
+
+class Checkpoint:
+    """
+    回放断点
+
+    事件并发处理，完成顺序与读取顺序不同；只记录低水位(之前的事件全部完成的最大序号)，
+    恢复时跳过低水位及之前的事件，低水位之后已完成的少量事件会被重复处理。
+    启用限流分发器时，处理函数返回只代表消息已进入分发器队列：低水位要等到这些事件提交的消息
+    全部发出或转入死信后才写入断点文件，中断时仍在队列中的消息对应的事件下次会重新回放
+    """
+
+    def __init__(
+        self,
+        path: Optional[str],
+        fingerprint: str,
+        save_interval: float = 5.0,
+        dispatcher: Optional[WeChatDispatcher] = None,
+    ):
+        self.path = Path(path) if path else None
+        self.fingerprint = fingerprint
+        self.save_interval = save_interval
+        self.dispatcher = dispatcher
+        # 已确认的位置(写入断点文件)
+        self.position = -1
+        self.ts: Optional[float] = None
+        self._completed: List[Tuple[int, float]] = []
+        # (分发器提交序号, 处理完成的低水位, 时间)：提交序号之前的消息发出后才能确认对应的低水位
+        self._marks: Deque[Tuple[int, int, Optional[float]]] = deque()
+        self._saved_at = time.monotonic()
+        if self.path is not None and self.path.exists():
+            state = json.loads(self.path.read_text(encoding="utf-8"))
+            if state.get("fingerprint") != fingerprint:
+                raise ValueError(f"断点文件 {self.path} 与本次回放的数据来源或过滤条件不一致，请删除后重试或使用 --reset")
+            self.position = state["position"]
+            self.ts = state.get("ts")
+        self.processed = self.position
+        self.processed_ts = self.ts
+
+    def complete(self, seq: int, ts: float):
+        """标记事件处理完成，推进低水位"""
+        heapq.heappush(self._completed, (seq, ts))
+        while self._completed and self._completed[0][0] == self.processed + 1:
+            self.processed, self.processed_ts = heapq.heappop(self._completed)
+        if time.monotonic() - self._saved_at >= self.save_interval:
+            self.save()
+
+    def confirm(self):
+        """按分发器已发出的消息推进已确认的位置"""
+        if self.dispatcher is None:
+            self.position, self.ts = self.processed, self.processed_ts
+            return
+        if self.processed > (self._marks[-1][1] if self._marks else self.position):
+            self._marks.append((self.dispatcher.submitted, self.processed, self.processed_ts))
+        settled = self.dispatcher.settled_through()
+        while self._marks and self._marks[0][0] <= settled:
+            _, self.position, self.ts = self._marks.popleft()
+
+    def save(self):
+        self.confirm()
+        if self.path is None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        state = {"fingerprint": self.fingerprint, "position": self.position, "ts": self.ts}
+        tmp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+        tmp_path.write_text(json.dumps(state), encoding="utf-8")
+        os.replace(tmp_path, self.path)
+        self._saved_at = time.monotonic()
+
+def parse_time(value: str) -> float:
+    """解析时间参数：Unix时间戳或ISO格式（不带时区时按本地时间）"""
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+def filter_records(
+    records: Iterable[Dict[str, Any]],
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+    projects: Iterable[str] = (),
+    event_types: Iterable[str] = (),
+) -> Iterator[Dict[str, Any]]:
+    """按时间范围、项目(ID或路径)、事件类型过滤"""
+    projects = set(projects)
+    event_types = set(event_types)
+    for record in records:
+        if since is not None and record["ts"] < since:
+            continue
+        if until is not None and record["ts"] >= until:
+            # 记录按时间排序，之后的都不在范围内
+            break
+        if event_types and record["event_type"] not in event_types:
+            continue
+        if projects:
+            project = (record["data"].get("project") or {})
+            if str(project.get("id")) not in projects and project.get("path_with_namespace") not in projects:
+                continue
+        yield record
+
+def get_fingerprint(args: argparse.Namespace) -> str:
+    """数据来源和过滤条件的指纹，断点只能用于相同的回放"""
+    state = {
+        "sources": sorted(str(Path(source).resolve()) for source in args.sources),
+        "since": args.since,
+        "until": args.until,
+        "projects": sorted(args.project),
+        "event_types": sorted(args.event_type),
+    }
+    return hashlib.sha256(json.dumps(state, sort_keys=True).encode("utf-8")).hexdigest()
+
+async def replay(
+    records: Iterable[Dict[str, Any]],
+    checkpoint: Checkpoint,
+    concurrency: int = 4,
+    lane_size: int = 100,
+    max_pending_messages: int = 200,
+    dry_run: bool = False,
+) -> Dict[str, int]:
+    """
+    回放事件
+
+    每个通道是有界队列，读取速度受处理速度限制；启用限流分发器时待发送消息超过
+    max_pending_messages条后暂停读取，避免积压大量未发出的通知。
+    处理函数以回放模式调用：不设置/取消超时提醒，MR索引不被旧数据覆盖；dry_run时不修改MR索引
+
+    Returns:
+        Dict[str, int]: 回放统计
+    """
+    stats = {"replayed": 0, "failed": 0, "ignored": 0, "skipped": 0}
+    lanes: List[asyncio.Queue] = [asyncio.Queue(maxsize=lane_size) for _ in range(concurrency)]
+
+    async def process_lane(lane: asyncio.Queue):
+        while True:
+            item = await lane.get()
+            if item is None:
+                return
+            seq, record, handler = item
+            try:
+                await handler(record["data"], replay=True, dry_run=dry_run)
+                stats["replayed"] += 1
+            except Exception as e:
+                stats["failed"] += 1
+                logger.error(f"回放第 {seq} 个事件失败({record['event_type']}): {str(e)}")
+            checkpoint.complete(seq, record["ts"])
+
+    workers = [asyncio.create_task(process_lane(lane)) for lane in lanes]
+    next_lane = 0
+    started_at = time.monotonic()
+    for seq, record in enumerate(records):
+        if seq <= checkpoint.processed:
+            stats["skipped"] += 1
+            continue
+        event_type, data = record["event_type"], record["data"]
+        handler = webhook_handler.get_event_handler(event_type)
+        if handler is None or webhook_handler.get_ignore_reason(event_type, data):
+            stats["ignored"] += 1
+            checkpoint.complete(seq, record["ts"])
+            continue
+
+        while wechat_dispatcher is not None and wechat_dispatcher.pending_count() > max_pending_messages:
+            await asyncio.sleep(0.5)
+
+        # 与线上队列相同：同一MR的事件进入同一通道
+        key = get_event_key(data)
+        if key is None:
+            index = next_lane
+            next_lane = (next_lane + 1) % concurrency
+        else:
+            index = hash(key) % concurrency
+        await lanes[index].put((seq, record, handler))
+
+        if (seq + 1) % 1000 == 0:
+            rate = (seq + 1 - stats["skipped"]) / max(time.monotonic() - started_at, 1e-6)
+            logger.info(f"已读取 {seq + 1} 个事件，{rate:.0f} 个/秒，当前事件时间: {datetime.fromtimestamp(record['ts'])}")
+
+    for lane in lanes:
+        await lane.put(None)
+    await asyncio.gather(*workers)
+    return stats
+
+def make_dry_run_sink(output: TextIO):
+    """演练模式：把渲染后的消息写到输出中"""
+    def sink(content: str, mentioned_users: Optional[list], bot_key: str):
+        output.write(f"<!-- bot: {bot_key[:8]}... -->\n{content}\n\n")
+    return sink
+
+async def main(args: argparse.Namespace) -> int:
+    fingerprint = get_fingerprint(args)
+    if args.reset and args.checkpoint and Path(args.checkpoint).exists():
+        Path(args.checkpoint).unlink()
+    try:
+        # 演练模式不经过分发器，处理完成即可确认
+        checkpoint = Checkpoint(args.checkpoint, fingerprint, dispatcher=None if args.dry_run else wechat_dispatcher)
+    except ValueError as e:
+        logger.error(str(e))
+        return 2
+    if checkpoint.position >= 0:
+        resumed_at = datetime.fromtimestamp(checkpoint.ts) if checkpoint.ts else "-"
+        logger.info(f"从断点继续：跳过前 {checkpoint.position + 1} 个事件（{resumed_at}）")
+
+    output = None
+    if args.dry_run:
+        output = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+        WeChatBot.set_dry_run(make_dry_run_sink(output))
+
+    records = filter_records(
+        iter_payloads(args.sources),
+        since=parse_time(args.since) if args.since else None,
+        until=parse_time(args.until) if args.until else None,
+        projects=args.project,
+        event_types=args.event_type,
+    )
+    try:
+        stats = await replay(records, checkpoint, concurrency=args.concurrency, dry_run=args.dry_run)
+        if wechat_dispatcher is not None and not args.dry_run:
+            await wechat_dispatcher.close(timeout=args.drain_timeout)
+        checkpoint.save()
+        if checkpoint.position < checkpoint.processed:
+            logger.warning(f"仍有通知未发出，断点停在第 {checkpoint.position + 1} 个事件，再次执行会从这里继续")
+        logger.info(
+            f"回放完成：处理 {stats['replayed']} 个，失败 {stats['failed']} 个，"
+            f"忽略 {stats['ignored']} 个，断点跳过 {stats['skipped']} 个"
+        )
+        return 1 if stats["failed"] else 0
+    finally:
+        checkpoint.save()
+        await GitlabAPI.close()
+        await WeChatBot.close()
+        if output is not None and output is not sys.stdout:
+            output.close()
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("sources", nargs="+", help="归档分段、旧版JSON文件或所在目录")
+    parser.add_argument("--since", help="开始时间（包含），ISO格式或Unix时间戳")
+    parser.add_argument("--until", help="结束时间（不包含），ISO格式或Unix时间戳")
+    parser.add_argument("--project", action="append", default=[], help="只回放指定项目（ID或路径），可重复")
+    parser.add_argument("--event-type", action="append", default=[], help="只回放指定事件类型，如 \"Note Hook\"，可重复")
+    parser.add_argument("--concurrency", type=int, default=4, help="并发处理通道数")
+    parser.add_argument("--checkpoint", help="断点文件，中断后使用相同参数再次执行会从断点继续")
+    parser.add_argument("--reset", action="store_true", help="忽略并删除已有断点")
+    parser.add_argument("--dry-run", action="store_true", help="只渲染消息不发送")
+    parser.add_argument("--output", help="演练模式下消息的输出文件，默认输出到标准输出")
+    parser.add_argument("--drain-timeout", type=float, default=600, help="结束时等待限流队列中的消息发出的最长时间(秒)")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    setup_logger()
+    try:
+        sys.exit(asyncio.run(main(parse_args())))
+    finally:
+        stop_logger()
@@ -8,6 +8,15 @@ root_dir = str(Path(__file__).parent.parent)
 if root_dir not in sys.path:
     sys.path.insert(0, root_dir)
 
+# 多worker时指标需要在进程间汇总，必须在导入prometheus_client之前设置目录
+if settings.server.workers > 1 and "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+    metrics_dir = Path(root_dir) / settings.metrics.multiproc_dir
+    metrics_dir.mkdir(parents=True, exist_ok=True)
+    # 清理上次运行遗留的指标文件
+    for stale_file in metrics_dir.glob("*.db"):
+        stale_file.unlink()
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = str(metrics_dir)
+
 from main import app
 
 if __name__ == "__main__":
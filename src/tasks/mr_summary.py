@@ -1,76 +1,236 @@
+import asyncio
 from datetime import datetime
 import logging
-import re
+import time
+from typing import Dict, List, Tuple
 from src.utils.gitlab_api import GitlabAPI
 from src.utils.wechat_bot import WeChatBot
-from src.utils.markdown import md
+from src.utils.markdown import WECHAT_MARKDOWN_LIMIT, md
+from src.utils.mr_index import mr_index
+from src.utils.priority import bulk_job
+from src.utils.router import router
 from src.config import settings
 
 logger = logging.getLogger(__name__)
 
-def is_target_branch(branch_name: str) -> bool:
-    return any(re.match(pattern, branch_name) for pattern in settings.branches_regex.versions)
+# 汇总消息只需要的MR字段
+SUMMARY_FIELDS = ("iid", "project_id", "references", "title", "web_url", "target_branch", "created_at", "author")
+# 对账MR索引需要的字段
+INDEX_FIELDS = SUMMARY_FIELDS + ("state", "updated_at")
+# 拆分发送时续页标题预留的字节数
+SUMMARY_HEADER_RESERVE = 96
 
+def get_summary_sources() -> List[Tuple[str, int]]:
+    """获取周报需要统计的项目和群组列表: [("project", id), ("group", id)]"""
+    project_ids = list(settings.gitlab.project_ids)
+    if settings.gitlab.project_id is not None and settings.gitlab.project_id not in project_ids:
+        project_ids.insert(0, settings.gitlab.project_id)
+    sources = [("project", project_id) for project_id in project_ids]
+    sources.extend(("group", group_id) for group_id in settings.gitlab.group_ids)
+    return sources
+
+def get_project_name(mr: dict) -> str:
+    """从MR的引用路径(group/project!iid)中获取项目名"""
+    if mr.get('project_name'):
+        return mr['project_name']
+    full_reference = (mr.get('references') or {}).get('full') or ''
+    if '!' in full_reference:
+        return full_reference.rsplit('!', 1)[0]
+    return f"项目{mr.get('project_id')}"
+
+async def _collect_all(mrs) -> List[dict]:
+    return [mr async for mr in mrs]
+
+async def _collect_source(kind: str, source_id: int) -> List[dict]:
+    """获取单个项目或群组中目标分支的未完成MR，分页获取不完整时抛出异常，该来源计入获取失败"""
+    if kind == "group":
+        mrs = GitlabAPI.iter_group_merge_requests(source_id, state="opened", fields=SUMMARY_FIELDS)
+    else:
+        mrs = GitlabAPI.iter_project_merge_requests(source_id, state="opened", fields=SUMMARY_FIELDS)
+    return [mr async for mr in mrs if router.is_target_branch(mr.get('target_branch') or '')]
+
+def group_by_project(mrs: List[dict]) -> Dict[str, Dict[str, List[dict]]]:
+    """按项目名、目标分支分组"""
+    project_groups: Dict[str, Dict[str, List[dict]]] = {}
+    for mr in mrs:
+        branch_groups = project_groups.setdefault(get_project_name(mr), {})
+        branch_groups.setdefault(mr.get('target_branch') or '未知分支', []).append(mr)
+    return project_groups
+
+async def _collect_from_index() -> Tuple[Dict[str, Dict[str, List[dict]]], List[str]]:
+    """从MR索引中查询配置的项目和群组(按群组路径匹配)的未完成MR"""
+    project_ids = []
+    namespaces = []
+    failed_sources = []
+    for kind, source_id in get_summary_sources():
+        if kind == "project":
+            project_ids.append(source_id)
+            continue
+        try:
+            group = await GitlabAPI.get_group(source_id)
+        except Exception as e:
+            group = None
+            logger.error(f"获取group {source_id}的路径失败: {str(e)}")
+        if not group or not group.get('full_path'):
+            failed_sources.append(f"group {source_id}")
+            continue
+        namespaces.append(group['full_path'])
+    mrs = [
+        mr for mr in mr_index.open_merge_requests(project_ids, namespaces)
+        if router.is_target_branch(mr.get('target_branch') or '')
+    ]
+    return group_by_project(mrs), failed_sources
+
+async def collect_open_mrs() -> Tuple[Dict[str, Dict[str, List[dict]]], List[str]]:
+    """
+    获取所有项目/群组的未完成MR：启用MR索引时直接查询索引，否则并发扫描GitLab API
+
+    Returns:
+        Tuple: ({项目名: {分支: [MR]}}, 获取失败的来源列表)
+    """
+    if mr_index is not None:
+        return await _collect_from_index()
+
+    semaphore = asyncio.Semaphore(settings.summary.concurrency)
+
+    async def collect(kind: str, source_id: int) -> List[dict]:
+        async with semaphore:
+            return await asyncio.wait_for(_collect_source(kind, source_id), settings.summary.project_timeout)
+
+    sources = get_summary_sources()
+    results = await asyncio.gather(*(collect(kind, source_id) for kind, source_id in sources), return_exceptions=True)
+
+    mrs = []
+    failed_sources = []
+    seen = set()
+    for (kind, source_id), result in zip(sources, results):
+        if isinstance(result, BaseException):
+            reason = "超时" if isinstance(result, asyncio.TimeoutError) else str(result)
+            logger.error(f"获取{kind} {source_id}的MR失败: {reason}")
+            failed_sources.append(f"{kind} {source_id}")
+            continue
+        for mr in result:
+            # 群组与项目配置重叠时去重
+            key = (mr.get('project_id'), mr.get('iid'))
+            if key in seen:
+                continue
+            seen.add(key)
+            mrs.append(mr)
+    return group_by_project(mrs), failed_sources
+
+@bulk_job
+async def reconcile_mr_index():
+    """用GitLab API数据对账本地MR索引，修复遗漏的webhook事件"""
+    if mr_index is None:
+        return
+    semaphore = asyncio.Semaphore(settings.summary.concurrency)
+
+    async def reconcile(kind: str, source_id: int) -> int:
+        async with semaphore:
+            # 扫描期间webhook写入的记录比API数据新，对账时不覆盖、不关闭
+            started_at = time.time()
+            if kind == "group":
+                mrs = GitlabAPI.iter_group_merge_requests(source_id, state="opened", fields=INDEX_FIELDS)
+            else:
+                mrs = GitlabAPI.iter_project_merge_requests(source_id, state="opened", fields=INDEX_FIELDS)
+            # 分页获取失败或超时时抛出异常，跳过该来源，不能用不完整的列表关闭MR
+            open_mrs = await asyncio.wait_for(
+                _collect_all(mrs), settings.summary.project_timeout
+            )
+            project_ids = {mr['project_id'] for mr in open_mrs}
+            if kind == "project":
+                project_ids.add(source_id)
+            return mr_index.reconcile(project_ids, open_mrs, started_at)
+
+    sources = get_summary_sources()
+    results = await asyncio.gather(*(reconcile(kind, source_id) for kind, source_id in sources), return_exceptions=True)
+    for (kind, source_id), result in zip(sources, results):
+        if isinstance(result, BaseException):
+            logger.error(f"对账{kind} {source_id}的MR索引失败: {str(result) or type(result).__name__}")
+        elif result:
+            logger.info(f"对账{kind} {source_id}: 修正了 {result} 条已关闭的MR")
+    logger.info("MR索引对账完成")
+
+def build_summary_chunks(
+    project_groups: Dict[str, Dict[str, List[dict]]], failed_sources: List[str], now: datetime
+) -> List[str]:
+    """
+    渲染MR周报，超过企业微信消息长度上限时拆分成多条，后续消息加上续页标题
+
+    纯CPU计算，MR较多时耗时明显，在线程池中执行，避免阻塞处理webhook的事件循环
+    """
+    mr_count = sum(len(mrs) for branch_groups in project_groups.values() for mrs in branch_groups.values())
+
+    # 构建消息，在每个项目、分支和MR之前标记拆分位置
+    message = (
+        md("MR周报汇总").info().bold().new_line() +
+        md(f"统计时间: {now.strftime('%Y-%m-%d %H:%M')}").new_line() +
+        md(f"待处理MR数量: {mr_count}").new_line() +
+        md("---").new_line()
+    )
+
+    # 按项目、分支输出MR信息
+    for project_name in sorted(project_groups):
+        message.boundary()
+        message = message + md().new_line() + md(f"项目: {project_name}").info().bold().new_line()
+
+        for branch, branch_mrs in project_groups[project_name].items():
+            message.boundary()
+            message = message + md(f"分支: {branch}").bold().new_line()
+
+            # 对每个分支内的MR按时间排序，缺少创建时间的排在最后
+            branch_mrs.sort(key=lambda x: x.get('created_at') or '', reverse=True)
+
+            for mr in branch_mrs:
+                author_name = (mr.get('author') or {}).get('name', '未知作者')
+                if mr.get('created_at'):
+                    created_at = datetime.fromisoformat(mr['created_at'].replace('Z', '+00:00'))
+                    created = f"{created_at.strftime('%Y-%m-%d')} ({(now - created_at).days}天)"
+                else:
+                    created = "未知"
+
+                message.boundary()
+                message = message + (
+                    md(f"[{mr['title']}]({mr['web_url']})").new_line() +
+                    md(f"提交人: {author_name}  ").info() +
+                    md(f"创建时间: {created}").new_line()
+                )
+
+        message = message + md("---").new_line()
+
+    message.boundary()
+    if failed_sources:
+        message = message + md(f"以下来源获取失败: {', '.join(failed_sources)}").error().new_line()
+
+    # 添加提醒信息
+    message = message + md("请及时处理您负责的合并请求").warning()
+
+    chunks = message.chunks(WECHAT_MARKDOWN_LIMIT - SUMMARY_HEADER_RESERVE)
+    return [
+        str(md(f"MR周报汇总（{index + 1}/{len(chunks)}）").info().bold().new_line()) + chunk if index else chunk
+        for index, chunk in enumerate(chunks)
+    ]
+
+@bulk_job
 async def send_mr_summary():
-    """发送每周MR汇总"""
+    """发送每周MR汇总（低优先级：GitLab连接配额和消息发送都让位于实时事件）"""
     try:
-        # 获取所有项目的未完成MR
-        mrs = GitlabAPI.get_project_merge_requests(settings.gitlab.project_id, state="opened")
-        
-        # 过滤目标分支的MR
-        filtered_mrs = [mr for mr in mrs if is_target_branch(mr.get('target_branch', ''))]
-        
-        if not filtered_mrs:
+        # 并发获取所有项目的未完成MR，按项目和目标分支分组
+        project_groups, failed_sources = await collect_open_mrs()
+        if not project_groups and not failed_sources:
             logger.info("没有未完成的目标分支MR")
             return
-        
+
         # 获取当前时间
         now = datetime.now(datetime.fromisoformat('2024-01-01T00:00:00+00:00').tzinfo)
-        
-        # 构建消息
-        message = (
-            md("MR周报汇总").info().bold().new_line() +
-            md(f"统计时间: {now.strftime('%Y-%m-%d %H:%M')}").new_line() +
-            md(f"待处理MR数量: {len(filtered_mrs)}").new_line() +
-            md("---").new_line()
+        chunks = await asyncio.get_running_loop().run_in_executor(
+            None, build_summary_chunks, project_groups, failed_sources, now
         )
-        
-        # 按目标分支分组
-        branch_groups = {}
-        for mr in filtered_mrs:
-            target_branch = mr.get('target_branch', '未知分支')
-            if target_branch not in branch_groups:
-                branch_groups[target_branch] = []
-            branch_groups[target_branch].append(mr)
-        
-        # 按分支输出MR信息
-        for branch, branch_mrs in branch_groups.items():
-            message = message + md(f"\n分支: {branch}").bold().new_line()
-            
-            # 对每个分支内的MR按时间排序
-            branch_mrs.sort(key=lambda x: x['created_at'], reverse=True)
-            
-            for mr in branch_mrs:
-                created_at = datetime.fromisoformat(mr['created_at'].replace('Z', '+00:00'))
-                days_old = (now - created_at).days
-                author_name = mr.get('author', {}).get('name', '未知作者')
-                
-                mr_line = (
-                    md(f"[{mr['title']}]({mr['web_url']})").new_line() +
-                    md(f"提交人: {author_name}  ").info() +
-                    md(f"创建时间: {created_at.strftime('%Y-%m-%d')} ({days_old}天)").new_line()
-                )
-                
-                message = message + mr_line
-            
-            message = message + md("---").new_line()
-        
-        # 添加提醒信息
-        message = message + md("请及时处理您负责的合并请求").warning()
-        
-        # 发送消息
-        await WeChatBot.send_message(str(message))
+        for chunk in chunks:
+            await WeChatBot.send_message(chunk)
+        if len(chunks) > 1:
+            logger.info(f"MR周报拆分为 {len(chunks)} 条消息发送")
         logger.info("已发送MR周报")
-        
+
     except Exception as e:
         logger.error(f"发送MR周报时出错: {str(e)}", exc_info=True)
@@ -0,0 +1,120 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+from src.utils.metrics import cache_counters
+
+_MISSING = object()
+
+class TTLCache:
+    """
+    进程内TTL + LRU缓存
+
+    - 超过max_size时淘汰最久未使用的条目
+    - 加载结果为None时按negative_ttl缓存（负缓存），避免反复请求失败的数据
+    - 同一个键的并发未命中只触发一次加载(single-flight)，其余调用等待同一结果
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 3600, negative_ttl: float = 60, name: Optional[str] = None):
+        """
+        Args:
+            name: 缓存名称，设置后命中/未命中次数同时计入/metrics
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self._hit_counter, self._miss_counter = cache_counters(name) if name else (None, None)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def _lookup(self, key: Hashable) -> Any:
+        """查找未过期的缓存值，不存在返回_MISSING"""
+        entry = self._data.get(key)
+        if entry is None:
+            return _MISSING
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return _MISSING
+        self._data.move_to_end(key)
+        return value
+
+    def _count_hit(self):
+        self.hits += 1
+        if self._hit_counter is not None:
+            self._hit_counter.inc()
+
+    def _count_miss(self):
+        self.misses += 1
+        if self._miss_counter is not None:
+            self._miss_counter.inc()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """获取缓存值（不触发加载）"""
+        value = self._lookup(key)
+        if value is _MISSING:
+            self._count_miss()
+            return default
+        self._count_hit()
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """写入缓存，value为None时使用负缓存TTL"""
+        if ttl is None:
+            ttl = self.negative_ttl if value is None else self.ttl
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """获取缓存值，未命中时调用loader加载并写入缓存"""
+        value = self._lookup(key)
+        if value is not _MISSING:
+            self._count_hit()
+            return value
+        self._count_miss()
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.coalesced += 1
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await loader()
+            self.set(key, value)
+            future.set_result(value)
+            return value
+        except BaseException as e:
+            future.set_exception(e)
+            # 没有其他等待者时避免 "exception was never retrieved" 警告
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存命中统计"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
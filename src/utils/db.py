@@ -0,0 +1,16 @@
+import sqlite3
+from pathlib import Path
+
+def connect(path: str, busy_timeout: int = 5000) -> sqlite3.Connection:
+    """
+    打开SQLite数据库(WAL模式)，可被同一主机上的多个进程共享
+
+    WAL模式下读写互不阻塞；synchronous=NORMAL 只在检查点时fsync，
+    进程崩溃不会丢失已提交的数据，同时把磁盘同步合并成批量操作
+    """
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(path, timeout=busy_timeout / 1000, isolation_level=None, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={busy_timeout}")
+    return conn
@@ -0,0 +1,129 @@
+import json
+import logging
+import re
+import time
+from typing import Any, Dict, List, Optional
+from src.config import settings
+from src.utils.db import connect
+
+logger = logging.getLogger(__name__)
+
+# 死信类型：队列中的webhook事件、分发器中的企业微信消息
+KIND_EVENT = "event"
+KIND_WECHAT = "wechat"
+
+# 接口返回死信时隐藏的字段，以及错误信息、消息内容中企业微信webhook地址里的key
+SECRET_FIELDS = frozenset({"bot_key"})
+_WEBHOOK_KEY = re.compile(r"([?&]key=)[^&\s\"'<>]+")
+
+def redact(value: Any) -> Any:
+    """隐藏机器人key等敏感信息，与调试日志中的配置一样替换为***"""
+    if isinstance(value, dict):
+        return {key: "***" if key in SECRET_FIELDS else redact(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [redact(item) for item in value]
+    if isinstance(value, str):
+        return _WEBHOOK_KEY.sub(r"\1***", value)
+    return value
+
+class DeadLetterStore:
+    """
+    死信存储(SQLite)
+
+    重试次数用完仍失败的事件/消息保存在这里，可以通过接口查看并重新投递(redrive)，
+    上游故障期间的失败不会丢失，也不会一直占用队列
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = connect(path)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS dead_letters (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                event_type TEXT,
+                payload TEXT NOT NULL,
+                error TEXT,
+                attempts INTEGER NOT NULL,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_dead_letters_kind ON dead_letters (kind, id)")
+        logger.info(f"死信存储已打开: {path}")
+
+    def add(self, kind: str, payload: Any, error: str, attempts: int, event_type: Optional[str] = None) -> int:
+        """保存一条死信，返回ID"""
+        cursor = self._conn.execute(
+            "INSERT INTO dead_letters (kind, event_type, payload, error, attempts, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (kind, event_type, json.dumps(payload, ensure_ascii=False), error, attempts, time.time()),
+        )
+        logger.error(f"已转入死信({kind} {event_type or ''}) #{cursor.lastrowid}，重试 {attempts} 次后仍失败: {error}")
+        return cursor.lastrowid
+
+    @staticmethod
+    def _summary(kind: str, payload: dict) -> Dict[str, Any]:
+        """列表中展示的摘要，不返回完整数据"""
+        if kind == KIND_WECHAT:
+            return {"content": (payload.get("content") or "")[:80]}
+        mr = payload.get("merge_request") or payload.get("object_attributes") or {}
+        return {
+            "project": (payload.get("project") or {}).get("path_with_namespace"),
+            "iid": mr.get("iid"),
+            "action": (payload.get("object_attributes") or {}).get("action"),
+        }
+
+    def list(self, kind: Optional[str] = None, limit: int = 50, after_id: int = 0) -> List[Dict[str, Any]]:
+        """按ID顺序列出死信摘要(已隐藏敏感信息)"""
+        sql = "SELECT id, kind, event_type, payload, error, attempts, created_at FROM dead_letters WHERE id > ?"
+        params: list = [after_id]
+        if kind:
+            sql += " AND kind = ?"
+            params.append(kind)
+        rows = self._conn.execute(sql + " ORDER BY id LIMIT ?", (*params, limit))
+        return [
+            redact({
+                "id": letter_id,
+                "kind": letter_kind,
+                "event_type": event_type,
+                "error": error,
+                "attempts": attempts,
+                "created_at": created_at,
+                **self._summary(letter_kind, json.loads(payload)),
+            })
+            for letter_id, letter_kind, event_type, payload, error, attempts, created_at in rows
+        ]
+
+    def get(self, letter_id: int) -> Optional[Dict[str, Any]]:
+        """获取一条死信的完整数据(包括机器人key，用于重新投递；返回给接口前需要redact)"""
+        row = self._conn.execute(
+            "SELECT id, kind, event_type, payload, error, attempts, created_at FROM dead_letters WHERE id = ?",
+            (letter_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        letter_id, kind, event_type, payload, error, attempts, created_at = row
+        return {
+            "id": letter_id,
+            "kind": kind,
+            "event_type": event_type,
+            "payload": json.loads(payload),
+            "error": error,
+            "attempts": attempts,
+            "created_at": created_at,
+        }
+
+    def delete(self, letter_id: int) -> bool:
+        return self._conn.execute("DELETE FROM dead_letters WHERE id = ?", (letter_id,)).rowcount > 0
+
+    def count(self) -> Dict[str, int]:
+        """按类型统计死信数量"""
+        return dict(self._conn.execute("SELECT kind, COUNT(*) FROM dead_letters GROUP BY kind").fetchall())
+
+    def close(self):
+        self._conn.close()
+
+dead_letters: Optional[DeadLetterStore] = (
+    DeadLetterStore(settings.resilience.dead_letter_path) if settings.resilience.dead_letter_path else None
+)
@@ -0,0 +1,112 @@
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Mapping, Optional
+from src.config import settings
+from src.utils.db import connect
+from src.utils.metrics import cache_counters
+
+logger = logging.getLogger(__name__)
+
+# 按优先级排列的投递ID请求头：GitLab重试/手动重发时保持不变
+DELIVERY_ID_HEADERS = ("Idempotency-Key", "X-Gitlab-Event-UUID")
+
+def get_delivery_key(headers: Mapping[str, str], body: bytes) -> str:
+    """获取webhook投递的唯一键，没有投递ID时使用请求体的哈希"""
+    for header in DELIVERY_ID_HEADERS:
+        value = headers.get(header)
+        if value:
+            return f"{header}:{value}"
+    event_type = headers.get("X-Gitlab-Event", "")
+    return "sha256:" + hashlib.sha256(event_type.encode("utf-8") + b"\0" + body).hexdigest()
+
+class DeliveryDeduplicator:
+    """
+    webhook投递去重
+
+    本地使用按时间排序的LRU(OrderedDict)：检查、记录、过期淘汰均为O(1)，最多保留max_size个键，
+    超过window秒的记录自动过期。配置shared_path后额外使用SQLite表在同一主机的worker之间共享去重状态
+    """
+
+    def __init__(self, window: float = 3600, max_size: int = 10000, shared_path: Optional[str] = None):
+        self.window = window
+        self.max_size = max_size
+        self.duplicate_count = 0
+        self._seen: "OrderedDict[str, float]" = OrderedDict()
+        self._conn = None
+        self._writes = 0
+        self._duplicate_counter, self._new_counter = cache_counters("dedup")
+        if shared_path:
+            self._conn = connect(shared_path)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS deliveries (key TEXT PRIMARY KEY, seen_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_deliveries_seen_at ON deliveries (seen_at)")
+
+    def _expire(self, now: float):
+        """淘汰过期和超出容量的本地记录"""
+        cutoff = now - self.window
+        while self._seen:
+            key, seen_at = next(iter(self._seen.items()))
+            if seen_at >= cutoff and len(self._seen) <= self.max_size:
+                break
+            self._seen.popitem(last=False)
+
+    def _check_shared(self, key: str, now: float) -> bool:
+        """在共享表中检查并记录，已存在且未过期返回True"""
+        cursor = self._conn.execute(
+            """
+            INSERT INTO deliveries (key, seen_at) VALUES (?, ?)
+            ON CONFLICT (key) DO UPDATE SET seen_at = excluded.seen_at WHERE deliveries.seen_at < ?
+            """,
+            (key, now, now - self.window),
+        )
+        self._writes += 1
+        if self._writes % 1000 == 0:
+            self._conn.execute("DELETE FROM deliveries WHERE seen_at < ?", (now - self.window,))
+        return cursor.rowcount == 0
+
+    def check_and_mark(self, key: str) -> bool:
+        """
+        检查投递是否重复，不重复时记录下来
+
+        Returns:
+            bool: 重复投递返回True
+        """
+        now = time.time()
+        self._expire(now)
+        duplicate = key in self._seen
+        if not duplicate and self._conn is not None:
+            duplicate = self._check_shared(key, now)
+        if duplicate:
+            self.duplicate_count += 1
+            self._duplicate_counter.inc()
+            return True
+        self._new_counter.inc()
+        self._seen[key] = now
+        self._expire(now)
+        return False
+
+    def forget(self, key: str):
+        """撤销记录（事件未被接收，需要允许GitLab重试）"""
+        self._seen.pop(key, None)
+        if self._conn is not None:
+            self._conn.execute("DELETE FROM deliveries WHERE key = ?", (key,))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": len(self._seen),
+            "max_size": self.max_size,
+            "duplicates": self.duplicate_count,
+        }
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+
+delivery_deduplicator: Optional[DeliveryDeduplicator] = DeliveryDeduplicator(
+    window=settings.dedup.window,
+    max_size=settings.dedup.max_size,
+    shared_path=settings.dedup.shared_path,
+) if settings.dedup.enabled else None
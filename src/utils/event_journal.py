@@ -0,0 +1,132 @@
+import json
+import logging
+import os
+import socket
+import time
+from typing import Iterable, List, Tuple
+from src.utils.db import connect
+
+logger = logging.getLogger(__name__)
+
+_HOSTNAME = socket.gethostname()
+
+def _owner_is_dead(owner: str) -> bool:
+    """判断事件持有者是否为本机上已退出的进程"""
+    host, _, pid = owner.rpartition(":")
+    if host != _HOSTNAME or not pid.isdigit():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        return False
+    return False
+
+class EventJournal:
+    """
+    基于SQLite(WAL)的持久化事件日志，同一主机上的所有uvicorn worker共享
+
+    事件入队前先写入日志并由当前进程持有(租约)，handler成功或最终失败(转入死信、放弃)后删除(ack)；
+    持有进程需要在租约过期前续约(renew)，持有进程退出、停止时释放或租约过期的事件会被重新认领并重放，实现至少一次投递
+    """
+
+    def __init__(self, path: str, lease_seconds: float = 300, max_attempts: int = 5):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.owner = f"{_HOSTNAME}:{os.getpid()}"
+        self._conn = connect(path)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                event_type TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                owner TEXT NOT NULL,
+                claimed_at REAL NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 1
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_events_claimed_at ON events (claimed_at)")
+        logger.info(f"事件日志已打开: {path}")
+
+    def append(self, event_type: str, data: dict) -> int:
+        """写入新事件并由当前进程持有，返回事件ID"""
+        now = time.time()
+        cursor = self._conn.execute(
+            "INSERT INTO events (event_type, payload, created_at, owner, claimed_at) VALUES (?, ?, ?, ?, ?)",
+            (event_type, json.dumps(data, ensure_ascii=False), now, self.owner, now),
+        )
+        return cursor.lastrowid
+
+    def ack(self, event_id: int):
+        """事件处理成功后删除"""
+        self._conn.execute("DELETE FROM events WHERE id = ?", (event_id,))
+
+    def release(self, event_id: int):
+        """停止时释放仍未处理完的事件，其他worker或重启后立即认领"""
+        self._conn.execute("UPDATE events SET owner = '', claimed_at = 0 WHERE id = ?", (event_id,))
+
+    def renew(self, event_ids: Iterable[int]):
+        """续约当前进程持有的事件，避免排队或等待重试期间被其他worker认领"""
+        event_ids = list(event_ids)
+        now = time.time()
+        for start in range(0, len(event_ids), 500):
+            batch = event_ids[start:start + 500]
+            self._conn.execute(
+                f"UPDATE events SET claimed_at = ? WHERE owner = ? AND id IN ({','.join('?' * len(batch))})",
+                (now, self.owner, *batch),
+            )
+
+    def pending_count(self) -> int:
+        """日志中尚未确认的事件数"""
+        return self._conn.execute("SELECT COUNT(*) FROM events").fetchone()[0]
+
+    def claim_orphans(self, limit: int = 1000) -> List[Tuple[int, str, dict]]:
+        """
+        认领已释放、持有者已退出或租约过期的事件
+
+        Returns:
+            List[Tuple[int, str, dict]]: (事件ID, 事件类型, 事件数据)，按写入顺序排列
+        """
+        now = time.time()
+        owners = [row[0] for row in self._conn.execute("SELECT DISTINCT owner FROM events WHERE owner != ?", (self.owner,))]
+        dead_owners = [owner for owner in owners if _owner_is_dead(owner)]
+
+        conditions = ["claimed_at < ?"]
+        params: list = [now - self.lease_seconds]
+        if dead_owners:
+            conditions.append(f"owner IN ({','.join('?' * len(dead_owners))})")
+            params.extend(dead_owners)
+        # 当前进程仍持有的事件正在内存队列中，不重复认领
+        where = f"owner != ? AND ({' OR '.join(conditions)})"
+        params.insert(0, self.owner)
+
+        claimed = []
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = self._conn.execute(
+                f"SELECT id, event_type, payload, attempts FROM events WHERE {where} ORDER BY id LIMIT ?",
+                (*params, limit),
+            ).fetchall()
+            for event_id, event_type, payload, attempts in rows:
+                if attempts >= self.max_attempts:
+                    logger.error(f"事件 {event_id}({event_type}) 已重试 {attempts} 次仍失败，放弃处理")
+                    self._conn.execute("DELETE FROM events WHERE id = ?", (event_id,))
+                    continue
+                self._conn.execute(
+                    "UPDATE events SET owner = ?, claimed_at = ?, attempts = attempts + 1 WHERE id = ?",
+                    (self.owner, now, event_id),
+                )
+                claimed.append((event_id, event_type, json.loads(payload)))
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+        return claimed
+
+    def close(self):
+        self._conn.close()
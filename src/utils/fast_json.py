@@ -0,0 +1,20 @@
+import json
+from typing import Any, Union
+
+# orjson为可选依赖(poetry install -E fast)，未安装时回退到标准库json
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+def loads(data: Union[bytes, str]) -> Any:
+    """解析JSON"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def dumps(obj: Any) -> bytes:
+    """序列化为UTF-8编码的JSON"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
@@ -1,8 +1,34 @@
+import asyncio
 import datetime
-from typing import Any, Dict, List, Optional
-from fastapi import logger
-import requests
+import logging
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Dict, List, Mapping, Optional, Sequence, Tuple
+import httpx
 from src.config import settings
+from src.utils.http_client import create_async_client
+from src.utils.cache import TTLCache
+from src.utils.http_cache import CachedResponse, http_cache
+from src.utils.metrics import observe_gitlab
+from src.utils.priority import is_bulk
+from src.utils.resilience import RetryableError, gitlab_breaker
+
+logger = logging.getLogger(__name__)
+
+_client: Optional[httpx.AsyncClient] = None
+# 批量事件和后台任务共用的连接配额，周报扫描时实时事件的请求不需要排队等连接
+_bulk_semaphore: Optional[asyncio.Semaphore] = None
+
+# 用户信息缓存：用户名几乎不变，避免每个事件都请求一次GitLab
+user_cache = TTLCache(
+    max_size=settings.cache.user_max_size,
+    ttl=settings.cache.user_ttl,
+    negative_ttl=settings.cache.user_negative_ttl,
+    name="user",
+)
+
+# 条件请求返回304(缓存的数据仍然有效)
+NOT_MODIFIED = object()
 
 class GitLabAPIError(Exception):
     """GitLab API 异常基类"""
@@ -10,43 +36,261 @@ class GitLabAPIError(Exception):
 
 class GitlabAPI:
     @staticmethod
-    def _make_request(method: str, endpoint: str, params: dict = None, headers: dict = None) -> Optional[dict]:
+    def _get_client() -> httpx.AsyncClient:
+        """获取共享的GitLab连接池客户端（首次调用时创建）"""
+        global _client
+        if _client is None or _client.is_closed:
+            _client = create_async_client(
+                timeout=settings.gitlab.timeout,
+                connect_timeout=settings.gitlab.connect_timeout,
+                max_connections=settings.gitlab.max_connections,
+                max_keepalive_connections=settings.gitlab.max_keepalive_connections,
+                http2=settings.gitlab.http2,
+            )
+        return _client
+
+    @staticmethod
+    async def _send(method: str, url: str, headers: dict, params: Optional[dict]) -> httpx.Response:
+        """发送请求，低优先级的请求最多占用bulk_max_connections个连接"""
+        if not is_bulk():
+            return await GitlabAPI._get_client().request(method, url, headers=headers, params=params)
+        global _bulk_semaphore
+        if _bulk_semaphore is None:
+            _bulk_semaphore = asyncio.Semaphore(settings.gitlab.bulk_max_connections)
+        async with _bulk_semaphore:
+            return await GitlabAPI._get_client().request(method, url, headers=headers, params=params)
+
+    @staticmethod
+    async def close():
+        """关闭共享客户端，释放连接池"""
+        global _client
+        if _client is not None:
+            await _client.aclose()
+            _client = None
+
+    @staticmethod
+    async def _make_request(method: str, endpoint: str, params: dict = None, headers: dict = None) -> Optional[dict]:
         """
         发送请求到GitLab API
         
         Returns:
             Optional[dict]: 成功返回响应数据，失败返回None
+
+        Raises:
+            RetryableError: 超时、网络错误、429/5xx或熔断中，调用方应稍后重试
         """
+        if method == "GET" and http_cache is not None:
+            ttl = http_cache.ttl_for(endpoint)
+            if ttl is not None:
+                return await GitlabAPI._cached_get(endpoint, params, headers, ttl)
+        result, _ = await GitlabAPI._make_request_with_headers(method, endpoint, params, headers)
+        return result
+
+    @staticmethod
+    async def _cached_get(endpoint: str, params: Optional[dict], headers: Optional[dict], ttl: float) -> Optional[Any]:
+        """
+        通过响应缓存发送GET请求
+
+        TTL内直接返回缓存；过期后带上ETag/Last-Modified发送条件请求，304时继续使用缓存的数据。
+        stale_if_error开启时，GitLab暂时不可用则返回已缓存的数据，不抛出RetryableError
+        """
+        key = http_cache.make_key(endpoint, params)
+        entry: Optional[CachedResponse] = http_cache.get(key)
+        if entry is not None and entry.fresh_until > time.time():
+            http_cache.count_hit()
+            return entry.value
+
+        request_headers = dict(headers or {})
+        request_headers.update(http_cache.conditional_headers(entry))
+        try:
+            result, response_headers = await GitlabAPI._make_request_with_headers("GET", endpoint, params, request_headers)
+        except RetryableError as e:
+            if entry is None or not http_cache.stale_if_error:
+                raise
+            logger.warning(f"GitLab暂时不可用，使用缓存的响应: {endpoint} ({str(e)})")
+            http_cache.count_stale()
+            return entry.value
+
+        if result is NOT_MODIFIED:
+            if entry is None:
+                return None
+            http_cache.refresh(key, entry, ttl)
+            http_cache.count_hit(revalidated=True)
+            return entry.value
+        http_cache.count_miss()
+        if result is not None:
+            http_cache.store(key, result, response_headers, ttl)
+        elif entry is not None:
+            # 资源已删除或无权限访问(4xx)，不再使用旧数据
+            http_cache.invalidate(key)
+        return result
+
+    @staticmethod
+    async def _make_request_with_headers(
+        method: str, endpoint: str, params: dict = None, headers: dict = None
+    ) -> Tuple[Optional[Any], Mapping[str, str]]:
+        """
+        发送请求到GitLab API，同时返回响应头（用于读取分页信息）
+
+        4xx等重试也不会成功的错误返回(None, {})；GitLab暂时不可用时抛出RetryableError，
+        并计入熔断器，熔断期间不再发出请求直接抛出CircuitOpenError
+        
+        Returns:
+            Tuple[Optional[Any], Mapping[str, str]]: (响应数据, 响应头)，失败时为(None, {})
+
+        Raises:
+            RetryableError: 超时、网络错误、429/5xx或熔断中
+        """
+        gitlab_breaker.before_call()
         if headers is None:
             headers = {}
         headers["PRIVATE-TOKEN"] = settings.gitlab.access_token
         
         url = f"{settings.gitlab.api_url}/{endpoint.lstrip('/')}"
         
+        started_at = time.perf_counter()
         try:
-            response = requests.request(method, url, headers=headers, params=params)
+            response = await GitlabAPI._send(method, url, headers, params)
+            if response.status_code == 304:
+                observe_gitlab(endpoint, time.perf_counter() - started_at)
+                gitlab_breaker.record_success()
+                return NOT_MODIFIED, response.headers
             response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
+            result = response.json(), response.headers
+            observe_gitlab(endpoint, time.perf_counter() - started_at)
+            gitlab_breaker.record_success()
+            return result
+        except httpx.HTTPStatusError as e:
+            status_code = e.response.status_code
+            observe_gitlab(endpoint, time.perf_counter() - started_at, f"http_{status_code}")
+            logger.error(f"GitLab API请求失败: {str(e)}, URL: {url}, Method: {method}")
+            logger.error(f"请求参数: {params}")
+            if status_code == 429 or status_code >= 500:
+                gitlab_breaker.record_failure()
+                retry_after = e.response.headers.get("Retry-After", "")
+                raise RetryableError(
+                    f"GitLab API返回 {status_code}: {endpoint}",
+                    retry_after=float(retry_after) if retry_after.isdigit() else None,
+                ) from e
+            # 4xx说明GitLab本身正常
+            gitlab_breaker.record_success()
+            return None, {}
+        except httpx.HTTPError as e:
+            reason = "timeout" if isinstance(e, httpx.TimeoutException) else "network"
+            observe_gitlab(endpoint, time.perf_counter() - started_at, reason)
             logger.error(f"GitLab API请求失败: {str(e)}, URL: {url}, Method: {method}")
             logger.error(f"请求参数: {params}")
-            return None
+            gitlab_breaker.record_failure()
+            raise RetryableError(f"GitLab API请求失败({reason}): {endpoint}") from e
         except ValueError as e:  # JSON解析错误
+            observe_gitlab(endpoint, time.perf_counter() - started_at, "decode")
             logger.error(f"GitLab API响应解析失败: {str(e)}")
-            return None
+            gitlab_breaker.record_success()
+            return None, {}
         except Exception as e:
+            observe_gitlab(endpoint, time.perf_counter() - started_at, "other")
             logger.error(f"GitLab API未知错误: {str(e)}")
-            return None
+            gitlab_breaker.record_failure()
+            return None, {}
+        except asyncio.CancelledError:
+            # 超时或窗口中的分页请求被取消，没有结果
+            gitlab_breaker.release()
+            raise
 
     @staticmethod
-    def get_user_info(user_id: int) -> Optional[dict]:
-        """获取GitLab用户信息"""
-        result = GitlabAPI._make_request("GET", f"/users/{user_id}")
+    async def _iter_pages(
+        endpoint: str,
+        params: dict,
+        fields: Optional[Sequence[str]] = None,
+        concurrency: int = 4,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        流式遍历分页接口的全部数据
+
+        响应带有X-Total-Pages时，以最多concurrency个请求的滑动窗口并发获取剩余页并按页序输出；
+        总数未知时（GitLab对超过1万条的集合不返回总数）按X-Next-Page顺序翻页
+
+        Args:
+            fields: 只保留指定字段，减少内存占用
+
+        Raises:
+            GitLabAPIError: 任意一页获取失败，已输出的数据不完整，调用方不能把它当作全部数据
+            RetryableError: GitLab暂时不可用
+        """
+        def project(items: list):
+            if fields is None:
+                return items
+            return [{key: item.get(key) for key in fields} for item in items]
+
+        async def fetch(page: int) -> Tuple[Optional[list], Mapping[str, str]]:
+            return await GitlabAPI._make_request_with_headers("GET", endpoint, params={**params, "page": page})
+
+        items, headers = await fetch(1)
+        if items is None:
+            raise GitLabAPIError(f"获取分页数据失败，接口: {endpoint}, 页码: 1")
+        for item in project(items):
+            yield item
+
+        total_pages = headers.get("X-Total-Pages", "")
+        if total_pages.isdigit():
+            pages = iter(range(2, int(total_pages) + 1))
+            window = deque()
+            for page in pages:
+                window.append(asyncio.ensure_future(fetch(page)))
+                if len(window) >= concurrency:
+                    break
+            try:
+                page = 2
+                while window:
+                    items, _ = await window.popleft()
+                    if items is None:
+                        raise GitLabAPIError(f"获取分页数据失败，接口: {endpoint}, 页码: {page}")
+                    page += 1
+                    next_page = next(pages, None)
+                    if next_page is not None:
+                        window.append(asyncio.ensure_future(fetch(next_page)))
+                    for item in project(items):
+                        yield item
+            finally:
+                for task in window:
+                    task.cancel()
+        else:
+            next_page = headers.get("X-Next-Page", "")
+            while next_page.isdigit():
+                items, headers = await fetch(int(next_page))
+                if items is None:
+                    raise GitLabAPIError(f"获取分页数据失败，接口: {endpoint}, 页码: {next_page}")
+                for item in project(items):
+                    yield item
+                next_page = headers.get("X-Next-Page", "")
+
+    @staticmethod
+    async def get_user_info(user_id: int) -> Optional[dict]:
+        """
+        获取GitLab用户信息（优先使用缓存）
+
+        用户不存在时返回默认值；GitLab暂时不可用时抛出RetryableError，由队列稍后重试整个事件，
+        不发送带有"未知用户"的通知
+        """
+        result = await user_cache.get_or_load(
+            user_id,
+            lambda: GitlabAPI._make_request("GET", f"/users/{user_id}")
+        )
         if result is None:
             logger.warning(f"获取用户信息失败，用户ID: {user_id}")
             return {"name": "未知用户"}  # 返回默认值而不是None
         return result
 
+    @staticmethod
+    def cache_users_from_webhook(webhook_data: dict):
+        """将webhook数据中已包含的用户信息(user/assignees/reviewers)写入缓存"""
+        users = [webhook_data.get('user')]
+        users.extend(webhook_data.get('assignees') or [])
+        users.extend(webhook_data.get('reviewers') or [])
+        for user in users:
+            if user and user.get('id') is not None and user.get('name'):
+                user_cache.set(user['id'], user)
+
     @staticmethod
     def get_merge_request_url_from_webhook(webhook_data: dict) -> str:
         """从webhook数据中获取合并请求的URL"""
@@ -63,49 +307,101 @@ class GitlabAPI:
             return f"{settings.gitlab.url}"  # 返回基础URL而不是失败
     
     @staticmethod
-    def get_project_merge_requests(project_id: int, state: str = "opened", created_after: datetime = None) -> List[Dict[str, Any]]:
-        """获取项目的合并请求列表"""
-        if created_after is None:
-            created_after = datetime.datetime.now() - datetime.timedelta(days=30)
-        
+    async def _iter_merge_requests(
+        endpoint: str,
+        state: str = "opened",
+        target_branch: Optional[str] = None,
+        created_after: Optional[datetime.datetime] = None,
+        updated_after: Optional[datetime.datetime] = None,
+        fields: Optional[Sequence[str]] = None,
+        per_page: int = 100,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """流式获取合并请求列表接口的全部数据，任意一页失败时抛出GitLabAPIError"""
         params = {
             "state": state,
-            "created_after": created_after.isoformat(),
             "order_by": "created_at",
             "sort": "desc",
-            "per_page": 100
+            "per_page": per_page
         }
-        
-        result = GitlabAPI._make_request("GET", f"/projects/{project_id}/merge_requests", params=params)
+        if target_branch:
+            params["target_branch"] = target_branch
+        if created_after:
+            params["created_after"] = created_after.isoformat()
+        if updated_after:
+            params["updated_after"] = updated_after.isoformat()
+
+        async for mr in GitlabAPI._iter_pages(
+            endpoint,
+            params,
+            fields=fields,
+            concurrency=settings.gitlab.page_concurrency,
+        ):
+            yield mr
+
+    @staticmethod
+    def iter_project_merge_requests(project_id: int, **kwargs) -> AsyncIterator[Dict[str, Any]]:
+        """
+        流式获取项目的全部合并请求（自动翻页）
+
+        Args:
+            state/target_branch/created_after/updated_after: GitLab服务端过滤条件
+            fields: 只保留指定字段
+        """
+        return GitlabAPI._iter_merge_requests(f"/projects/{project_id}/merge_requests", **kwargs)
+
+    @staticmethod
+    def iter_group_merge_requests(group_id: int, **kwargs) -> AsyncIterator[Dict[str, Any]]:
+        """流式获取群组（含子群组）下所有项目的合并请求，参数同iter_project_merge_requests"""
+        return GitlabAPI._iter_merge_requests(f"/groups/{group_id}/merge_requests", **kwargs)
+
+    @staticmethod
+    async def get_group(group_id: int) -> Optional[Dict[str, Any]]:
+        """获取群组信息(不含项目列表)，群组不存在或无权限时返回None"""
+        result = await GitlabAPI._make_request("GET", f"/groups/{group_id}", params={"with_projects": "false"})
         if result is None:
-            logger.warning(f"获取项目MR列表失败，项目ID: {project_id}")
-            return []  # 返回空列表而不是None
+            logger.warning(f"获取群组信息失败，群组ID: {group_id}")
+        return result
+
+    @staticmethod
+    async def get_project_merge_requests(project_id: int, state: str = "opened", created_after: datetime = None) -> List[Dict[str, Any]]:
+        """
+        获取项目的合并请求列表（包含所有分页）
+
+        Raises:
+            GitLabAPIError: 部分分页获取失败，不返回不完整的列表
+        """
+        if created_after is None:
+            created_after = datetime.datetime.now() - datetime.timedelta(days=30)
+        
+        result = [
+            mr async for mr in GitlabAPI.iter_project_merge_requests(project_id, state=state, created_after=created_after)
+        ]
         if settings.app.debug:
             logger.info(f"获取项目MR列表成功，项目ID: {project_id}, MR列表: {result}")
         return result
     
     @staticmethod
-    def get_merge_request_details(project_id: int, mr_iid: int) -> Optional[Dict[str, Any]]:
+    async def get_merge_request_details(project_id: int, mr_iid: int) -> Optional[Dict[str, Any]]:
         """获取特定合并请求的详细信息"""
-        result = GitlabAPI._make_request("GET", f"/projects/{project_id}/merge_requests/{mr_iid}")
+        result = await GitlabAPI._make_request("GET", f"/projects/{project_id}/merge_requests/{mr_iid}")
         if result is None:
             logger.warning(f"获取MR详情失败，项目ID: {project_id}, MR IID: {mr_iid}")
             return {}  # 返回空字典而不是None
         return result
     
     @staticmethod
-    def get_merge_request_changes(project_id: int, mr_iid: int) -> Optional[Dict[str, Any]]:
+    async def get_merge_request_changes(project_id: int, mr_iid: int) -> Optional[Dict[str, Any]]:
         """获取合并请求的变更内容"""
-        result = GitlabAPI._make_request("GET", f"/projects/{project_id}/merge_requests/{mr_iid}/changes")
+        result = await GitlabAPI._make_request("GET", f"/projects/{project_id}/merge_requests/{mr_iid}/changes")
         if result is None:
             logger.warning(f"获取MR变更内容失败，项目ID: {project_id}, MR IID: {mr_iid}")
             return {}  # 返回空字典而不是None
         return result
     
     @staticmethod
-    def get_merge_request_approvals(project_id: int, mr_iid: int) -> Optional[Dict[str, Any]]:
+    async def get_merge_request_approvals(project_id: int, mr_iid: int) -> Optional[Dict[str, Any]]:
         """获取合并请求的审批状态"""
-        result = GitlabAPI._make_request("GET", f"/projects/{project_id}/merge_requests/{mr_iid}/approvals")
+        result = await GitlabAPI._make_request("GET", f"/projects/{project_id}/merge_requests/{mr_iid}/approvals")
         if result is None:
             logger.warning(f"获取MR审批状态失败，项目ID: {project_id}, MR IID: {mr_iid}")
             return {"approved": False}  # 返回默认值而不是None
@@ -113,6 +409,7 @@ class GitlabAPI:
     
 
 if __name__ == "__main__":
+    import asyncio
     import sys
     from pathlib import Path
     
@@ -127,7 +424,7 @@ if __name__ == "__main__":
     
     # 测试获取MR列表
     project_id = 266  # 替换为您的项目ID
-    mrs = GitlabAPI.get_project_merge_requests(project_id)
+    mrs = asyncio.run(GitlabAPI.get_project_merge_requests(project_id))
     
     print("\n=== 最近一个月的开放MR列表 ===")
     for mr in mrs:
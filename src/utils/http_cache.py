@@ -0,0 +1,294 @@
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, Mapping, Optional, Set
+from urllib.parse import urlencode
+from src.config import settings
+from src.utils import fast_json
+from src.utils.db import connect
+from src.utils.metrics import cache_counters, gitlab_endpoint
+
+logger = logging.getLogger(__name__)
+
+class CachedResponse:
+    """缓存的GET响应：解析后的数据和用于条件请求的校验器"""
+    __slots__ = ("value", "etag", "last_modified", "fresh_until", "size", "stored_at")
+
+    def __init__(self, value: Any, etag: Optional[str], last_modified: Optional[str], fresh_until: float, size: int):
+        self.value = value
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fresh_until = fresh_until
+        self.size = size
+        self.stored_at = time.time()
+
+def _ancestors(key: str) -> Iterator[str]:
+    """缓存键对应路径的所有上级路径: /projects/1/merge_requests/2/changes -> /projects/1/merge_requests/2, ..."""
+    path = key.split("?", 1)[0]
+    while path:
+        yield path
+        path = path.rsplit("/", 1)[0]
+
+class ResponseCache:
+    """
+    GitLab GET接口的条件请求缓存
+
+    只缓存ttl_policies中配置了TTL的接口(按 /projects/:id/... 形式的路径匹配)：TTL内直接返回缓存，
+    过期后带If-None-Match/If-Modified-Since重新验证，GitLab返回304时继续使用缓存的数据，
+    不重新下载和解析响应体。内存层按LRU淘汰(条目数和字节数双重上限)；配置disk_path后
+    额外使用SQLite磁盘层，重启后和同一主机的其他worker也能用已有的校验器发起条件请求。
+    webhook事件按路径前缀清除相关缓存，例如MR更新清除该MR的详情、变更和审批状态；
+    启用磁盘层时清除记录写入共享的invalidations表，其他worker读取内存层前先检查，不会继续使用已清除的数据
+    """
+
+    def __init__(
+        self,
+        ttl_policies: Mapping[str, float],
+        max_entries: int = 2048,
+        max_bytes: int = 64 * 1024 * 1024,
+        max_entry_size: int = 1024 * 1024,
+        disk_path: Optional[str] = None,
+        disk_max_entries: int = 50000,
+        stale_if_error: bool = True,
+    ):
+        self.ttl_policies = dict(ttl_policies)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_entry_size = max_entry_size
+        self.disk_max_entries = disk_max_entries
+        self.stale_if_error = stale_if_error
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.invalidated = 0
+        self.stale = 0
+        self._bytes = 0
+        self._entries: "OrderedDict[str, CachedResponse]" = OrderedDict()
+        # 路径前缀 -> 缓存键，按前缀清除时不需要遍历全部条目
+        self._prefixes: Dict[str, Set[str]] = {}
+        self._hit_counter, self._miss_counter = cache_counters("http")
+        self._conn = None
+        self._writes = 0
+        if disk_path:
+            self._conn = connect(disk_path)
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    etag TEXT,
+                    last_modified TEXT,
+                    body BLOB NOT NULL,
+                    fresh_until REAL NOT NULL,
+                    stored_at REAL NOT NULL
+                )
+                """
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_stored_at ON responses (stored_at)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS invalidations (prefix TEXT PRIMARY KEY, invalidated_at REAL NOT NULL)"
+            )
+
+    def ttl_for(self, endpoint: str) -> Optional[float]:
+        """接口的缓存TTL，未配置时返回None(不缓存)"""
+        return self.ttl_policies.get(gitlab_endpoint(endpoint))
+
+    @staticmethod
+    def make_key(endpoint: str, params: Optional[dict] = None) -> str:
+        key = "/" + endpoint.lstrip("/")
+        if params:
+            key += "?" + urlencode(sorted(params.items()))
+        return key
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        """查找缓存条目(可能已过期，需要重新验证)，内存层未命中时查找磁盘层"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            if self._conn is None or not self._invalidated_since(key, entry.stored_at):
+                self._entries.move_to_end(key)
+                return entry
+            # 其他worker已清除该缓存
+            self._remove_memory(key)
+        if self._conn is None:
+            return None
+        row = self._conn.execute(
+            "SELECT etag, last_modified, body, fresh_until FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        etag, last_modified, body, fresh_until = row
+        entry = CachedResponse(fast_json.loads(body), etag, last_modified, fresh_until, len(body))
+        self._put_memory(key, entry)
+        return entry
+
+    def _invalidated_since(self, key: str, stored_at: float) -> bool:
+        """缓存写入内存层之后，是否有worker清除了它或它的上级路径"""
+        prefixes = list(_ancestors(key))
+        row = self._conn.execute(
+            f"SELECT 1 FROM invalidations WHERE prefix IN ({', '.join('?' * len(prefixes))}) AND invalidated_at >= ? LIMIT 1",
+            (*prefixes, stored_at),
+        ).fetchone()
+        return row is not None
+
+    def _record_invalidation(self, prefix: str):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO invalidations (prefix, invalidated_at) VALUES (?, ?)", (prefix, time.time())
+        )
+
+    @staticmethod
+    def conditional_headers(entry: Optional[CachedResponse]) -> Dict[str, str]:
+        """重新验证用的请求头"""
+        headers = {}
+        if entry is not None:
+            if entry.etag:
+                headers["If-None-Match"] = entry.etag
+            if entry.last_modified:
+                headers["If-Modified-Since"] = entry.last_modified
+        return headers
+
+    def count_hit(self, revalidated: bool = False):
+        if revalidated:
+            self.revalidated += 1
+        else:
+            self.hits += 1
+        self._hit_counter.inc()
+
+    def count_stale(self):
+        self.stale += 1
+        self._hit_counter.inc()
+
+    def count_miss(self):
+        self.misses += 1
+        self._miss_counter.inc()
+
+    def store(self, key: str, value: Any, headers: Mapping[str, str], ttl: float):
+        """缓存200响应；没有校验器且TTL为0、或响应过大时不缓存"""
+        etag = headers.get("ETag")
+        last_modified = headers.get("Last-Modified")
+        if not etag and not last_modified and ttl <= 0:
+            return
+        body = fast_json.dumps(value)
+        if len(body) > self.max_entry_size:
+            self.invalidate(key)
+            return
+        entry = CachedResponse(value, etag, last_modified, time.time() + ttl, len(body))
+        self._put_memory(key, entry)
+        if self._conn is not None:
+            self._conn.execute(
+                """
+                INSERT INTO responses (key, etag, last_modified, body, fresh_until, stored_at) VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET etag = excluded.etag, last_modified = excluded.last_modified,
+                    body = excluded.body, fresh_until = excluded.fresh_until, stored_at = excluded.stored_at
+                """,
+                (key, etag, last_modified, body, entry.fresh_until, time.time()),
+            )
+            self._writes += 1
+            if self._writes % 1000 == 0:
+                self._prune_disk()
+
+    def refresh(self, key: str, entry: CachedResponse, ttl: float):
+        """304：数据未变化，延长缓存有效期"""
+        entry.fresh_until = time.time() + ttl
+        if self._conn is not None and ttl > 0:
+            self._conn.execute(
+                "UPDATE responses SET fresh_until = ?, stored_at = ? WHERE key = ?", (entry.fresh_until, time.time(), key)
+            )
+
+    def _put_memory(self, key: str, entry: CachedResponse):
+        self._remove_memory(key)
+        self._entries[key] = entry
+        self._bytes += entry.size
+        for prefix in _ancestors(key):
+            self._prefixes.setdefault(prefix, set()).add(key)
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            self._remove_memory(next(iter(self._entries)))
+
+    def _remove_memory(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._bytes -= entry.size
+        for prefix in _ancestors(key):
+            keys = self._prefixes.get(prefix)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._prefixes[prefix]
+
+    def _prune_disk(self):
+        """磁盘层只保留最近写入的disk_max_entries条；超过最长TTL的清除记录不再影响未过期的缓存"""
+        self._conn.execute(
+            """
+            DELETE FROM responses WHERE key IN (
+                SELECT key FROM responses ORDER BY stored_at DESC LIMIT -1 OFFSET ?
+            )
+            """,
+            (self.disk_max_entries,),
+        )
+        max_ttl = max(self.ttl_policies.values(), default=0)
+        self._conn.execute("DELETE FROM invalidations WHERE invalidated_at < ?", (time.time() - max_ttl,))
+
+    def invalidate(self, key: str):
+        self._remove_memory(key)
+        if self._conn is not None:
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._record_invalidation(key.split("?", 1)[0])
+
+    def invalidate_prefix(self, prefix: str):
+        """清除路径本身及其下级路径的全部缓存"""
+        prefix = "/" + prefix.strip("/")
+        for key in list(self._prefixes.get(prefix, ())):
+            self._remove_memory(key)
+            self.invalidated += 1
+        if self._conn is not None:
+            self._conn.execute(
+                """
+                DELETE FROM responses
+                WHERE substr(key, 1, ?) = ? AND (length(key) = ? OR substr(key, ? + 1, 1) IN ('/', '?'))
+                """,
+                (len(prefix), prefix, len(prefix), len(prefix)),
+            )
+            self._record_invalidation(prefix)
+
+    def invalidate_from_webhook(self, data: dict):
+        """MR和评论事件清除该MR的缓存(详情、变更、审批状态等)"""
+        project_id = (data.get("project") or {}).get("id")
+        if data.get("object_kind") == "merge_request":
+            mr_iid = (data.get("object_attributes") or {}).get("iid")
+        elif data.get("object_kind") == "note":
+            mr_iid = (data.get("merge_request") or {}).get("iid")
+        else:
+            return
+        if project_id is not None and mr_iid is not None:
+            self.invalidate_prefix(f"/projects/{project_id}/merge_requests/{mr_iid}")
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.revalidated + self.misses
+        return {
+            "size": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "revalidated": self.revalidated,
+            "misses": self.misses,
+            "invalidated": self.invalidated,
+            "stale": self.stale,
+            "hit_rate": round((self.hits + self.revalidated) / total, 4) if total else 0.0,
+            "disk_size": self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0] if self._conn else None,
+        }
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+
+if settings.http_cache.enabled and settings.server.workers > 1 and not settings.http_cache.disk_path:
+    # 每个worker的内存缓存只会被自己收到的webhook清除，其他worker会继续使用过期的数据
+    logger.warning("多worker部署的GitLab响应缓存需要配置 http_cache.disk_path，已禁用缓存")
+
+http_cache: Optional[ResponseCache] = ResponseCache(
+    settings.http_cache.ttl,
+    max_entries=settings.http_cache.max_entries,
+    max_bytes=settings.http_cache.max_bytes,
+    max_entry_size=settings.http_cache.max_entry_size,
+    disk_path=settings.http_cache.disk_path,
+    disk_max_entries=settings.http_cache.disk_max_entries,
+    stale_if_error=settings.http_cache.stale_if_error,
+) if settings.http_cache.enabled and (settings.server.workers <= 1 or settings.http_cache.disk_path) else None
@@ -0,0 +1,42 @@
+import logging
+from typing import Dict, Optional
+import httpx
+
+logger = logging.getLogger(__name__)
+
+def _http2_available() -> bool:
+    """检查是否安装了HTTP/2依赖(h2)"""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+def create_async_client(
+    timeout: float = 10.0,
+    connect_timeout: float = 5.0,
+    max_connections: int = 20,
+    max_keepalive_connections: int = 10,
+    http2: bool = True,
+    base_url: str = "",
+    headers: Optional[Dict[str, str]] = None,
+) -> httpx.AsyncClient:
+    """
+    创建带长连接池的异步HTTP客户端
+
+    连接池按目标主机复用连接，max_connections 限制单个客户端（即单个上游主机）的并发连接数
+    """
+    if http2 and not _http2_available():
+        logger.warning("未安装h2，HTTP/2不可用，回退到HTTP/1.1")
+        http2 = False
+
+    return httpx.AsyncClient(
+        base_url=base_url,
+        headers=headers,
+        http2=http2,
+        timeout=httpx.Timeout(timeout, connect=connect_timeout),
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+        ),
+    )
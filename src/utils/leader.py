@@ -0,0 +1,265 @@
+import abc
+import asyncio
+import functools
+import logging
+import os
+import socket
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional
+from src.config import LeaderConfig, settings
+from src.utils.db import connect
+from src.utils.metrics import SCHEDULER_LEADER
+
+logger = logging.getLogger(__name__)
+
+class LeaseBackend(abc.ABC):
+    """
+    租约存储接口
+
+    同一租约名同时只有一个持有者；持有者需要在ttl内续约，否则其他竞争者可以接管
+    """
+
+    @abc.abstractmethod
+    async def acquire(self, name: str, owner: str, ttl: float) -> bool:
+        """获取或续约，成功返回True"""
+
+    @abc.abstractmethod
+    async def release(self, name: str, owner: str):
+        """持有者主动释放租约"""
+
+    @abc.abstractmethod
+    async def holder(self, name: str) -> Optional[str]:
+        """当前有效的持有者"""
+
+    def close(self):
+        pass
+
+class MemoryLeaseBackend(LeaseBackend):
+    """进程内租约，单worker部署或本地调试时代替共享存储"""
+
+    def __init__(self):
+        self._leases: Dict[str, tuple] = {}
+
+    async def acquire(self, name: str, owner: str, ttl: float) -> bool:
+        current = self._leases.get(name)
+        now = time.monotonic()
+        if current is not None and current[0] != owner and current[1] > now:
+            return False
+        self._leases[name] = (owner, now + ttl)
+        return True
+
+    async def release(self, name: str, owner: str):
+        current = self._leases.get(name)
+        if current is not None and current[0] == owner:
+            del self._leases[name]
+
+    async def holder(self, name: str) -> Optional[str]:
+        current = self._leases.get(name)
+        if current is None or current[1] <= time.monotonic():
+            return None
+        return current[0]
+
+class SQLiteLeaseBackend(LeaseBackend):
+    """基于SQLite(WAL)的租约，同一主机上的uvicorn worker之间共享"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = connect(path)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS leases (
+                name TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+            """
+        )
+
+    async def acquire(self, name: str, owner: str, ttl: float) -> bool:
+        now = time.time()
+        # 租约不存在、已过期或本来就由自己持有时写入，否则不修改
+        cursor = self._conn.execute(
+            """
+            INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+            WHERE leases.owner = excluded.owner OR leases.expires_at <= ?
+            """,
+            (name, owner, now + ttl, now),
+        )
+        return cursor.rowcount > 0
+
+    async def release(self, name: str, owner: str):
+        self._conn.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))
+
+    async def holder(self, name: str) -> Optional[str]:
+        row = self._conn.execute(
+            "SELECT owner FROM leases WHERE name = ? AND expires_at > ?", (name, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def close(self):
+        self._conn.close()
+
+class RedisLeaseBackend(LeaseBackend):
+    """基于Redis的租约，多个节点之间共享（需要安装redis: poetry install -E cluster）"""
+
+    # 只有持有者可以续约和释放，比较和修改需要原子执行
+    _RENEW_SCRIPT = """
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+    end
+    return 0
+    """
+    _RELEASE_SCRIPT = """
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        return redis.call('DEL', KEYS[1])
+    end
+    return 0
+    """
+
+    def __init__(self, url: str, prefix: str = "gitlab-webhook:lease:"):
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:  # pragma: no cover
+            raise RuntimeError("leader.backend = \"redis\" 需要安装redis: poetry install -E cluster") from e
+        self.prefix = prefix
+        self._redis = redis.from_url(url, decode_responses=True)
+        self._renew = self._redis.register_script(self._RENEW_SCRIPT)
+        self._release = self._redis.register_script(self._RELEASE_SCRIPT)
+
+    async def acquire(self, name: str, owner: str, ttl: float) -> bool:
+        key = self.prefix + name
+        ttl_ms = int(ttl * 1000)
+        if await self._redis.set(key, owner, nx=True, px=ttl_ms):
+            return True
+        return bool(await self._renew(keys=[key], args=[owner, ttl_ms]))
+
+    async def release(self, name: str, owner: str):
+        await self._release(keys=[self.prefix + name], args=[owner])
+
+    async def holder(self, name: str) -> Optional[str]:
+        return await self._redis.get(self.prefix + name)
+
+def create_lease_backend(config: LeaderConfig) -> LeaseBackend:
+    """根据配置创建租约存储"""
+    if config.backend == "sqlite":
+        return SQLiteLeaseBackend(config.path)
+    if config.backend == "redis":
+        return RedisLeaseBackend(config.redis_url)
+    if config.backend == "memory":
+        return MemoryLeaseBackend()
+    raise ValueError(f"不支持的 leader.backend: {config.backend}")
+
+class LeaderElector:
+    """
+    基于租约的leader选举
+
+    每个worker定期尝试获取同名租约，持有者每renew_interval秒续约一次；持有者退出时主动释放，
+    崩溃时租约在ttl后过期，由其他worker接管。续约失败(包括租约存储不可用)且本地租约到期后
+    立即放弃leader身份，避免两个worker同时执行定时任务
+    """
+
+    def __init__(self, backend: LeaseBackend, name: str = "scheduler", ttl: float = 30, renew_interval: float = 10):
+        self.backend = backend
+        self.name = name
+        self.ttl = ttl
+        self.renew_interval = min(renew_interval, ttl / 2)
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.elected_count = 0
+        self._leader = False
+        self._lease_deadline = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self._on_elected: Optional[Callable[[], Any]] = None
+        self._on_revoked: Optional[Callable[[], Any]] = None
+
+    @property
+    def is_leader(self) -> bool:
+        """持有未过期的租约"""
+        return self._leader and time.monotonic() < self._lease_deadline
+
+    def start(self, on_elected: Optional[Callable[[], Any]] = None, on_revoked: Optional[Callable[[], Any]] = None):
+        """开始参与选举，成为leader和失去leader身份时分别调用on_elected/on_revoked"""
+        self._on_elected = on_elected
+        self._on_revoked = on_revoked
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            started_at = time.monotonic()
+            try:
+                acquired = await self.backend.acquire(self.name, self.owner, self.ttl)
+            except Exception as e:
+                logger.error(f"续约leader租约失败: {str(e)}")
+                acquired = None
+
+            if acquired:
+                self._lease_deadline = started_at + self.ttl
+                if not self._leader:
+                    self._set_leader(True)
+            elif self._leader and (acquired is False or time.monotonic() >= self._lease_deadline):
+                # 租约被其他worker接管，或存储不可用直到本地租约到期
+                self._set_leader(False)
+
+            # 非leader以相同间隔竞争，leader宕机后最多ttl + renew_interval秒内完成切换
+            await asyncio.sleep(self.renew_interval)
+
+    def _set_leader(self, leader: bool):
+        self._leader = leader
+        SCHEDULER_LEADER.set(1 if leader else 0)
+        callback = self._on_elected if leader else self._on_revoked
+        if leader:
+            self.elected_count += 1
+            logger.info(f"当前worker成为定时任务leader: {self.owner}")
+        else:
+            logger.warning(f"当前worker失去定时任务leader身份: {self.owner}")
+        if callback is not None:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"leader切换回调出错: {str(e)}", exc_info=True)
+
+    def leader_only(self, func: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+        """包装定时任务：只在leader上执行，其他worker直接跳过"""
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            if not self.is_leader:
+                logger.debug(f"非leader，跳过定时任务 {func.__name__}")
+                return None
+            return await func(*args, **kwargs)
+        return wrapper
+
+    async def stop(self):
+        """停止选举并释放租约，其他worker可以立即接管"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._leader:
+            self._set_leader(False)
+            try:
+                await self.backend.release(self.name, self.owner)
+            except Exception as e:
+                logger.error(f"释放leader租约失败: {str(e)}")
+        self.backend.close()
+
+    async def stats(self) -> Dict[str, Any]:
+        try:
+            holder = await self.backend.holder(self.name)
+        except Exception as e:
+            holder = f"unknown ({str(e)})"
+        return {
+            "owner": self.owner,
+            "is_leader": self.is_leader,
+            "holder": holder,
+            "elected": self.elected_count,
+            "backend": type(self.backend).__name__,
+        }
+
+leader_elector = LeaderElector(
+    create_lease_backend(settings.leader),
+    name=settings.leader.name,
+    ttl=settings.leader.ttl,
+    renew_interval=settings.leader.renew_interval,
+)
@@ -1,72 +1,104 @@
-from datetime import datetime
+import atexit
 import logging
+import queue
 import sys
-import json
 from pathlib import Path
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import List, Optional
 from src.config import settings
 
+_listener: Optional[QueueListener] = None
+_queue_handler: Optional[QueueHandler] = None
+# 控制台和文件处理器；停止后台线程后直接挂到根日志记录器上
+_handlers: List[logging.Handler] = []
+
 def setup_logger():
-    """配置日志系统"""
+    """
+    配置日志系统
+
+    根日志记录器只挂一个QueueHandler，记录放入队列后立即返回；
+    控制台和文件的实际写入由QueueListener的后台线程完成，不阻塞事件循环
+    """
+    global _listener, _queue_handler, _handlers
+
+    # 配置根日志记录器
+    logger = logging.getLogger()
+    if _listener is not None:
+        return logger
+    # 之前stop_logger后直接写入的处理器，换成新的队列
+    for handler in _handlers:
+        logger.removeHandler(handler)
+        handler.close()
+    _handlers = []
+
     # 创建logs目录
     log_dir = Path("logs")
     log_dir.mkdir(exist_ok=True)
-    
-    # 配置根日志记录器
-    logger = logging.getLogger()
+
     # 在调试模式下设置为DEBUG级别
     logger.setLevel(logging.DEBUG if settings.app.debug else logging.INFO)
-    
+
     # 日志格式
     formatter = logging.Formatter(
         '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
         datefmt='%Y-%m-%d %H:%M:%S'
     )
-    
+
     # 控制台处理器
     console_handler = logging.StreamHandler(sys.stdout)
     console_handler.setFormatter(formatter)
-    logger.addHandler(console_handler)
-    
+
     # 文件处理器（按大小轮转）
     file_handler = RotatingFileHandler(
         log_dir / "webhook.log",
-        maxBytes=10*1024*1024,  # 10MB
-        backupCount=5,
+        maxBytes=settings.log.max_size,
+        backupCount=settings.log.backup_count,
         encoding='utf-8'
     )
     file_handler.setFormatter(formatter)
-    logger.addHandler(file_handler)
-    
+    handlers = [console_handler, file_handler]
+
     # 在调试模式下创建单独的调试日志文件
     if settings.app.debug:
         debug_handler = RotatingFileHandler(
             log_dir / "webhook.debug.log",
-            maxBytes=10*1024*1024,
-            backupCount=5,
+            maxBytes=settings.log.max_size,
+            backupCount=settings.log.backup_count,
             encoding='utf-8'
         )
         debug_handler.setFormatter(formatter)
         debug_handler.setLevel(logging.DEBUG)
-        logger.addHandler(debug_handler)
-    
+        handlers.append(debug_handler)
+
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    _queue_handler = QueueHandler(log_queue)
+    logger.addHandler(_queue_handler)
+    _handlers = handlers
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logger)
+
     # 为某些模块单独设置日志级别
     logging.getLogger("urllib3").setLevel(logging.WARNING)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    logging.getLogger("httpcore").setLevel(logging.WARNING)
     logging.getLogger("asyncio").setLevel(logging.WARNING)
 
     return logger
 
-def log_webhook_data(data: dict, event_type: str):
-    """记录webhook详细数据（仅在调试模式下）"""
-    if not settings.app.debug:
+def stop_logger():
+    """
+    写出队列中剩余的日志并停止后台线程
+
+    移除QueueHandler，之后的日志直接由控制台和文件处理器写入，不会堆积在无人消费的队列中
+    """
+    global _listener, _queue_handler
+    if _listener is None:
         return
-        
-    log_dir = Path("logs/webhook_data")
-    log_dir.mkdir(exist_ok=True, parents=True)
-    
-    # 使用时间戳和事件类型作为文件名
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"{timestamp}_{event_type.replace(' ', '_')}.json"
-    
-    with open(log_dir / filename, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2) 
\ No newline at end of file
+    logger = logging.getLogger()
+    logger.removeHandler(_queue_handler)
+    _queue_handler = None
+    _listener.stop()
+    _listener = None
+    for handler in _handlers:
+        logger.addHandler(handler)
@@ -1,70 +1,177 @@
+from typing import Iterator, List
+
+# 企业微信markdown消息内容的最大字节数(UTF-8)
+WECHAT_MARKDOWN_LIMIT = 4096
+
 class Markdown:
+    """
+    Markdown文本构建器
+
+    内容以片段列表保存，+ 运算只追加片段并累加UTF-8字节数，循环拼接大量内容是线性的；
+    bold()/info()等包裹整段内容的方法会先把片段合并成一个字符串。
+    boundary() 标记可以拆分消息的位置，chunks() 按字节上限在这些位置拆分成多条消息
+    """
+
+    __slots__ = ("_parts", "_bytes", "_boundaries")
+
     def __init__(self, text: str = ""):
-        self.val = text or ""
-    
+        text = text or ""
+        self._parts: List[str] = [text] if text else []
+        self._bytes = len(text.encode("utf-8"))
+        # 可拆分位置：片段下标
+        self._boundaries: List[int] = []
+
+    @property
+    def val(self) -> str:
+        """完整内容；只读，不合并片段，拆分标记保持有效"""
+        return "".join(self._parts)
+
+    @val.setter
+    def val(self, text: str):
+        self._parts = [text] if text else []
+        self._bytes = len(text.encode("utf-8"))
+        self._boundaries = []
+
+    @property
+    def byte_length(self) -> int:
+        """内容的UTF-8字节数"""
+        return self._bytes
+
+    def _wrap(self, prefix: str, suffix: str = "") -> 'Markdown':
+        """包裹整段内容，拆分标记随之失效"""
+        self._parts = [f"{prefix}{self.val}{suffix}"]
+        self._bytes += len(prefix.encode("utf-8")) + len(suffix.encode("utf-8"))
+        self._boundaries = []
+        return self
+
     def __add__(self, other) -> 'Markdown':
         """使用 + 运算符连接文本"""
         if isinstance(other, Markdown):
-            self.val += other.val
+            offset = len(self._parts)
+            self._boundaries.extend(offset + index for index in other._boundaries)
+            self._parts.extend(other._parts)
+            self._bytes += other._bytes
         elif isinstance(other, str):
-            self.val += other
+            if other:
+                self._parts.append(other)
+                self._bytes += len(other.encode("utf-8"))
         else:
             raise TypeError(f"unsupported operand type(s) for +: '{type(self).__name__}' and '{type(other).__name__}'")
         return self
-    
+
+    def boundary(self) -> 'Markdown':
+        """在当前位置标记可拆分点（如每条MR、每个分支分组之前）"""
+        if not self._boundaries or self._boundaries[-1] != len(self._parts):
+            self._boundaries.append(len(self._parts))
+        return self
+
     def new_line(self) -> 'Markdown':
         """添加换行"""
-        self.val = f"{self.val}\n"
-        return self
-    
+        return self + "\n"
+
     def quote(self) -> 'Markdown':
         """添加引用"""
-        self.val = f">{self.val}"
-        return self
-    
+        return self._wrap(">")
+
     def bold(self) -> 'Markdown':
         """加粗文本"""
-        self.val = f"**{self.val}**"
-        return self
-    
+        return self._wrap("**", "**")
+
     def info(self) -> 'Markdown':
         """信息颜色"""
-        self.val = f"<font color='info'>{self.val}</font>"
-        return self
-    
+        return self._wrap("<font color='info'>", "</font>")
+
     def warning(self) -> 'Markdown':
         """警告颜色"""
-        self.val = f"<font color='warning'>{self.val}</font>"
-        return self
-    
+        return self._wrap("<font color='warning'>", "</font>")
+
     def comment(self) -> 'Markdown':
         """注释颜色"""
-        self.val = f"<font color='comment'>{self.val}</font>"
-        return self
-    
+        return self._wrap("<font color='comment'>", "</font>")
+
     def error(self) -> 'Markdown':
         """错误颜色"""
-        self.val = f"<font color='error'>{self.val}</font>"
-        return self
-        
+        return self._wrap("<font color='error'>", "</font>")
+
     def success(self) -> 'Markdown':
         """成功颜色"""
-        self.val = f"<font color='success'>{self.val}</font>"
-        return self
-    
+        return self._wrap("<font color='success'>", "</font>")
+
     def mark(self) -> 'Markdown':
         """@某人"""
-        self.val = f"<@{self.val}>"
-        return self
-    
+        return self._wrap("<@", ">")
+
+    def _segments(self) -> Iterator[str]:
+        """按拆分标记切分的内容段"""
+        start = 0
+        for end in self._boundaries:
+            if end > start:
+                yield "".join(self._parts[start:end])
+            start = end
+        if start < len(self._parts):
+            yield "".join(self._parts[start:])
+
+    def chunks(self, limit: int = WECHAT_MARKDOWN_LIMIT) -> List[str]:
+        """
+        按UTF-8字节上限拆分成多条消息
+
+        优先在boundary()标记处拆分；单段超过上限时按行拆分，单行仍超过上限时按字符截断
+        """
+        if self._bytes <= limit:
+            return [self.val] if self._bytes else []
+        chunks: List[str] = []
+        current: List[str] = []
+        size = 0
+        for segment in self._segments():
+            segment_size = len(segment.encode("utf-8"))
+            if size + segment_size > limit and current:
+                chunks.append("".join(current))
+                current, size = [], 0
+            if segment_size <= limit:
+                current.append(segment)
+                size += segment_size
+                continue
+            for piece in _split_oversized(segment, limit):
+                piece_size = len(piece.encode("utf-8"))
+                if size + piece_size > limit and current:
+                    chunks.append("".join(current))
+                    current, size = [], 0
+                current.append(piece)
+                size += piece_size
+        if current:
+            chunks.append("".join(current))
+        return chunks
+
     def __str__(self) -> str:
         return self.val
-    
+
     def __repr__(self) -> str:
         return self.val
 
+def _split_oversized(text: str, limit: int) -> Iterator[str]:
+    """
+    把超过上限的内容按行拆分，单行超过上限时按字节截断（不拆开多字节字符）
+
+    上限小于单个字符的字节数时，该字符单独成段（超过上限），保证能拆分完
+    """
+    for line in text.splitlines(keepends=True):
+        encoded = line.encode("utf-8")
+        while len(encoded) > limit:
+            cut = limit
+            # 回退到UTF-8字符起始字节
+            while cut > 0 and (encoded[cut] & 0xC0) == 0x80:
+                cut -= 1
+            if cut == 0:
+                cut = 1
+                while cut < len(encoded) and (encoded[cut] & 0xC0) == 0x80:
+                    cut += 1
+            yield encoded[:cut].decode("utf-8")
+            encoded = encoded[cut:]
+        if encoded:
+            yield encoded.decode("utf-8")
+
 def md(text: str = "") -> Markdown:
     """创建Markdown实例的工厂函数"""
     if text and not isinstance(text, str):
         raise TypeError("expected arg not string")
-    return Markdown(text) 
\ No newline at end of file
+    return Markdown(text)
@@ -0,0 +1,116 @@
+import os
+import re
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client import multiprocess
+from src.utils.priority import PRIORITY_BULK, PRIORITY_REALTIME
+from src.utils.router import MR_ACTIONS, NOTE_ACTION
+
+# uvicorn多worker时由run.py在导入前设置，各进程把指标写入该目录，/metrics汇总所有进程
+MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+
+# 请求、处理函数、外部接口的耗时分桶(秒)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# 排队时间分桶(秒)，防抖和积压时可能达到分钟级
+QUEUE_WAIT_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0)
+
+INGRESS_OUTCOMES = ("accepted", "ignored", "duplicate", "shed", "queue_full", "unauthorized", "not_supported", "error")
+
+INGRESS_REQUESTS = Counter("webhook_ingress_requests_total", "webhook请求数", ["outcome"])
+INGRESS_LATENCY = Histogram("webhook_ingress_duration_seconds", "webhook请求处理耗时", buckets=LATENCY_BUCKETS)
+QUEUE_DEPTH = Gauge("webhook_queue_depth", "队列中等待处理的事件数", multiprocess_mode="livesum")
+QUEUE_WAIT = Histogram(
+    "webhook_queue_wait_seconds", "事件在队列中的等待时间", ["priority"], buckets=QUEUE_WAIT_BUCKETS
+)
+HANDLER_DURATION = Histogram(
+    "webhook_handler_duration_seconds", "事件处理耗时", ["event_type", "action"], buckets=LATENCY_BUCKETS
+)
+HANDLER_ERRORS = Counter("webhook_handler_errors_total", "事件处理失败次数", ["event_type", "action"])
+GITLAB_LATENCY = Histogram(
+    "gitlab_api_request_duration_seconds", "GitLab API请求耗时", ["endpoint"], buckets=LATENCY_BUCKETS
+)
+GITLAB_ERRORS = Counter("gitlab_api_errors_total", "GitLab API请求失败次数", ["endpoint", "reason"])
+WECHAT_LATENCY = Histogram("wechat_send_duration_seconds", "企业微信消息发送耗时", buckets=LATENCY_BUCKETS)
+WECHAT_RESULTS = Counter("wechat_send_total", "企业微信消息发送结果", ["errcode"])
+SCHEDULER_LEADER = Gauge("scheduler_leader", "当前持有定时任务leader租约的worker数", multiprocess_mode="livesum")
+CACHE_REQUESTS = Counter("cache_requests_total", "缓存查询次数", ["cache", "result"])
+
+# 预先创建固定取值的标签子指标，热路径上只做字典查找
+_ingress_children = {outcome: (INGRESS_REQUESTS.labels(outcome), INGRESS_LATENCY) for outcome in INGRESS_OUTCOMES}
+QUEUE_WAIT_CHILDREN = {priority: QUEUE_WAIT.labels(priority) for priority in (PRIORITY_REALTIME, PRIORITY_BULK)}
+_handler_children: Dict[Tuple[str, str], Tuple[Histogram, Counter]] = {}
+_wechat_children: Dict[str, Counter] = {}
+
+def _handler_child(event_type: str, action: str) -> Tuple[Histogram, Counter]:
+    children = _handler_children.get((event_type, action))
+    if children is None:
+        children = _handler_children[(event_type, action)] = (
+            HANDLER_DURATION.labels(event_type, action),
+            HANDLER_ERRORS.labels(event_type, action),
+        )
+    return children
+
+for _action in MR_ACTIONS:
+    _handler_child("merge_request", _action)
+_handler_child("note", NOTE_ACTION)
+
+def observe_ingress(outcome: str, seconds: float):
+    """记录一次webhook请求"""
+    counter, histogram = _ingress_children.get(outcome) or _ingress_children["error"]
+    counter.inc()
+    histogram.observe(seconds)
+
+def observe_handler(data: dict, seconds: float, failed: bool = False):
+    """记录一次事件处理，按事件类型和MR动作区分"""
+    event_type = data.get("object_kind") or "unknown"
+    if event_type == "merge_request":
+        action = (data.get("object_attributes") or {}).get("action") or "unknown"
+    else:
+        action = NOTE_ACTION if event_type == "note" else "none"
+    histogram, errors = _handler_child(event_type, action)
+    histogram.observe(seconds)
+    if failed:
+        errors.inc()
+
+_ID_SEGMENT = re.compile(r"/\d+(?=/|$)")
+
+@lru_cache(maxsize=512)
+def gitlab_endpoint(endpoint: str) -> str:
+    """把API路径中的ID替换为占位符，控制标签数量"""
+    return _ID_SEGMENT.sub("/:id", "/" + endpoint.lstrip("/"))
+
+@lru_cache(maxsize=512)
+def _gitlab_child(endpoint: str) -> Histogram:
+    return GITLAB_LATENCY.labels(gitlab_endpoint(endpoint))
+
+def observe_gitlab(endpoint: str, seconds: float, error: Optional[str] = None):
+    """记录一次GitLab API请求，error为失败原因(如http_404、timeout)"""
+    _gitlab_child(endpoint).observe(seconds)
+    if error is not None:
+        GITLAB_ERRORS.labels(gitlab_endpoint(endpoint), error).inc()
+
+def observe_wechat(seconds: float, errcode: str):
+    """记录一次企业微信接口调用"""
+    WECHAT_LATENCY.observe(seconds)
+    counter = _wechat_children.get(errcode)
+    if counter is None:
+        counter = _wechat_children[errcode] = WECHAT_RESULTS.labels(errcode)
+    counter.inc()
+
+def render_metrics() -> Tuple[bytes, str]:
+    """生成Prometheus文本格式的指标，多进程模式下汇总所有worker"""
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+def mark_process_dead():
+    """进程退出时清理多进程模式下的实时指标(livesum等)"""
+    if MULTIPROC_DIR:
+        multiprocess.mark_process_dead(os.getpid())
+
+def cache_counters(cache: str) -> Tuple[Counter, Counter]:
+    """获取缓存的(命中, 未命中)计数器"""
+    return CACHE_REQUESTS.labels(cache, "hit"), CACHE_REQUESTS.labels(cache, "miss")
@@ -0,0 +1,208 @@
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional
+from src.config import settings
+from src.utils.db import connect
+
+logger = logging.getLogger(__name__)
+
+_COLUMNS = (
+    "project_id", "iid", "project_name", "title", "web_url", "target_branch",
+    "state", "author_name", "created_at", "updated_at",
+)
+
+class MRIndex:
+    """
+    本地MR状态索引(SQLite)，由webhook事件增量维护，按(项目ID, iid)唯一
+
+    周报可以直接查询索引，不必每次全量扫描GitLab；定期对账任务用API数据修复漏掉的事件
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = connect(path)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS merge_requests (
+                project_id INTEGER NOT NULL,
+                iid INTEGER NOT NULL,
+                project_name TEXT,
+                title TEXT,
+                web_url TEXT,
+                target_branch TEXT,
+                state TEXT,
+                author_name TEXT,
+                created_at TEXT,
+                updated_at TEXT,
+                synced_at REAL NOT NULL,
+                PRIMARY KEY (project_id, iid)
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_mr_state_branch ON merge_requests (state, target_branch)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_mr_target_branch ON merge_requests (target_branch)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_mr_created_at ON merge_requests (created_at)")
+        logger.info(f"MR索引已打开: {path}")
+
+    def upsert(self, record: Dict[str, Any], synced_before: Optional[float] = None):
+        """
+        写入或更新一条MR记录，author_name为空时保留原值；updated_at早于已有记录的数据(乱序或重放的旧事件)不覆盖
+
+        Args:
+            synced_before: 只覆盖在该时间之前同步的记录，之后写入的记录(如webhook事件)保持不变
+        """
+        params = [record.get(column) for column in _COLUMNS] + [time.time()]
+        condition = (
+            "WHERE (merge_requests.updated_at IS NULL OR excluded.updated_at IS NULL"
+            " OR excluded.updated_at >= merge_requests.updated_at)"
+        )
+        if synced_before is not None:
+            condition += " AND merge_requests.synced_at < ?"
+            params.append(synced_before)
+        self._conn.execute(
+            f"""
+            INSERT INTO merge_requests ({', '.join(_COLUMNS)}, synced_at)
+            VALUES ({', '.join('?' * len(_COLUMNS))}, ?)
+            ON CONFLICT (project_id, iid) DO UPDATE SET
+                project_name = excluded.project_name,
+                title = excluded.title,
+                web_url = excluded.web_url,
+                target_branch = excluded.target_branch,
+                state = excluded.state,
+                author_name = COALESCE(excluded.author_name, merge_requests.author_name),
+                created_at = COALESCE(excluded.created_at, merge_requests.created_at),
+                updated_at = excluded.updated_at,
+                synced_at = excluded.synced_at
+            {condition}
+            """,
+            params,
+        )
+
+    def upsert_from_webhook(self, data: dict, author_name: Optional[str] = None, web_url: Optional[str] = None):
+        """根据Merge Request Hook事件更新索引"""
+        mr = data["object_attributes"]
+        project = data["project"]
+        self.upsert({
+            "project_id": project["id"],
+            "iid": mr["iid"],
+            "project_name": project.get("path_with_namespace") or project.get("name"),
+            "title": mr.get("title"),
+            "web_url": mr.get("url") or web_url,
+            "target_branch": mr.get("target_branch"),
+            "state": mr.get("state"),
+            "author_name": author_name,
+            "created_at": _normalize_time(mr.get("created_at")),
+            "updated_at": _normalize_time(mr.get("updated_at")),
+        })
+
+    def upsert_from_api(self, mr: dict, synced_before: Optional[float] = None):
+        """根据GitLab API返回的MR对象更新索引"""
+        full_reference = (mr.get("references") or {}).get("full") or ""
+        self.upsert({
+            "project_id": mr["project_id"],
+            "iid": mr["iid"],
+            "project_name": full_reference.rsplit("!", 1)[0] if "!" in full_reference else None,
+            "title": mr.get("title"),
+            "web_url": mr.get("web_url"),
+            "target_branch": mr.get("target_branch"),
+            "state": mr.get("state"),
+            "author_name": (mr.get("author") or {}).get("name"),
+            "created_at": _normalize_time(mr.get("created_at")),
+            "updated_at": _normalize_time(mr.get("updated_at")),
+        }, synced_before=synced_before)
+
+    def reconcile(self, project_ids: Iterable[int], open_mrs: Iterable[dict], started_at: float) -> int:
+        """
+        用API获取的未完成MR对账
+
+        写入所有未完成MR，并把索引中这些项目里已不在列表中的opened记录标记为closed。
+        open_mrs必须是完整的列表；扫描开始(started_at)之后由webhook写入的记录比API数据新，不修改
+
+        Returns:
+            int: 被修正为closed的记录数
+        """
+        open_keys = set()
+        self._conn.execute("BEGIN")
+        try:
+            for mr in open_mrs:
+                self.upsert_from_api(mr, synced_before=started_at)
+                open_keys.add((mr["project_id"], mr["iid"]))
+            stale = []
+            for project_id in set(project_ids):
+                rows = self._conn.execute(
+                    "SELECT iid FROM merge_requests WHERE project_id = ? AND state = 'opened' AND synced_at < ?",
+                    (project_id, started_at),
+                )
+                stale.extend((project_id, iid) for (iid,) in rows if (project_id, iid) not in open_keys)
+            self._conn.executemany(
+                "UPDATE merge_requests SET state = 'closed', synced_at = ? WHERE project_id = ? AND iid = ?",
+                [(time.time(), project_id, iid) for project_id, iid in stale],
+            )
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+        return len(stale)
+
+    def open_merge_requests(self, project_ids: Iterable[int] = (), namespaces: Iterable[str] = ()) -> List[Dict[str, Any]]:
+        """
+        查询指定项目、或指定群组路径(含子群组)下未完成的MR，结构与GitLab API返回的MR对象兼容
+
+        索引中还有其他项目发来webhook时写入的记录，不在统计范围内
+        """
+        project_ids = list(project_ids)
+        namespaces = [namespace.strip("/") + "/" for namespace in namespaces]
+        conditions = []
+        params: List[Any] = []
+        if project_ids:
+            conditions.append(f"project_id IN ({', '.join('?' * len(project_ids))})")
+            params.extend(project_ids)
+        for namespace in namespaces:
+            conditions.append("substr(project_name, 1, ?) = ?")
+            params.extend((len(namespace), namespace))
+        if not conditions:
+            return []
+        rows = self._conn.execute(
+            f"""
+            SELECT project_id, iid, project_name, title, web_url, target_branch, author_name, created_at
+            FROM merge_requests WHERE state = 'opened' AND ({' OR '.join(conditions)}) ORDER BY created_at DESC
+            """,
+            params,
+        )
+        return [
+            {
+                "project_id": project_id,
+                "iid": iid,
+                "project_name": project_name,
+                "title": title,
+                "web_url": web_url,
+                "target_branch": target_branch,
+                "author": {"name": author_name} if author_name else {},
+                "created_at": created_at,
+            }
+            for project_id, iid, project_name, title, web_url, target_branch, author_name, created_at in rows
+        ]
+
+    def close(self):
+        self._conn.close()
+
+def _normalize_time(value: Optional[str]) -> Optional[str]:
+    """
+    统一时间格式为UTC的ISO 8601（webhook中为 '2024-01-01 00:00:00 UTC'，API中带毫秒）
+
+    格式固定后可以直接按字符串比较先后
+    """
+    if not value:
+        return None
+    if value.endswith(" UTC"):
+        value = value[:-4].replace(" ", "T") + "Z"
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return value
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+mr_index: Optional[MRIndex] = MRIndex(settings.index.path) if settings.index.enabled else None
@@ -0,0 +1,204 @@
+import gzip
+import heapq
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+from src.config import settings
+from src.utils import fast_json
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_PREFIX = "payloads-"
+SEGMENT_SUFFIX = ".jsonl.gz"
+
+class PayloadArchive:
+    """
+    webhook原始数据归档
+
+    请求处理中只把(时间, 事件类型, 请求体)放入有界队列，由后台线程批量写入gzip压缩的JSONL分段文件，
+    每行一条 {"ts": 时间戳, "event_type": 事件类型, "data": 请求数据}。
+    分段超过segment_size字节（压缩后）时轮转，最多保留max_segments个分段；队列满时丢弃并计数，不阻塞请求
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        segment_size: int = 64 * 1024 * 1024,
+        max_segments: int = 20,
+        flush_interval: float = 5.0,
+        max_pending: int = 10000,
+    ):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.segment_size = segment_size
+        self.max_segments = max_segments
+        self.flush_interval = flush_interval
+        self.written_count = 0
+        self.dropped_count = 0
+        self.segment_count = 0
+        self._queue: "queue.Queue[Optional[Tuple[float, str, bytes, Any]]]" = queue.Queue(maxsize=max_pending)
+        self._raw = None
+        self._gzip: Optional[gzip.GzipFile] = None
+        self._thread = threading.Thread(target=self._run, name="payload-archive", daemon=True)
+        self._thread.start()
+
+    def record(self, event_type: str, body: bytes, data: Any = None):
+        """
+        归档一次投递，立即返回
+
+        Args:
+            body: 原始请求体，是单行JSON时直接写入，否则在后台线程中用data重新序列化
+        """
+        try:
+            self._queue.put_nowait((time.time(), event_type, body, data))
+        except queue.Full:
+            self.dropped_count += 1
+
+    def _segment_path(self) -> Path:
+        timestamp = time.strftime("%Y%m%d-%H%M%S")
+        return self.path / f"{SEGMENT_PREFIX}{timestamp}-{os.getpid()}-{self.segment_count}{SEGMENT_SUFFIX}"
+
+    def _open_segment(self):
+        self.segment_count += 1
+        self._raw = open(self._segment_path(), "wb")
+        self._gzip = gzip.GzipFile(fileobj=self._raw, mode="wb", compresslevel=6)
+
+    def _close_segment(self):
+        if self._gzip is not None:
+            self._gzip.close()
+            self._raw.close()
+            self._gzip = self._raw = None
+
+    def _prune(self):
+        """删除超出数量的旧分段"""
+        segments = sorted(self.path.glob(f"{SEGMENT_PREFIX}*{SEGMENT_SUFFIX}"), key=lambda p: p.stat().st_mtime)
+        for segment in segments[:max(len(segments) - self.max_segments, 0)]:
+            try:
+                segment.unlink()
+            except OSError as e:
+                logger.warning(f"删除归档分段失败 {segment}: {str(e)}")
+
+    @staticmethod
+    def _encode(ts: float, event_type: str, body: bytes, data: Any) -> bytes:
+        if b"\n" in body or b"\r" in body or not body:
+            body = fast_json.dumps(data)
+        return b'{"ts":%.3f,"event_type":%s,"data":%s}\n' % (ts, fast_json.dumps(event_type), body)
+
+    def _write(self, batch: List[Tuple[float, str, bytes, Any]]):
+        if self._gzip is None:
+            self._open_segment()
+            self._prune()
+        self._gzip.write(b"".join(self._encode(*item) for item in batch))
+        self.written_count += len(batch)
+        if self._raw.tell() >= self.segment_size:
+            self._close_segment()
+
+    def _run(self):
+        """后台写入线程：批量取出队列中的记录写入，定期刷新到磁盘"""
+        last_flush = time.monotonic()
+        running = True
+        while running:
+            batch = []
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+                while item is not None:
+                    batch.append(item)
+                    item = self._queue.get_nowait()
+                running = False
+            except queue.Empty:
+                pass
+            try:
+                if batch:
+                    self._write(batch)
+                if self._gzip is not None and (not running or time.monotonic() - last_flush >= self.flush_interval):
+                    # 同步刷新后已写入的内容可以被读取，即使进程异常退出
+                    self._gzip.flush()
+                    self._raw.flush()
+                    last_flush = time.monotonic()
+            except Exception as e:
+                self.dropped_count += len(batch)
+                logger.error(f"写入webhook归档失败: {str(e)}")
+                self._close_segment()
+        self._close_segment()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending": self._queue.qsize(),
+            "written": self.written_count,
+            "dropped": self.dropped_count,
+            "segments": self.segment_count,
+        }
+
+    def close(self, timeout: float = 5.0):
+        """写入剩余记录并关闭当前分段"""
+        self._queue.put(None)
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.warning("webhook归档线程未在超时前退出")
+
+def iter_archive(paths: Iterable[Union[str, Path]]) -> Iterator[Dict[str, Any]]:
+    """按顺序读取归档分段中的记录，忽略进程异常退出导致的不完整结尾"""
+    for path in paths:
+        try:
+            with gzip.open(path, "rb") as f:
+                for line in f:
+                    if line.strip():
+                        yield fast_json.loads(line)
+        except (EOFError, OSError) as e:
+            logger.warning(f"归档分段不完整 {path}: {str(e)}")
+
+# 旧版 log_webhook_data 写出的单个JSON文件: <日期>_<时间>_<事件类型，空格替换为下划线>.json
+_LEGACY_NAME = re.compile(r"^(\d{8}_\d{6})_(.+)\.json$")
+
+def iter_legacy_dumps(paths: Iterable[Union[str, Path]]) -> Iterator[Dict[str, Any]]:
+    """读取旧版逐条保存的JSON文件，记录格式与归档一致，时间取自文件名"""
+    for path in map(Path, paths):
+        match = _LEGACY_NAME.match(path.name)
+        if not match:
+            continue
+        try:
+            with open(path, "rb") as f:
+                data = fast_json.loads(f.read())
+        except (OSError, ValueError) as e:
+            logger.warning(f"读取webhook数据文件失败 {path}: {str(e)}")
+            continue
+        yield {
+            "ts": time.mktime(time.strptime(match.group(1), "%Y%m%d_%H%M%S")),
+            "event_type": match.group(2).replace("_", " "),
+            "data": data,
+        }
+
+def iter_payloads(paths: Iterable[Union[str, Path]]) -> Iterator[Dict[str, Any]]:
+    """
+    按时间顺序流式读取归档分段和旧版JSON文件（可以是目录）
+
+    每个分段内按写入顺序读取，多个分段（多个worker同时写入）以及旧版文件之间用堆归并，
+    内存占用只与文件数量有关
+    """
+    segments: List[Path] = []
+    legacy: List[Path] = []
+    for path in map(Path, paths):
+        files = sorted(p for p in path.rglob("*") if p.is_file()) if path.is_dir() else [path]
+        for file in files:
+            if file.name.endswith(SEGMENT_SUFFIX):
+                segments.append(file)
+            elif _LEGACY_NAME.match(file.name):
+                legacy.append(file)
+    # 旧版文件名以时间开头，按文件名排序即为时间顺序
+    sources = [iter_archive([segment]) for segment in segments]
+    if legacy:
+        sources.append(iter_legacy_dumps(sorted(legacy, key=lambda p: p.name)))
+    return heapq.merge(*sources, key=lambda record: record["ts"])
+
+payload_archive: Optional[PayloadArchive] = PayloadArchive(
+    settings.archive.path,
+    segment_size=settings.archive.segment_size,
+    max_segments=settings.archive.max_segments,
+    flush_interval=settings.archive.flush_interval,
+    max_pending=settings.archive.max_pending,
+) if settings.archive.enabled or settings.app.debug else None
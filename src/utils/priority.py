@@ -0,0 +1,33 @@
+import functools
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Collection, Hashable, Optional
+
+# 实时事件(merge/approved/评论等)优先处理；批量事件(update)和后台任务(周报、对账)让出资源
+PRIORITY_REALTIME = "realtime"
+PRIORITY_BULK = "bulk"
+
+# 当前任务的优先级，GitLab请求和企业微信消息据此选择连接配额和发送队列
+current_priority: ContextVar[str] = ContextVar("current_priority", default=PRIORITY_REALTIME)
+# 当前事件的顺序键(项目ID, MR iid)，同一MR的消息按事件顺序发送
+current_event_key: ContextVar[Optional[Hashable]] = ContextVar("current_event_key", default=None)
+
+def is_bulk() -> bool:
+    return current_priority.get() == PRIORITY_BULK
+
+def get_event_priority(data: dict, bulk_actions: Collection[str]) -> str:
+    """MR动作在bulk_actions中的事件为批量事件，其他事件(包括评论)为实时事件"""
+    if data.get("object_kind") == "merge_request":
+        if (data.get("object_attributes") or {}).get("action") in bulk_actions:
+            return PRIORITY_BULK
+    return PRIORITY_REALTIME
+
+def bulk_job(func: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+    """把后台任务标记为批量优先级，任务中发起的请求和消息都按批量处理"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        token = current_priority.set(PRIORITY_BULK)
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            current_priority.reset(token)
+    return wrapper
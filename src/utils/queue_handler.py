@@ -1,43 +1,603 @@
 import asyncio
-from typing import Any, Callable, Coroutine
+import time
 from collections import deque
+from typing import Any, Callable, Coroutine, Dict, List, Optional, Sequence, Set, Tuple
 import logging
+from src.config import settings
+from src.utils.dead_letter import KIND_EVENT, DeadLetterStore, dead_letters
+from src.utils.event_journal import EventJournal
+from src.utils.metrics import QUEUE_DEPTH, QUEUE_WAIT_CHILDREN, observe_handler
+from src.utils.priority import PRIORITY_BULK, current_event_key, current_priority, get_event_priority
+from src.utils.resilience import RetryableError, backoff_delay
+from src.utils.wechat_dispatcher import WeChatDispatcher, submitted_messages
 
 logger = logging.getLogger(__name__)
 
+class QueueFullError(Exception):
+    """队列已满，拒绝新事件"""
+    pass
+
+def get_event_key(data: dict) -> Optional[Tuple[Any, Any]]:
+    """获取事件的顺序键(项目ID, MR iid)，同一键的事件需要按到达顺序处理"""
+    project_id = (data.get("project") or {}).get("id")
+    if data.get("object_kind") == "merge_request":
+        mr_iid = (data.get("object_attributes") or {}).get("iid")
+    else:
+        mr_iid = (data.get("merge_request") or {}).get("iid")
+    if project_id is None or mr_iid is None:
+        return None
+    return project_id, mr_iid
+
+def get_event_action(data: dict) -> Optional[str]:
+    """获取MR事件的动作类型，非MR事件返回None"""
+    if data.get("object_kind") != "merge_request":
+        return None
+    return (data.get("object_attributes") or {}).get("action")
+
+class _DebouncedEvent:
+    """防抖窗口中等待合并的事件"""
+    __slots__ = ("handler", "data", "event_type", "first_seen", "timer")
+
+    def __init__(self, handler: Callable, data: dict, event_type: Optional[str]):
+        self.handler = handler
+        self.data = data
+        self.event_type = event_type
+        self.first_seen = time.monotonic()
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+class _PriorityLane:
+    """
+    单个worker的两级队列：实时事件优先，每realtime_weight个实时事件之后穿插一个批量事件
+
+    同一MR的事件始终在同一级中：实时事件到达时把该MR积压的批量事件提升到实时队列(排在它之前)，
+    该MR在实时队列中还有事件时新的批量事件也进入实时队列，保证同一MR按到达顺序处理
+    """
+
+    def __init__(self, realtime_weight: int):
+        self.realtime_weight = max(1, realtime_weight)
+        self.realtime: deque = deque()
+        self.bulk: deque = deque()
+        self.promoted_count = 0
+        self._realtime_keys: Dict[Any, int] = {}
+        self._bulk_keys: Dict[Any, int] = {}
+        self._streak = 0
+        self._unfinished = 0
+        self._ready = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    @staticmethod
+    def _count(counts: Dict[Any, int], key: Any, delta: int):
+        if key is None:
+            return
+        value = counts.get(key, 0) + delta
+        if value:
+            counts[key] = value
+        else:
+            del counts[key]
+
+    def _promote(self, key: Any):
+        """把该MR积压的批量事件按原顺序移到实时队列"""
+        remaining = deque()
+        for entry in self.bulk:
+            if entry[0] == key:
+                self.realtime.append(entry)
+                self._count(self._realtime_keys, key, 1)
+                self.promoted_count += 1
+            else:
+                remaining.append(entry)
+        self.bulk = remaining
+        del self._bulk_keys[key]
+
+    def put_nowait(self, item: tuple, key: Any, bulk: bool):
+        if bulk and key not in self._realtime_keys:
+            self.bulk.append((key, item))
+            self._count(self._bulk_keys, key, 1)
+        else:
+            if key is not None and key in self._bulk_keys:
+                self._promote(key)
+            self.realtime.append((key, item))
+            self._count(self._realtime_keys, key, 1)
+        self._unfinished += 1
+        self._idle.clear()
+        self._ready.set()
+
+    async def get(self) -> tuple:
+        while not self.realtime and not self.bulk:
+            self._ready.clear()
+            await self._ready.wait()
+        if self.realtime and (not self.bulk or self._streak < self.realtime_weight):
+            self._streak += 1
+            key, item = self.realtime.popleft()
+            self._count(self._realtime_keys, key, -1)
+        else:
+            self._streak = 0
+            key, item = self.bulk.popleft()
+            self._count(self._bulk_keys, key, -1)
+        return item
+
+    def task_done(self):
+        self._unfinished -= 1
+        if not self._unfinished:
+            self._idle.set()
+
+    async def join(self):
+        await self._idle.wait()
+
+    def qsize(self) -> int:
+        return len(self.realtime) + len(self.bulk)
+
 class WebhookQueue:
-    def __init__(self):
-        self.queue = deque()
-        self.is_processing = False
-        self._task = None
-        logger.info("WebhookQueue 初始化完成")
-
-    async def add_task(self, handler: Callable[[dict], Coroutine[Any, Any, None]], data: dict):
-        """添加任务到队列"""
-        self.queue.append((handler, data))
-        logger.info(f"新任务已添加到队列，当前队列长度: {len(self.queue)}")
-        
-        if not self.is_processing:
-            logger.info("启动队列处理器")
-            self._task = asyncio.create_task(self._process_queue())
-
-    async def _process_queue(self):
-        """处理队列中的任务"""
-        self.is_processing = True
-        logger.info("开始处理队列任务")
-        
+    def __init__(
+        self,
+        workers: int = 1,
+        capacity: int = 0,
+        high_watermark: int = 0,
+        low_watermark: int = 0,
+        shed_actions: Sequence[str] = (),
+        debounce_window: float = 0,
+        debounce_max_wait: float = 0,
+        debounce_actions: Sequence[str] = (),
+        bulk_actions: Sequence[str] = (),
+        realtime_weight: int = 8,
+        max_attempts: int = 1,
+        retry_base_delay: float = 1,
+        retry_max_delay: float = 60,
+        dead_letters: Optional[DeadLetterStore] = None,
+    ):
+        # 每个worker独占一条通道，事件按顺序键哈希到固定通道：同一MR串行，不同MR并行
+        self.workers = max(1, workers)
+        # capacity为0表示不限制；队列长度达到高水位后丢弃低价值事件，回落到低水位后恢复
+        self.capacity = capacity
+        self.high_watermark = high_watermark or capacity
+        self.low_watermark = min(low_watermark, self.high_watermark)
+        self.shed_actions = frozenset(shed_actions)
+        self.shedding = False
+        # 同一MR在防抖窗口内的连续事件(默认update)只保留最新一条；同一MR的其他事件会先冲刷窗口，保证顺序
+        self.debounce_window = debounce_window
+        self.debounce_max_wait = max(debounce_max_wait, debounce_window)
+        self.debounce_actions = frozenset(debounce_actions)
+        self.debounced_count = 0
+        self._debounced: Dict[Tuple[Any, Any], _DebouncedEvent] = {}
+        # 批量事件(默认update)在每条通道中排在实时事件之后
+        self.bulk_actions = frozenset(bulk_actions)
+        self.realtime_weight = realtime_weight
+        # GitLab/企业微信暂时不可用导致的失败按指数退避重新入队，等待期间不占用worker；
+        # 尝试max_attempts次仍失败、或不可重试的错误转入死信(未启用死信时丢弃)，都会确认日志中的事件，不再重放。
+        # 重试等待期间同一MR的后续事件暂存在_parked中，重试结束后按到达顺序处理，保证同一MR不乱序
+        self.max_attempts = max(1, max_attempts)
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.dead_letters = dead_letters
+        self.retried_count = 0
+        self.dead_lettered_count = 0
+        self._retry_timers: Dict[int, Tuple[asyncio.TimerHandle, Optional[int]]] = {}
+        self._parked: Dict[Tuple[Any, Any], deque] = {}
+        self._next_retry_id = 0
+        self.accepted_count = 0
+        self.shed_count = 0
+        self.rejected_count = 0
+        self.max_depth = 0
+        self.journal: Optional[EventJournal] = None
+        # 本进程持有的日志事件，定期续约
+        self._held: Set[int] = set()
+        # 启用限流分发器时，事件提交的消息发出后才确认日志
+        self.dispatcher: Optional[WeChatDispatcher] = None
+        self._delivery_tasks: Set[asyncio.Task] = set()
+        self._resolve_handler: Optional[Callable[[str], Optional[Callable]]] = None
+        self._lanes: List[_PriorityLane] = []
+        self._tasks: List[asyncio.Task] = []
+        self._sweeper: Optional[asyncio.Task] = None
+        self._next_lane = 0
+        logger.info(f"WebhookQueue 初始化完成，worker数量: {self.workers}，容量: {self.capacity or '不限'}")
+
+    def _ensure_workers(self):
+        """在事件循环中按需启动worker"""
+        if self._tasks:
+            return
+        logger.info("启动队列处理器")
+        self._lanes = [_PriorityLane(self.realtime_weight) for _ in range(self.workers)]
+        self._tasks = [asyncio.create_task(self._process_lane(i)) for i in range(self.workers)]
+        if self.journal is not None:
+            self._sweeper = asyncio.create_task(self._sweep_journal())
+
+    def attach_journal(
+        self,
+        journal: EventJournal,
+        resolve_handler: Callable[[str], Optional[Callable]],
+        dispatcher: Optional[WeChatDispatcher] = None,
+    ):
+        """
+        启用持久化事件日志
+
+        Args:
+            journal: 事件日志
+            resolve_handler: 根据事件类型获取处理函数，用于重放日志中的事件
+            dispatcher: 企业微信限流分发器，处理函数返回时消息只是进入了发送队列，发出后才确认事件
+        """
+        self.journal = journal
+        self._resolve_handler = resolve_handler
+        self.dispatcher = dispatcher
+
+    async def replay_journal(self) -> int:
+        """认领并重放日志中未确认的事件，返回重放数量"""
+        if self.journal is None:
+            return 0
+        self._ensure_workers()
+        replayed = 0
+        while True:
+            events = self.journal.claim_orphans()
+            for event_id, event_type, data in events:
+                self._held.add(event_id)
+                handler = self._resolve_handler(event_type)
+                if handler is None:
+                    logger.warning(f"无法重放不支持的事件类型: {event_type}")
+                    self._ack(event_id)
+                    continue
+                self._put(self._select_lane(data), handler, data, event_type, event_id)
+                replayed += 1
+            if not events:
+                break
+        if replayed:
+            logger.info(f"已从事件日志重放 {replayed} 个事件")
+        return replayed
+
+    async def _sweep_journal(self):
+        """定期续约本进程持有的事件，并认领其他worker遗留或租约过期的事件"""
+        interval = max(1.0, self.journal.lease_seconds / 2)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.journal.renew(self._held)
+                await self.replay_journal()
+            except Exception as e:
+                logger.error(f"重放事件日志时出错: {str(e)}", exc_info=True)
+
+    def _ack(self, journal_id: Optional[int]):
+        if journal_id is not None:
+            self._held.discard(journal_id)
+            self.journal.ack(journal_id)
+
+    def _ack_delivered(self, journal_id: Optional[int], messages: List[int]):
+        """处理成功：提交的消息都已发出时立即确认，否则等待分发器发出后再确认"""
+        if journal_id is None:
+            return
+        if self.dispatcher is None or self.dispatcher.is_settled(messages):
+            self._ack(journal_id)
+            return
+        task = asyncio.create_task(self._ack_when_delivered(journal_id, messages))
+        self._delivery_tasks.add(task)
+        task.add_done_callback(self._delivery_tasks.discard)
+
+    async def _ack_when_delivered(self, journal_id: int, messages: List[int]):
+        try:
+            await self.dispatcher.wait_settled(messages)
+        except asyncio.CancelledError:
+            # 停止时消息仍未发出，由其他worker或重启后重放
+            self._release(journal_id)
+            raise
+        self._ack(journal_id)
+
+    def _release(self, journal_id: Optional[int]):
+        if journal_id is not None:
+            self._held.discard(journal_id)
+            self.journal.release(journal_id)
+
+    def _select_lane(self, data: dict) -> int:
+        """根据顺序键选择通道，无法识别MR的事件轮询分配"""
+        key = get_event_key(data)
+        if key is None:
+            self._next_lane = (self._next_lane + 1) % self.workers
+            return self._next_lane
+        return hash(key) % self.workers
+
+    def parked_count(self) -> int:
+        """等待同一MR的重试结束的事件数"""
+        return sum(len(items) for items in self._parked.values())
+
+    def qsize(self) -> int:
+        """当前排队中的任务总数（包括等待同一MR重试结束的事件）"""
+        return sum(lane.qsize() for lane in self._lanes) + self.parked_count()
+
+    def _update_shedding(self, depth: int):
+        """根据高低水位更新丢弃状态"""
+        if not self.high_watermark:
+            return
+        if self.shedding and depth <= self.low_watermark:
+            self.shedding = False
+            logger.info(f"队列长度回落到 {depth}，停止丢弃低价值事件")
+        elif not self.shedding and depth >= self.high_watermark:
+            self.shedding = True
+            logger.warning(f"队列长度达到 {depth}，开始丢弃低价值事件")
+
+    def stats(self) -> Dict[str, Any]:
+        """队列状态统计"""
+        return {
+            "depth": self.qsize(),
+            "bulk_depth": sum(len(lane.bulk) for lane in self._lanes),
+            "promoted": sum(lane.promoted_count for lane in self._lanes),
+            "max_depth": self.max_depth,
+            "capacity": self.capacity,
+            "workers": self.workers,
+            "shedding": self.shedding,
+            "accepted": self.accepted_count,
+            "shed": self.shed_count,
+            "rejected": self.rejected_count,
+            "debounce_pending": len(self._debounced),
+            "debounced": self.debounced_count,
+            "retry_pending": len(self._retry_timers),
+            "parked": self.parked_count(),
+            "retried": self.retried_count,
+            "dead_lettered": self.dead_lettered_count,
+            "journal_pending": self.journal.pending_count() if self.journal else None,
+        }
+
+    async def add_task(
+        self,
+        handler: Callable[[dict], Coroutine[Any, Any, None]],
+        data: dict,
+        event_type: Optional[str] = None,
+    ) -> bool:
+        """
+        添加任务到队列
+
+        启用事件日志且提供了event_type时，事件先写入日志，处理成功后才确认；
+        处于防抖窗口中的事件在窗口结束、被冲刷入队时才写入日志
+
+        Returns:
+            bool: 成功入队（或进入防抖窗口）返回True，作为低价值事件被丢弃返回False
+
+        Raises:
+            QueueFullError: 队列已达到容量上限
+        """
+        self._ensure_workers()
+        key = get_event_key(data)
+        if key is not None:
+            if self.debounce_window and get_event_action(data) in self.debounce_actions:
+                self._debounce(key, handler, data, event_type)
+                return True
+            if key in self._debounced:
+                # 同一MR的后续事件（如merge/close）到达，先冲刷窗口中的事件以保持顺序
+                self._flush_debounced(key)
+        return self._enqueue(handler, data, event_type)
+
+    def _debounce(self, key: Tuple[Any, Any], handler: Callable, data: dict, event_type: Optional[str]):
+        """事件进入防抖窗口，替换同一MR窗口中较旧的事件"""
+        pending = self._debounced.get(key)
+        if pending is None:
+            pending = self._debounced[key] = _DebouncedEvent(handler, data, event_type)
+        else:
+            pending.timer.cancel()
+            pending.handler, pending.data, pending.event_type = handler, data, event_type
+            self.debounced_count += 1
+            logger.info(f"合并MR {key} 的连续更新事件，累计合并: {self.debounced_count}")
+        # 窗口随新事件顺延，但从第一条事件起最多等待debounce_max_wait秒
+        delay = min(self.debounce_window, pending.first_seen + self.debounce_max_wait - time.monotonic())
+        pending.timer = asyncio.get_running_loop().call_later(max(0.0, delay), self._flush_debounced, key)
+
+    def _flush_debounced(self, key: Tuple[Any, Any]):
+        """把防抖窗口中的事件放入处理队列"""
+        pending = self._debounced.pop(key, None)
+        if pending is None:
+            return
+        pending.timer.cancel()
+        try:
+            self._enqueue(pending.handler, pending.data, pending.event_type)
+        except QueueFullError:
+            logger.warning(f"队列已满，丢弃MR {key} 合并后的事件")
+
+    def _enqueue(self, handler: Callable, data: dict, event_type: Optional[str]) -> bool:
+        """按容量和水位检查后放入处理通道"""
+        depth = self.qsize()
+        self._update_shedding(depth)
+
+        if self.capacity and depth >= self.capacity:
+            self.rejected_count += 1
+            raise QueueFullError(f"Webhook queue is full ({depth}/{self.capacity})")
+
+        if self.shedding and get_event_action(data) in self.shed_actions:
+            self.shed_count += 1
+            logger.warning(f"队列繁忙，丢弃低价值事件: {get_event_action(data)}，累计丢弃: {self.shed_count}")
+            return False
+
+        journal_id = None
+        if self.journal is not None and event_type is not None:
+            journal_id = self.journal.append(event_type, data)
+            self._held.add(journal_id)
+
+        index = self._select_lane(data)
+        self._put(index, handler, data, event_type, journal_id)
+        self.accepted_count += 1
+        self.max_depth = max(self.max_depth, depth + 1)
+        logger.info(f"新任务已添加到通道 {index}，当前队列长度: {depth + 1}")
+        return True
+
+    def _put(
+        self,
+        index: int,
+        handler: Callable,
+        data: dict,
+        event_type: Optional[str],
+        journal_id: Optional[int],
+        attempts: int = 1,
+    ):
+        """按优先级放入处理通道，记录入队时间用于统计排队耗时"""
+        priority = get_event_priority(data, self.bulk_actions)
+        self._lanes[index].put_nowait(
+            (handler, data, event_type, journal_id, time.monotonic(), attempts, priority),
+            get_event_key(data),
+            priority == PRIORITY_BULK,
+        )
+        QUEUE_DEPTH.inc()
+
+    async def _process_lane(self, index: int):
+        """处理单个通道中的任务"""
+        lane = self._lanes[index]
+        while True:
+            item = await lane.get()
+            QUEUE_DEPTH.dec()
+            try:
+                key = get_event_key(item[1])
+                attempts = item[5]
+                if key in self._parked and attempts == 1:
+                    # 该MR有事件在等待重试，后续事件暂存，避免先于失败的事件处理
+                    self._parked[key].append(item)
+                    logger.info(f"MR {key} 有事件等待重试，暂存后续事件")
+                    continue
+                retrying = await self._run(index, item)
+                if key in self._parked and attempts > 1 and not retrying:
+                    await self._release_parked(index, key)
+            finally:
+                lane.task_done()
+
+    async def _run(self, index: int, item: tuple) -> bool:
+        """处理一个任务，失败后等待重试时返回True"""
+        handler, data, event_type, journal_id, enqueued_at, attempts, priority = item
+        started_at = time.monotonic()
+        QUEUE_WAIT_CHILDREN[priority].observe(started_at - enqueued_at)
+        logger.info(f"通道 {index} 正在处理任务，剩余任务数: {self._lanes[index].qsize()}")
+        # 批量事件发起的GitLab请求和企业微信消息同样按低优先级处理
+        token = current_priority.set(priority)
+        key_token = current_event_key.set(get_event_key(data))
+        messages: List[int] = []
+        messages_token = submitted_messages.set(messages)
         try:
-            while self.queue:
-                handler, data = self.queue.popleft()
-                logger.info(f"正在处理任务，剩余任务数: {len(self.queue)}")
-                
-                try:
-                    await handler(data)
-                    logger.info("任务处理成功")
-                except Exception as e:
-                    logger.error(f"处理webhook消息时出错: {str(e)}", exc_info=True)
+            await handler(data)
+            observe_handler(data, time.monotonic() - started_at)
+            logger.info("任务处理成功")
+            self._ack_delivered(journal_id, messages)
+            return False
+        except Exception as e:
+            observe_handler(data, time.monotonic() - started_at, failed=True)
+            return self._handle_failure(index, handler, data, event_type, journal_id, attempts, e)
         finally:
-            self.is_processing = False
-            logger.info("队列处理完成")
+            submitted_messages.reset(messages_token)
+            current_event_key.reset(key_token)
+            current_priority.reset(token)
+
+    async def _release_parked(self, index: int, key: Tuple[Any, Any]):
+        """重试结束（成功或转入死信）后按到达顺序处理暂存的事件，其中有事件需要重试时剩余的继续暂存"""
+        parked = self._parked.pop(key)
+        while parked:
+            if await self._run(index, parked.popleft()):
+                self._parked[key].extend(parked)
+                return
+
+    def _handle_failure(
+        self,
+        index: int,
+        handler: Callable,
+        data: dict,
+        event_type: Optional[str],
+        journal_id: Optional[int],
+        attempts: int,
+        error: Exception,
+    ) -> bool:
+        """处理失败的任务：可重试的错误延迟重新入队(返回True)，否则转入死信并确认日志中的事件"""
+        if isinstance(error, RetryableError) and attempts < self.max_attempts:
+            delay = backoff_delay(attempts, self.retry_base_delay, self.retry_max_delay, error.retry_after)
+            logger.warning(f"处理webhook消息失败(第 {attempts} 次): {str(error)}，{delay:.1f} 秒后重试")
+            retry_id = self._next_retry_id
+            self._next_retry_id += 1
+            # 日志中的事件保持由本进程持有并续约，重试期间不会被其他worker认领
+            if journal_id is not None:
+                self.journal.renew([journal_id])
+            timer = asyncio.get_running_loop().call_later(
+                delay, self._retry, retry_id, index, handler, data, event_type, journal_id, attempts + 1
+            )
+            self._retry_timers[retry_id] = (timer, journal_id)
+            self.retried_count += 1
+            key = get_event_key(data)
+            if key is not None:
+                self._parked.setdefault(key, deque())
+            return True
+
+        logger.error(f"处理webhook消息时出错: {str(error)}", exc_info=error)
+        if self.dead_letters is not None and event_type is not None:
+            self.dead_letters.add(KIND_EVENT, data, f"{type(error).__name__}: {error}", attempts, event_type)
+            self.dead_lettered_count += 1
+        elif journal_id is not None:
+            logger.error(f"未启用死信，丢弃处理失败的事件 {journal_id}({event_type})")
+        # 不可重试的错误(如代码缺陷)重放也会失败，重试用完的事件已转入死信，都不再由日志重放
+        self._ack(journal_id)
+        return False
+
+    def _retry(
+        self,
+        retry_id: int,
+        index: int,
+        handler: Callable,
+        data: dict,
+        event_type: Optional[str],
+        journal_id: Optional[int],
+        attempts: int,
+    ):
+        """退避结束，重新放入原通道（不检查容量，已接收的事件不丢弃）"""
+        del self._retry_timers[retry_id]
+        if not self._lanes:
+            return
+        self._put(index, handler, data, event_type, journal_id, attempts)
+
+    async def join(self):
+        """等待当前所有任务处理完成"""
+        await asyncio.gather(*(lane.join() for lane in self._lanes))
+
+    async def stop(self, timeout: float = 10.0):
+        """冲刷防抖窗口并等待剩余任务处理完成、已处理事件的消息发出（最多timeout秒）后停止worker"""
+        if not self._tasks:
+            return
+        deadline = time.monotonic() + timeout
+        for key in list(self._debounced):
+            self._flush_debounced(key)
+        try:
+            await asyncio.wait_for(self.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"停止队列时仍有 {self.qsize()} 个任务未处理")
+        if self._delivery_tasks:
+            _, pending = await asyncio.wait(set(self._delivery_tasks), timeout=max(0.0, deadline - time.monotonic()))
+            if pending:
+                logger.warning(f"停止队列时仍有 {len(pending)} 个事件的消息未发出，释放后重放")
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+        if self._retry_timers:
+            # 启用事件日志时未确认的事件会被释放，由其他worker或重启后重放
+            logger.warning(f"停止队列时仍有 {len(self._retry_timers)} 个任务等待重试")
+            for timer, journal_id in self._retry_timers.values():
+                timer.cancel()
+                self._release(journal_id)
+            self._retry_timers.clear()
+        if self._parked:
+            logger.warning(f"停止队列时仍有 {self.parked_count()} 个事件等待同一MR的重试结束")
+            for items in self._parked.values():
+                for item in items:
+                    self._release(item[3])
+            self._parked.clear()
+        for lane in self._lanes:
+            for _, item in list(lane.realtime) + list(lane.bulk):
+                self._release(item[3])
+        tasks = self._tasks + ([self._sweeper] if self._sweeper else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+        self._lanes = []
+        self._sweeper = None
+        logger.info("队列处理器已停止")
 
-webhook_queue = WebhookQueue()
\ No newline at end of file
+webhook_queue = WebhookQueue(
+    workers=settings.queue.workers,
+    capacity=settings.queue.capacity,
+    high_watermark=settings.queue.high_watermark,
+    low_watermark=settings.queue.low_watermark,
+    shed_actions=settings.queue.shed_actions,
+    debounce_window=settings.queue.debounce_window,
+    debounce_max_wait=settings.queue.debounce_max_wait,
+    debounce_actions=settings.queue.debounce_actions,
+    bulk_actions=settings.queue.bulk_actions,
+    realtime_weight=settings.queue.realtime_weight,
+    max_attempts=settings.resilience.max_attempts,
+    retry_base_delay=settings.resilience.retry_base_delay,
+    retry_max_delay=settings.resilience.retry_max_delay,
+    dead_letters=dead_letters,
+)
@@ -0,0 +1,304 @@
+import asyncio
+import heapq
+import json
+import logging
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from src.config import settings
+from src.utils.db import connect
+from src.utils.templates import REMINDER_ACTION, templates
+from src.utils.wechat_bot import WeChatBot
+
+logger = logging.getLogger(__name__)
+
+# 提醒的键: (项目ID, MR iid)
+ReminderKey = Tuple[int, int]
+
+# 发送提醒失败后重试的间隔(秒)
+SEND_RETRY_DELAY = 60
+
+class ReminderStore:
+    """
+    MR提醒的持久化存储(SQLite)，所有worker共享
+
+    到期的提醒由先删除成功(claim)的worker发送，其他worker的同一定时器自然失效
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = connect(path)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS reminders (
+                project_id INTEGER NOT NULL,
+                mr_iid INTEGER NOT NULL,
+                due_at REAL NOT NULL,
+                reminded INTEGER NOT NULL DEFAULT 0,
+                payload TEXT NOT NULL,
+                PRIMARY KEY (project_id, mr_iid)
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_reminders_due_at ON reminders (due_at)")
+        # 已评审通过的MR，撤销通过之前不再设置提醒
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS reminder_suppressions (
+                project_id INTEGER NOT NULL,
+                mr_iid INTEGER NOT NULL,
+                PRIMARY KEY (project_id, mr_iid)
+            )
+            """
+        )
+
+    def arm(self, key: ReminderKey, due_at: float, payload: dict, reset: bool = True, reminded: int = 0) -> Optional[float]:
+        """
+        设置提醒，返回生效的到期时间；MR已评审通过时不设置，返回None
+
+        Args:
+            reset: 已有提醒时是否推迟到新的到期时间，False时保留原提醒
+        """
+        conflict = (
+            "DO UPDATE SET due_at = excluded.due_at, reminded = excluded.reminded, payload = excluded.payload"
+            if reset else "DO UPDATE SET payload = excluded.payload"
+        )
+        # 检查评审通过标记和写入在同一条语句中完成，其他worker同时写入标记时不会留下提醒
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            armed = self._conn.execute(
+                f"""
+                INSERT INTO reminders (project_id, mr_iid, due_at, reminded, payload)
+                SELECT ?, ?, ?, ?, ?
+                WHERE NOT EXISTS (SELECT 1 FROM reminder_suppressions WHERE project_id = ? AND mr_iid = ?)
+                ON CONFLICT(project_id, mr_iid) {conflict}
+                """,
+                (*key, due_at, reminded, json.dumps(payload, ensure_ascii=False), *key),
+            ).rowcount > 0
+            row = self._conn.execute(
+                "SELECT due_at FROM reminders WHERE project_id = ? AND mr_iid = ?", key
+            ).fetchone() if armed else None
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+        return row[0] if row else None
+
+    def cancel(self, key: ReminderKey, suppress: bool = False) -> bool:
+        """
+        取消提醒，返回是否有被取消的提醒
+
+        Args:
+            suppress: 之后的事件也不再设置提醒，直到unsuppress
+        """
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            if suppress:
+                self._conn.execute("INSERT OR IGNORE INTO reminder_suppressions (project_id, mr_iid) VALUES (?, ?)", key)
+            cancelled = self._conn.execute("DELETE FROM reminders WHERE project_id = ? AND mr_iid = ?", key).rowcount > 0
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+        return cancelled
+
+    def unsuppress(self, key: ReminderKey):
+        self._conn.execute("DELETE FROM reminder_suppressions WHERE project_id = ? AND mr_iid = ?", key)
+
+    def is_suppressed(self, key: ReminderKey) -> bool:
+        return self._conn.execute(
+            "SELECT 1 FROM reminder_suppressions WHERE project_id = ? AND mr_iid = ?", key
+        ).fetchone() is not None
+
+    def claim(self, key: ReminderKey, due_at: float) -> Optional[Tuple[int, dict]]:
+        """
+        认领到期的提醒：删除成功时返回(已提醒次数, 数据)
+
+        提醒已被取消、推迟或由其他worker认领时返回None
+        """
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self._conn.execute(
+                "SELECT reminded, payload FROM reminders WHERE project_id = ? AND mr_iid = ? AND due_at = ?",
+                (*key, due_at),
+            ).fetchone()
+            if row is not None:
+                self._conn.execute("DELETE FROM reminders WHERE project_id = ? AND mr_iid = ?", key)
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
+
+    def due_before(self, due_at: Optional[float] = None) -> List[Tuple[float, ReminderKey]]:
+        """列出到期时间早于due_at的提醒，为空时列出全部"""
+        if due_at is None:
+            rows = self._conn.execute("SELECT due_at, project_id, mr_iid FROM reminders")
+        else:
+            rows = self._conn.execute("SELECT due_at, project_id, mr_iid FROM reminders WHERE due_at <= ?", (due_at,))
+        return [(row_due_at, (project_id, mr_iid)) for row_due_at, project_id, mr_iid in rows]
+
+    def pending_count(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM reminders").fetchone()[0]
+
+    def close(self):
+        self._conn.close()
+
+class ReminderScheduler:
+    """
+    MR超时提醒
+
+    定时器保存在最小堆中(到期时间, 键)，设置O(log n)；取消只删除字典中的记录(O(1))，
+    堆中失效的条目在到达堆顶时丢弃，失效条目过多时重建堆。只有一个等待最近到期时间的任务，
+    不轮询GitLab。启动时从存储加载全部提醒；定期扫描已过期未认领的提醒，接管已退出的worker设置的定时器
+    """
+
+    def __init__(
+        self,
+        store: ReminderStore,
+        timeout: float = 86400,
+        max_reminders: int = 1,
+        sweep_interval: float = 300,
+    ):
+        self.store = store
+        self.timeout = timeout
+        self.max_reminders = max(1, max_reminders)
+        self.sweep_interval = sweep_interval
+        self.sent_count = 0
+        self._heap: List[Tuple[float, ReminderKey]] = []
+        self._due: Dict[ReminderKey, float] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def _push(self, key: ReminderKey, due_at: float):
+        """加入本地定时器"""
+        self._due[key] = due_at
+        heapq.heappush(self._heap, (due_at, key))
+        if len(self._heap) > 2 * len(self._due) + 1024:
+            self._heap = [(due, timer_key) for timer_key, due in self._due.items()]
+            heapq.heapify(self._heap)
+        if self._wakeup is not None and self._heap[0][1] == key:
+            self._wakeup.set()
+
+    def arm(self, key: ReminderKey, payload: dict, reset: bool = True):
+        """
+        设置MR的提醒，timeout秒后仍未取消时发送
+
+        Args:
+            payload: 提醒消息的模板字段值和机器人key: {"values": {...}, "bot_keys": [...]}
+            reset: 已有提醒时推迟到timeout秒后；False时保留原到期时间(只更新消息内容)
+        """
+        due_at = self.store.arm(key, time.time() + self.timeout, payload, reset=reset)
+        if due_at is not None and self._due.get(key) != due_at:
+            self._push(key, due_at)
+
+    def cancel(self, key: ReminderKey, suppress: bool = False):
+        """
+        取消MR的提醒，本地堆中的条目在到期时丢弃
+
+        Args:
+            suppress: MR已评审通过，之后的update等事件不再重新设置提醒，直到unsuppress
+        """
+        self._due.pop(key, None)
+        if self.store.cancel(key, suppress=suppress):
+            logger.info(f"已取消MR {key} 的超时提醒")
+
+    def unsuppress(self, key: ReminderKey):
+        """MR撤销评审通过、合并、关闭或重新打开，允许重新设置提醒(关闭的MR不再保留标记)"""
+        self.store.unsuppress(key)
+
+    async def start(self):
+        """加载未完成的提醒并启动定时任务"""
+        if self._task is not None:
+            return
+        self._wakeup = asyncio.Event()
+        for due_at, key in self.store.due_before():
+            self._due[key] = due_at
+            self._heap.append((due_at, key))
+        heapq.heapify(self._heap)
+        if self._due:
+            logger.info(f"已加载 {len(self._due)} 个MR超时提醒")
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        next_sweep = time.time() + self.sweep_interval
+        while True:
+            # 丢弃已取消或已推迟的条目
+            while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+                heapq.heappop(self._heap)
+            now = time.time()
+            if now >= next_sweep:
+                self._sweep(now)
+                next_sweep = now + self.sweep_interval
+                continue
+            wait_until = min(self._heap[0][0], next_sweep) if self._heap else next_sweep
+            if wait_until > now:
+                # 用定时回调唤醒而不是wait_for：事件与取消同时发生时wait_for可能吞掉取消
+                self._wakeup.clear()
+                timer = asyncio.get_running_loop().call_later(wait_until - now, self._wakeup.set)
+                try:
+                    await self._wakeup.wait()
+                finally:
+                    timer.cancel()
+                continue
+
+            due_at, key = heapq.heappop(self._heap)
+            del self._due[key]
+            try:
+                await self._fire(key, due_at)
+            except Exception as e:
+                logger.error(f"发送MR {key} 的超时提醒时出错: {str(e)}", exc_info=True)
+
+    def _sweep(self, now: float):
+        """接管超过一个扫描周期仍未认领的提醒(设置它的worker可能已退出)"""
+        for due_at, key in self.store.due_before(now - self.sweep_interval):
+            if key not in self._due:
+                self._push(key, due_at)
+
+    async def _fire(self, key: ReminderKey, due_at: float):
+        claimed = self.store.claim(key, due_at)
+        if claimed is None:
+            return
+        reminded, payload = claimed
+        try:
+            message = templates[REMINDER_ACTION].render(payload["values"])
+            await WeChatBot.broadcast(message, payload["bot_keys"])
+        except Exception as e:
+            # 发送失败时放回存储，稍后重试
+            logger.error(f"发送MR {key} 的超时提醒失败，{SEND_RETRY_DELAY} 秒后重试: {str(e)}")
+            self._restore(key, time.time() + SEND_RETRY_DELAY, payload, reminded)
+            return
+        self.sent_count += 1
+        reminded += 1
+        logger.info(f"已发送MR {key} 的第 {reminded} 次超时提醒")
+        if reminded < self.max_reminders:
+            self._restore(key, time.time() + self.timeout, payload, reminded)
+
+    def _restore(self, key: ReminderKey, due_at: float, payload: dict, reminded: int):
+        """重新设置已认领的提醒，期间有新事件重新设置过时以新的为准"""
+        due_at = self.store.arm(key, due_at, payload, reset=False, reminded=reminded)
+        if due_at is not None:
+            self._push(key, due_at)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "local_timers": len(self._due),
+            "heap_size": len(self._heap),
+            "pending": self.store.pending_count(),
+            "sent": self.sent_count,
+        }
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self.store.close()
+
+reminders: Optional[ReminderScheduler] = ReminderScheduler(
+    ReminderStore(settings.reminders.path),
+    timeout=settings.reminders.timeout,
+    max_reminders=settings.reminders.max_reminders,
+    sweep_interval=settings.reminders.sweep_interval,
+) if settings.reminders.enabled else None
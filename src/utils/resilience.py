@@ -0,0 +1,111 @@
+import logging
+import random
+import time
+from typing import Any, Dict, Optional
+from src.config import settings
+
+logger = logging.getLogger(__name__)
+
+class RetryableError(Exception):
+    """上游暂时不可用(超时、网络错误、5xx、限流)，稍后重试可能成功"""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class CircuitOpenError(RetryableError):
+    """熔断器打开，请求未发出直接失败"""
+    pass
+
+class CircuitBreaker:
+    """
+    熔断器
+
+    连续失败failure_threshold次后打开，recovery_timeout秒内的请求直接失败(不占用连接和超时时间)；
+    之后进入半开状态，只放行一个试探请求，成功则关闭，失败则重新打开。
+    调用方在before_call之后必须调用record_success/record_failure/release之一
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 5, recovery_timeout: float = 30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_count = 0
+        self.rejected_count = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+
+    def before_call(self):
+        """
+        请求前检查，熔断时抛出CircuitOpenError
+
+        Raises:
+            CircuitOpenError: 熔断器打开，或半开状态下已有试探请求
+        """
+        if self.state == self.CLOSED:
+            return
+        remaining = self._opened_at + self.recovery_timeout - time.monotonic()
+        if self.state == self.OPEN and remaining <= 0:
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return
+        self.rejected_count += 1
+        raise CircuitOpenError(f"{self.name} 熔断中", retry_after=max(remaining, 1.0))
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            logger.info(f"{self.name} 恢复，熔断器关闭")
+        self.state = self.CLOSED
+        self.failures = 0
+        self._trial_in_flight = False
+
+    def release(self):
+        """请求被取消、没有结果时释放试探名额，否则半开状态会一直拒绝后续请求"""
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._trial_in_flight = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.opened_count += 1
+                logger.warning(f"{self.name} 连续失败 {self.failures} 次，熔断 {self.recovery_timeout} 秒")
+            self.state = self.OPEN
+            self._opened_at = time.monotonic()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "opened": self.opened_count,
+            "rejected": self.rejected_count,
+        }
+
+def backoff_delay(attempt: int, base: float, cap: float, retry_after: Optional[float] = None) -> float:
+    """
+    第attempt次(从1开始)重试前的等待时间：指数退避 + 全抖动，避免大量重试同时打到刚恢复的上游
+
+    上游给出了retry_after(如熔断剩余时间)时至少等待该时间
+    """
+    delay = random.uniform(0, min(cap, base * (2 ** (attempt - 1))))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+gitlab_breaker = CircuitBreaker(
+    "GitLab API",
+    failure_threshold=settings.resilience.failure_threshold,
+    recovery_timeout=settings.resilience.recovery_timeout,
+)
+wechat_breaker = CircuitBreaker(
+    "企业微信接口",
+    failure_threshold=settings.resilience.failure_threshold,
+    recovery_timeout=settings.resilience.recovery_timeout,
+)
@@ -0,0 +1,174 @@
+import logging
+import re
+from functools import lru_cache
+from typing import Dict, FrozenSet, List, Optional, Pattern, Sequence, Tuple
+from src.config import RouteConfig, settings
+
+logger = logging.getLogger(__name__)
+
+# 会发送通知的MR动作
+MR_ACTIONS = ("open", "close", "reopen", "update", "merge", "approved", "unapproved")
+# 评论事件在路由规则中使用的动作名
+NOTE_ACTION = "note"
+
+class _CompiledRoute:
+    __slots__ = ("index", "projects", "branch_patterns", "actions", "author_ids", "author_names", "bot_keys")
+
+    def __init__(self, index: int, route: RouteConfig, bot_keys: Tuple[str, ...]):
+        self.index = index
+        self.projects = frozenset(str(project) for project in route.projects)
+        self.branch_patterns: List[Pattern] = [re.compile(pattern) for pattern in route.branches]
+        self.actions = frozenset(route.actions)
+        # 作者ID按字符串比较；非数字的条目是用户名，需要把MR的author_id解析成用户名后才能比较
+        authors = [str(author) for author in route.authors]
+        self.author_ids = frozenset(author for author in authors if author.isdigit())
+        self.author_names = frozenset(author for author in authors if not author.isdigit())
+        self.bot_keys = bot_keys
+
+    def matches_author(self, author_id: Optional[int], author_username: Optional[str], resolved: bool) -> bool:
+        """
+        是否匹配MR作者(不是操作者)
+
+        用户名未解析(resolved=False)时无法判断用户名条件，视为可能匹配，由处理时解析后再精确判断
+        """
+        if not self.author_ids and not self.author_names:
+            return True
+        if str(author_id) in self.author_ids:
+            return True
+        if author_username is not None:
+            return author_username in self.author_names
+        return bool(self.author_names) and not resolved
+
+class Router:
+    """
+    通知路由：按项目、目标分支、动作、作者匹配规则，返回需要投递的机器人key
+
+    规则在启动时编译一次：所有分支正则合并成一个正则用于快速排除不匹配的分支，
+    分支到规则集合的映射以及完整的路由结果都用LRU缓存，规则数量增加时单次匹配开销基本不变
+    """
+
+    def __init__(self, routes: Sequence[RouteConfig], bots: Dict[str, str], default_bot_key: str, cache_size: int = 4096):
+        self.routes = [
+            _CompiledRoute(index, route, self._resolve_bots(route.bots, bots, default_bot_key))
+            for index, route in enumerate(routes)
+        ]
+        self._any_branch_routes = frozenset(route.index for route in self.routes if not route.branch_patterns)
+        patterns = [pattern.pattern for route in self.routes for pattern in route.branch_patterns]
+        self._combined_pattern = self._combine(patterns)
+        self.needs_username = any(route.author_names for route in self.routes)
+        self._branch_routes = lru_cache(maxsize=cache_size)(self._match_branch)
+        self.route = lru_cache(maxsize=cache_size)(self._route)
+        logger.info(f"已编译 {len(self.routes)} 条通知路由规则")
+
+    @staticmethod
+    def _resolve_bots(names: Sequence[str], bots: Dict[str, str], default_bot_key: str) -> Tuple[str, ...]:
+        """机器人名称转换为key，未在[wechat.bots]中定义的按key本身处理，为空时使用默认机器人"""
+        if not names:
+            return (default_bot_key,)
+        return tuple(dict.fromkeys(bots.get(name, name) for name in names))
+
+    @staticmethod
+    def _combine(patterns: Sequence[str]) -> Optional[Pattern]:
+        """把所有分支正则合并成一个，用于一次匹配排除所有规则都不匹配的分支"""
+        if not patterns:
+            return None
+        try:
+            return re.compile("|".join(f"(?:{pattern})" for pattern in dict.fromkeys(patterns)))
+        except re.error:
+            # 正则中包含无法合并的写法（如重复的命名分组）时不做预过滤
+            logger.warning("分支正则无法合并，逐条匹配")
+            return None
+
+    def _match_branch(self, branch: str) -> FrozenSet[int]:
+        """获取分支匹配的规则序号"""
+        if self._combined_pattern is not None and not self._combined_pattern.match(branch):
+            return self._any_branch_routes
+        matched = {
+            route.index for route in self.routes
+            if route.branch_patterns and any(pattern.match(branch) for pattern in route.branch_patterns)
+        }
+        return self._any_branch_routes | matched
+
+    def _route(
+        self,
+        project_id: Optional[int],
+        project_path: Optional[str],
+        branch: str,
+        action: str,
+        author_id: Optional[int] = None,
+        author_username: Optional[str] = None,
+        resolved: bool = True,
+    ) -> Tuple[str, ...]:
+        """
+        获取事件需要投递的机器人key，没有匹配的规则时返回空元组
+
+        resolved=False表示作者用户名尚未解析，按用户名配置的作者条件视为匹配(用于入队前的预过滤)
+        """
+        bot_keys: Dict[str, None] = {}
+        for index in sorted(self._branch_routes(branch)):
+            route = self.routes[index]
+            if route.actions and action not in route.actions:
+                continue
+            if route.projects and str(project_id) not in route.projects and project_path not in route.projects:
+                continue
+            if not route.matches_author(author_id, author_username, resolved):
+                continue
+            bot_keys.update(dict.fromkeys(route.bot_keys))
+        return tuple(bot_keys)
+
+    def is_target_branch(self, branch: str) -> bool:
+        """分支是否被任意MR通知规则关注（用于周报等不区分动作的场景）"""
+        return any(
+            not route.actions or route.actions - {NOTE_ACTION}
+            for route in (self.routes[index] for index in self._branch_routes(branch))
+        )
+
+    @classmethod
+    def from_settings(cls) -> "Router":
+        """
+        根据配置创建路由
+
+        未配置[[routes]]时沿用原有行为：MR事件按branches_regex过滤，评论事件不过滤，都发送到默认机器人
+        """
+        routes = settings.routes or [
+            RouteConfig(branches=settings.branches_regex.versions, actions=list(MR_ACTIONS)),
+            RouteConfig(actions=[NOTE_ACTION]),
+        ]
+        return cls(routes, settings.wechat.bots, settings.wechat.bot_key)
+
+def get_author_identity(data: dict) -> Tuple[Optional[int], Optional[str]]:
+    """从webhook数据中获取MR作者的ID和用户名（用户名仅在操作者就是作者时可知）"""
+    if data.get("object_kind") == "merge_request":
+        author_id = (data.get("object_attributes") or {}).get("author_id")
+    else:
+        author_id = (data.get("merge_request") or {}).get("author_id")
+    user = data.get("user") or {}
+    username = user.get("username") if author_id is not None and user.get("id") == author_id else None
+    return author_id, username
+
+def unresolved_author(data: dict) -> Optional[int]:
+    """路由规则按用户名匹配作者、而webhook中没有MR作者的用户名(操作者不是作者)时，返回需要解析的作者ID"""
+    author_id, author_username = get_author_identity(data)
+    if author_username is None and author_id is not None and router.needs_username:
+        return author_id
+    return None
+
+def route_event(
+    data: dict, action: str, branch: str, author_username: Optional[str] = None, resolved: bool = False
+) -> Tuple[str, ...]:
+    """
+    获取webhook事件需要投递的机器人key
+
+    resolved表示已通过GitLab解析MR作者用户名(author_username，用户不存在时为None)；
+    未解析且webhook中也没有作者用户名时(入队前的预过滤，不访问GitLab)，按用户名配置的作者条件视为匹配，
+    处理时解析用户名后再精确判断
+    """
+    project = data.get("project") or {}
+    author_id, webhook_username = get_author_identity(data)
+    author_username = author_username or webhook_username
+    return router.route(
+        project.get("id"), project.get("path_with_namespace"), branch, action, author_id, author_username,
+        resolved=resolved or author_username is not None or not router.needs_username,
+    )
+
+router = Router.from_settings()
@@ -0,0 +1,116 @@
+import logging
+from string import Formatter
+from typing import Dict, FrozenSet, List, Mapping, Optional, Tuple
+from src.config import settings
+from src.utils.markdown import md
+from src.utils.router import MR_ACTIONS, NOTE_ACTION
+
+logger = logging.getLogger(__name__)
+
+# 模板中可以使用的字段
+TEMPLATE_FIELDS = frozenset((
+    "project", "branch", "title", "description", "link", "author", "reviewer", "assignee", "note", "waiting",
+))
+
+# MR超时未处理的提醒模板
+REMINDER_ACTION = "reminder"
+
+# 字段值一次性转义：企业微信消息中的双引号统一替换为单引号
+_ESCAPE_TABLE = str.maketrans({'"': "'"})
+
+def escape(value) -> str:
+    """转义单个字段值"""
+    if value is None:
+        return ""
+    return str(value).translate(_ESCAPE_TABLE)
+
+class Template:
+    """
+    预编译的消息模板
+
+    源文本使用 {字段} 占位，编译时拆分成(静态文本, 字段名)片段，渲染时只做一次拼接
+    """
+
+    __slots__ = ("name", "source", "fields", "_segments")
+
+    def __init__(self, name: str, source: str):
+        self.name = name
+        self.source = source
+        segments: List[Tuple[str, Optional[str]]] = []
+        for literal, field, format_spec, conversion in Formatter().parse(source):
+            if field is not None and (format_spec or conversion):
+                raise ValueError(f"模板 {name} 不支持格式说明: {{{field}}}")
+            if field is not None and field not in TEMPLATE_FIELDS:
+                raise ValueError(f"模板 {name} 中的字段未知: {{{field}}}")
+            segments.append((literal, field or None))
+        self._segments = tuple(segments)
+        self.fields: FrozenSet[str] = frozenset(field for _, field in segments if field)
+
+    def render(self, values: Mapping[str, object]) -> str:
+        """渲染模板，字段值在这里统一转义"""
+        parts = []
+        for literal, field in self._segments:
+            parts.append(literal)
+            if field is not None:
+                parts.append(escape(values.get(field)))
+        return "".join(parts)
+
+def _mr_header(title: md) -> md:
+    return (
+        title.bold().new_line() +
+        md("项目: {project}").quote().new_line() +
+        md("分支: {branch}").quote().new_line() +
+        md("标题: {title}").quote().new_line() +
+        md("内容：{description}").quote().new_line() +
+        md("链接: {link}").quote().new_line()
+    )
+
+def _person(label: str, field: str) -> md:
+    return md(label).info().quote() + md(f"{{{field}}}").mark().new_line()
+
+# 默认模板，与原来逐条拼接的消息格式一致
+DEFAULT_TEMPLATES: Dict[str, str] = {
+    "open": str(
+        _mr_header(md("有新的合并请求").info()) +
+        _person("申请人:", "author") + _person("评审:", "reviewer") + _person("经办人:", "assignee")
+    ),
+    "close": str(_mr_header(md("你的MR已关闭").warning()) + _person("申请人:", "author")),
+    "reopen": str(
+        _mr_header(md("你的MR已重新打开").warning()) +
+        _person("申请人:", "author") + _person("评审人:", "reviewer") + _person("经办人:", "assignee")
+    ),
+    "update": str(_mr_header(md("MR存在更新，请拨冗查看").warning()) + _person("评审:", "reviewer")),
+    "merge": str(_mr_header(md("MR请求已合并").success()) + _person("申请人:", "author")),
+    "approved": str(_mr_header(md("MR请求已评审通过，请您合并").success()) + _person("经办人:", "assignee")),
+    "unapproved": str(
+        _mr_header(md("MR请求未评审通过，请根据评审意见修改代码").error()) + _person("申请人:", "author")
+    ),
+    NOTE_ACTION: str(
+        md("你的MR有新的评论，请及时查看").error().bold().new_line() +
+        md("项目: {project}").quote().new_line() +
+        md("目标分支: {branch}").quote().new_line() +
+        md("评论内容：{note}").quote().new_line() +
+        md("MR链接: {link}").quote().new_line() +
+        _person("申请人:", "author")
+    ),
+    REMINDER_ACTION: str(
+        md("MR已超过{waiting}未处理，请尽快评审").warning().bold().new_line() +
+        md("项目: {project}").quote().new_line() +
+        md("分支: {branch}").quote().new_line() +
+        md("标题: {title}").quote().new_line() +
+        md("链接: {link}").quote().new_line() +
+        _person("评审:", "reviewer") + _person("经办人:", "assignee")
+    ),
+}
+
+def load_templates(overrides: Optional[Mapping[str, str]] = None) -> Dict[str, Template]:
+    """编译默认模板，并用配置中的[templates]覆盖"""
+    sources = dict(DEFAULT_TEMPLATES)
+    for name, source in (overrides or {}).items():
+        if name not in MR_ACTIONS and name not in (NOTE_ACTION, REMINDER_ACTION):
+            raise ValueError(f"未知的模板名称: {name}")
+        sources[name] = source
+        logger.info(f"使用自定义消息模板: {name}")
+    return {name: Template(name, source) for name, source in sources.items()}
+
+templates = load_templates(settings.templates)
@@ -1,15 +1,91 @@
-import requests
+import asyncio
+import time
+from typing import Callable, Optional, Sequence
+import httpx
 from src.config import settings
+from src.utils.http_client import create_async_client
+from src.utils.markdown import WECHAT_MARKDOWN_LIMIT
+from src.utils.dead_letter import dead_letters
+from src.utils.metrics import observe_wechat
+from src.utils.priority import current_event_key, is_bulk
+from src.utils.resilience import RetryableError, wechat_breaker
+from src.utils.wechat_dispatcher import ERRCODE_RATE_LIMITED, WeChatDispatcher
 import logging
 import json
 
 logger = logging.getLogger(__name__)
 
+# 企业微信系统繁忙，稍后重试
+ERRCODE_BUSY = -1
+
+_client: Optional[httpx.AsyncClient] = None
+# 演练模式：设置后消息交给该函数处理(内容, @用户, 机器人key)，不调用企业微信接口
+_dry_run_sink: Optional[Callable[[str, Optional[list], str], None]] = None
+
 class WeChatBot:
     @staticmethod
-    async def send_message(content: str, mentioned_users: list = None):
-        """发送企业微信机器人消息"""
-        webhook_url = f"https://qyapi.weixin.qq.com/cgi-bin/webhook/send?key={settings.wechat.bot_key}"
+    def _get_client() -> httpx.AsyncClient:
+        """获取共享的企业微信连接池客户端（首次调用时创建）"""
+        global _client
+        if _client is None or _client.is_closed:
+            _client = create_async_client(
+                base_url=settings.wechat.base_url,
+                timeout=settings.wechat.read_timeout,
+                connect_timeout=settings.wechat.connect_timeout,
+                max_connections=settings.wechat.max_connections,
+                max_keepalive_connections=settings.wechat.max_keepalive_connections,
+                http2=False,
+            )
+        return _client
+
+    @staticmethod
+    async def close():
+        """关闭共享客户端，释放连接池"""
+        global _client
+        if _client is not None:
+            await _client.aclose()
+            _client = None
+
+    @staticmethod
+    def set_dry_run(sink: Optional[Callable[[str, Optional[list], str], None]]):
+        """开启（传入处理函数）或关闭（传入None）演练模式"""
+        global _dry_run_sink
+        _dry_run_sink = sink
+
+    @staticmethod
+    async def send_message(content: str, mentioned_users: list = None, bot_key: Optional[str] = None):
+        """
+        发送企业微信机器人消息
+
+        启用限流分发器时消息进入对应机器人的发送队列后立即返回(失败由分发器重试，事件日志等消息发出后才确认)，否则直接发送；
+        后台任务和批量事件中发送的消息排在实时通知之后
+
+        Raises:
+            RetryableError: 直接发送时企业微信暂时不可用或限流，由队列稍后重试
+        """
+        bot_key = bot_key or settings.wechat.bot_key
+        if _dry_run_sink is not None:
+            _dry_run_sink(content, mentioned_users, bot_key)
+            return None
+        if wechat_dispatcher is not None:
+            await wechat_dispatcher.submit(content, mentioned_users, bot_key, bulk=is_bulk(), key=current_event_key.get())
+            return None
+        response = await WeChatBot.post_message(content, mentioned_users, bot_key)
+        if response.get('errcode') == ERRCODE_RATE_LIMITED:
+            raise RetryableError("企业微信接口限流", retry_after=60)
+        return response
+
+    @staticmethod
+    async def broadcast(content: str, bot_keys: Sequence[str], mentioned_users: list = None):
+        """并行发送同一条消息到多个机器人"""
+        await asyncio.gather(*(
+            WeChatBot.send_message(content, mentioned_users, bot_key) for bot_key in bot_keys
+        ))
+
+    @staticmethod
+    async def post_message(content: str, mentioned_users: list = None, bot_key: Optional[str] = None):
+        """立即调用企业微信接口发送消息"""
+        webhook_path = "/cgi-bin/webhook/send"
         
         # 替换内容中的双引号为单引号
         content = content.replace('"', "'")
@@ -25,20 +101,58 @@ class WeChatBot:
             message["markdown"]["mentioned_list"] = mentioned_users
             
         if settings.app.debug:
-            logger.info(f"企业微信机器人地址: {webhook_url}")
+            logger.info(f"企业微信机器人地址: {settings.wechat.base_url}{webhook_path}")
             logger.info(f"发送企业微信机器人消息: {json.dumps(message, ensure_ascii=False, indent=2)}")
         
+        wechat_breaker.before_call()
+        started_at = time.perf_counter()
         try:
-            response = requests.post(webhook_url, json=message)
+            response = await WeChatBot._get_client().post(
+                webhook_path,
+                params={"key": bot_key or settings.wechat.bot_key},
+                json=message
+            )
+            if response.status_code >= 500:
+                raise RetryableError(f"企业微信接口返回 {response.status_code}")
             response_json = response.json()
-            
-            if response.status_code != 200 or response_json.get('errcode', 0) != 0:
-                logger.error(f"发送消息失败: {response_json}")
-            else:
-                logger.info("消息发送成功")
-                
-            return response_json
-            
         except Exception as e:
+            observe_wechat(time.perf_counter() - started_at, "error")
             logger.error(f"发送消息时出错: {str(e)}", exc_info=True)
-            raise 
\ No newline at end of file
+            wechat_breaker.record_failure()
+            if isinstance(e, (httpx.HTTPError, ValueError)):
+                raise RetryableError(f"发送企业微信消息失败: {str(e)}") from e
+            raise
+        except asyncio.CancelledError:
+            wechat_breaker.release()
+            raise
+
+        errcode = response_json.get('errcode', 0)
+        observe_wechat(time.perf_counter() - started_at, str(response_json.get('errcode', response.status_code)))
+        if errcode == ERRCODE_BUSY:
+            wechat_breaker.record_failure()
+            logger.error(f"发送消息失败: {response_json}")
+            raise RetryableError(f"企业微信系统繁忙: {response_json.get('errmsg')}")
+        # 限流和参数错误等说明接口本身正常
+        wechat_breaker.record_success()
+        if response.status_code != 200 or errcode != 0:
+            logger.error(f"发送消息失败: {response_json}")
+        else:
+            logger.info("消息发送成功")
+        return response_json
+
+# 不共享令牌桶时每个worker只使用平分后的配额
+_rate_limit = settings.wechat.rate_limit if settings.wechat.rate_limit_path else settings.wechat.rate_limit / max(settings.server.workers, 1)
+
+wechat_dispatcher = WeChatDispatcher(
+    WeChatBot.post_message,
+    rate_per_minute=_rate_limit,
+    burst=_rate_limit,
+    digest_threshold=settings.wechat.digest_threshold,
+    bulk_max_wait=settings.wechat.bulk_max_wait,
+    max_bytes=WECHAT_MARKDOWN_LIMIT,
+    max_attempts=settings.resilience.max_attempts,
+    retry_base_delay=settings.resilience.retry_base_delay,
+    retry_max_delay=settings.resilience.retry_max_delay,
+    dead_letters=dead_letters,
+    shared_path=settings.wechat.rate_limit_path,
+) if settings.wechat.rate_limit > 0 else None
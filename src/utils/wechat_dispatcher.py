@@ -0,0 +1,432 @@
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, List, Optional, Set, Union
+from src.utils.db import connect
+from src.utils.dead_letter import KIND_WECHAT, DeadLetterStore
+from src.utils.markdown import md
+from src.utils.resilience import RetryableError, backoff_delay
+
+logger = logging.getLogger(__name__)
+
+# 企业微信接口频率超限错误码
+ERRCODE_RATE_LIMITED = 45009
+
+DIGEST_SEPARATOR = "\n---\n"
+# 摘要标题预留的字节数
+DIGEST_HEADER_RESERVE = 128
+
+# 设置为列表时，submit把提交的消息序号追加到其中；事件队列据此在消息发出后才确认事件日志
+submitted_messages: ContextVar[Optional[List[int]]] = ContextVar("submitted_messages", default=None)
+
+class TokenBucket:
+    """令牌桶：每分钟补充rate_per_minute个令牌，最多积累capacity个"""
+
+    def __init__(self, rate_per_minute: float, capacity: float):
+        self.rate = rate_per_minute / 60
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    @property
+    def tokens(self) -> float:
+        self._refill()
+        return self._tokens
+
+    def wait_time(self) -> float:
+        """距离下一个令牌可用的秒数"""
+        self._refill()
+        return 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+
+    def acquire(self) -> float:
+        """取一个令牌：成功返回0，否则返回距离下一个令牌可用的秒数"""
+        wait_time = self.wait_time()
+        if wait_time == 0:
+            self._tokens -= 1
+        return wait_time
+
+    def drain(self):
+        """服务端已限流，清空令牌"""
+        self._refill()
+        self._tokens = min(self._tokens, 0)
+
+class SharedTokenBucket:
+    """
+    同一主机所有进程共享的令牌桶
+
+    企业微信按机器人key限流，与进程数无关：多个worker各用一个TokenBucket时实际速率会翻倍。
+    令牌数保存在SQLite中，补充和扣减在同一个写事务内完成，按墙上时间补充令牌
+    """
+
+    def __init__(self, conn: sqlite3.Connection, bot_key: str, rate_per_minute: float, capacity: float):
+        self.rate = rate_per_minute / 60
+        self.capacity = capacity
+        self._conn = conn
+        # 不在数据库中保存机器人key
+        self._name = hashlib.sha256(bot_key.encode("utf-8")).hexdigest()[:16]
+
+    def _refilled(self, row: Optional[tuple], now: float) -> float:
+        return self.capacity if row is None else min(self.capacity, row[0] + max(now - row[1], 0) * self.rate)
+
+    def _update(self, take: bool = False, drain: bool = False) -> float:
+        """补充令牌并按需扣减，返回扣减前的令牌数"""
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self._conn.execute("SELECT tokens, updated_at FROM token_buckets WHERE name = ?", (self._name,)).fetchone()
+            now = time.time()
+            tokens = self._refilled(row, now)
+            remaining = tokens
+            if take and tokens >= 1:
+                remaining -= 1
+            if drain:
+                remaining = min(remaining, 0)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO token_buckets (name, tokens, updated_at) VALUES (?, ?, ?)",
+                (self._name, remaining, now),
+            )
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+        return tokens
+
+    @property
+    def tokens(self) -> float:
+        """当前令牌数(只读查询，不开启写事务)"""
+        row = self._conn.execute("SELECT tokens, updated_at FROM token_buckets WHERE name = ?", (self._name,)).fetchone()
+        return self._refilled(row, time.time())
+
+    def acquire(self) -> float:
+        """取一个令牌：成功返回0，否则返回距离下一个令牌可用的秒数"""
+        tokens = self._update(take=True)
+        return 0.0 if tokens >= 1 else (1 - tokens) / self.rate
+
+    def drain(self):
+        self._update(drain=True)
+
+class _PendingMessage:
+    __slots__ = ("seq", "content", "mentioned_users", "bulk", "key", "enqueued_at", "size", "attempts")
+
+    def __init__(
+        self, seq: int, content: str, mentioned_users: Optional[list], bulk: bool = False, key: Optional[Hashable] = None
+    ):
+        self.seq = seq
+        self.key = key
+        self.content = content
+        self.mentioned_users = mentioned_users
+        self.bulk = bulk
+        self.enqueued_at = time.monotonic()
+        self.size = len(content.encode("utf-8"))
+        self.attempts = 0
+
+class _BotChannel:
+    """单个机器人key的发送状态"""
+
+    def __init__(self, bucket: Union[TokenBucket, SharedTokenBucket]):
+        self.bucket = bucket
+        self.pending: Deque[_PendingMessage] = deque()
+        # 周报等后台任务的消息，实时通知发完后才发送
+        self.bulk: Deque[_PendingMessage] = deque()
+        self.wakeup = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+class WeChatDispatcher:
+    """
+    按机器人key限流的企业微信消息分发器
+
+    每个key一个令牌桶（企业微信群机器人限制约20条/分钟），配置shared_path时同一主机的所有worker共享令牌桶。令牌充足时逐条发送；
+    令牌不足digest_threshold时把待发送的多条通知合并成不超过max_bytes的摘要消息，
+    被服务端限流(45009)的消息放回队首等待重发，而不是丢弃；批量消息只在没有待发送的实时通知、
+    或已等待bulk_max_wait秒时发送，同一MR(key)的实时通知会把之前的批量消息带到自己前面，保持事件顺序；
+    接口暂时不可用(超时、5xx、熔断)时按指数退避重发，尝试max_attempts次仍失败或返回其他错误码的消息转入死信
+    """
+
+    def __init__(
+        self,
+        sender: Callable[[str, Optional[list], str], Awaitable[dict]],
+        rate_per_minute: float = 20,
+        burst: float = 20,
+        digest_threshold: float = 5,
+        bulk_max_wait: float = 60,
+        max_bytes: int = 4096,
+        max_attempts: int = 1,
+        retry_base_delay: float = 1,
+        retry_max_delay: float = 60,
+        dead_letters: Optional[DeadLetterStore] = None,
+        shared_path: Optional[str] = None,
+    ):
+        self._sender = sender
+        self.rate_per_minute = rate_per_minute
+        self.burst = burst
+        self.digest_threshold = digest_threshold
+        self.bulk_max_wait = bulk_max_wait
+        self.max_bytes = max_bytes
+        self.max_attempts = max(1, max_attempts)
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.dead_letters = dead_letters
+        self._channels: Dict[str, _BotChannel] = {}
+        self._conn = None
+        if shared_path:
+            self._conn = connect(shared_path)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS token_buckets (name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+        self.sent_count = 0
+        self.digest_count = 0
+        self.merged_count = 0
+        self.rate_limited_count = 0
+        self.failed_count = 0
+        self.retried_count = 0
+        self.dead_lettered_count = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self._delivered = 0
+        # 提交序号：已提交的消息数和尚未发出(也未转入死信)的消息序号
+        self.submitted = 0
+        self._unsettled: Set[int] = set()
+        self._waiters: Dict[int, List[asyncio.Future]] = {}
+
+    async def submit(
+        self,
+        content: str,
+        mentioned_users: Optional[list],
+        bot_key: str,
+        bulk: bool = False,
+        key: Optional[Hashable] = None,
+    ):
+        """提交待发送消息，立即返回；key为消息所属的MR，同一key的消息按提交顺序发送"""
+        channel = self._channels.get(bot_key)
+        if channel is None:
+            if self._conn is not None:
+                bucket = SharedTokenBucket(self._conn, bot_key, self.rate_per_minute, self.burst)
+            else:
+                bucket = TokenBucket(self.rate_per_minute, self.burst)
+            channel = self._channels[bot_key] = _BotChannel(bucket)
+        if channel.task is None or channel.task.done():
+            channel.task = asyncio.create_task(self._run(bot_key, channel))
+        self.submitted += 1
+        self._unsettled.add(self.submitted)
+        messages = submitted_messages.get()
+        if messages is not None:
+            messages.append(self.submitted)
+        message = _PendingMessage(self.submitted, content, mentioned_users, bulk, key)
+        if bulk:
+            channel.bulk.append(message)
+        else:
+            if key is not None:
+                self._promote(channel, key)
+            channel.pending.append(message)
+        channel.wakeup.set()
+
+    @staticmethod
+    def _promote(channel: _BotChannel, key: Hashable):
+        """同一MR的批量消息移到实时队列，排在新的实时通知之前"""
+        if not any(item.key == key for item in channel.bulk):
+            return
+        remaining: Deque[_PendingMessage] = deque()
+        for item in channel.bulk:
+            if item.key == key:
+                item.bulk = False
+                channel.pending.append(item)
+            else:
+                remaining.append(item)
+        channel.bulk = remaining
+
+    def _take_batch(self, channel: _BotChannel) -> List[_PendingMessage]:
+        """取出下一次发送的消息：实时通知优先；令牌充足时取一条，否则尽量合并同一优先级的多条"""
+        queue = channel.pending or channel.bulk
+        if channel.pending and channel.bulk and time.monotonic() - channel.bulk[0].enqueued_at >= self.bulk_max_wait:
+            # 批量消息等待过久，不再让路
+            queue = channel.bulk
+        batch = [queue.popleft()]
+        # 本次发送的令牌已经取走
+        if channel.bucket.tokens + 1 >= self.digest_threshold:
+            return batch
+        size = batch[0].size
+        while queue:
+            next_size = queue[0].size + len(DIGEST_SEPARATOR.encode("utf-8"))
+            if size + next_size + DIGEST_HEADER_RESERVE > self.max_bytes:
+                break
+            batch.append(queue.popleft())
+            size += next_size
+        return batch
+
+    @staticmethod
+    def _render_batch(batch: List[_PendingMessage]):
+        """渲染合并后的摘要消息"""
+        if len(batch) == 1:
+            return batch[0].content, batch[0].mentioned_users
+        header = str(md(f"消息较多，以下{len(batch)}条通知合并发送").comment().bold().new_line())
+        content = header + DIGEST_SEPARATOR.join(item.content for item in batch)
+        mentioned_users = []
+        for item in batch:
+            for user in item.mentioned_users or []:
+                if user not in mentioned_users:
+                    mentioned_users.append(user)
+        return content, mentioned_users or None
+
+    async def _run(self, bot_key: str, channel: _BotChannel):
+        """单个机器人key的发送循环"""
+        while True:
+            while not channel.pending and not channel.bulk:
+                channel.wakeup.clear()
+                await channel.wakeup.wait()
+
+            wait_time = channel.bucket.acquire()
+            if wait_time > 0:
+                # 等待令牌期间新到的消息会一起合并
+                await asyncio.sleep(wait_time)
+                continue
+
+            batch = self._take_batch(channel)
+            content, mentioned_users = self._render_batch(batch)
+            for item in batch:
+                item.attempts += 1
+            try:
+                response = await self._sender(content, mentioned_users, bot_key)
+            except RetryableError as e:
+                attempts = max(item.attempts for item in batch)
+                if attempts < self.max_attempts:
+                    # 放回队首，退避期间不消耗令牌；同一机器人的后续消息保持顺序
+                    self.retried_count += 1
+                    self._requeue(channel, batch)
+                    delay = backoff_delay(attempts, self.retry_base_delay, self.retry_max_delay, e.retry_after)
+                    logger.warning(f"发送企业微信消息失败: {str(e)}，{delay:.1f} 秒后重发 {len(batch)} 条通知")
+                    await asyncio.sleep(delay)
+                    continue
+                self._fail(batch, bot_key, str(e))
+                continue
+            except Exception as e:
+                self._fail(batch, bot_key, f"{type(e).__name__}: {e}")
+                continue
+
+            errcode = (response or {}).get("errcode", 0)
+            if errcode == ERRCODE_RATE_LIMITED:
+                self.rate_limited_count += 1
+                channel.bucket.drain()
+                self._requeue(channel, batch)
+                logger.warning(f"企业微信接口限流，{len(channel.pending) + len(channel.bulk)} 条通知等待重发")
+                continue
+            if errcode != 0:
+                # 无效的key、内容格式错误等，重发不会成功
+                self._fail(batch, bot_key, f"errcode {errcode}: {response.get('errmsg')}")
+                continue
+
+            now = time.monotonic()
+            for item in batch:
+                latency = now - item.enqueued_at
+                self.latency_total += latency
+                self.latency_max = max(self.latency_max, latency)
+            self._delivered += len(batch)
+            self._settle(batch)
+            self.sent_count += 1
+            if len(batch) > 1:
+                self.digest_count += 1
+                self.merged_count += len(batch)
+                logger.info(f"已合并发送 {len(batch)} 条通知")
+
+    @staticmethod
+    def _requeue(channel: _BotChannel, batch: List[_PendingMessage]):
+        """放回原优先级的队首；发送期间同一MR有了实时通知时放回实时队列，仍排在它前面"""
+        if batch[0].bulk:
+            keys = {item.key for item in batch if item.key is not None}
+            if not any(item.key in keys for item in channel.pending):
+                channel.bulk.extendleft(reversed(batch))
+                return
+            for item in batch:
+                item.bulk = False
+        channel.pending.extendleft(reversed(batch))
+
+    def _fail(self, batch: List[_PendingMessage], bot_key: str, error: str):
+        """发送失败的消息逐条转入死信，未启用死信时丢弃"""
+        self.failed_count += len(batch)
+        self._settle(batch)
+        if self.dead_letters is None:
+            logger.error(f"发送企业微信消息失败，丢弃 {len(batch)} 条通知: {error}")
+            return
+        for item in batch:
+            self.dead_letters.add(
+                KIND_WECHAT,
+                {"content": item.content, "mentioned_users": item.mentioned_users, "bot_key": bot_key},
+                error,
+                item.attempts,
+            )
+        self.dead_lettered_count += len(batch)
+
+    def _settle(self, batch: List[_PendingMessage]):
+        for item in batch:
+            self._unsettled.discard(item.seq)
+            for waiter in self._waiters.pop(item.seq, ()):
+                if not waiter.done():
+                    waiter.set_result(None)
+
+    def is_settled(self, seqs: List[int]) -> bool:
+        return not any(seq in self._unsettled for seq in seqs)
+
+    async def wait_settled(self, seqs: List[int]):
+        """等待这些消息全部发出或转入死信；停止时仍未发出的消息不会完成，调用方需要设置超时或取消"""
+        loop = asyncio.get_running_loop()
+        waiters = []
+        for seq in seqs:
+            if seq in self._unsettled:
+                waiter = loop.create_future()
+                self._waiters.setdefault(seq, []).append(waiter)
+                waiters.append((seq, waiter))
+        try:
+            for _, waiter in waiters:
+                await waiter
+        finally:
+            for seq, waiter in waiters:
+                pending = self._waiters.get(seq)
+                if pending is not None and waiter in pending:
+                    pending.remove(waiter)
+                    if not pending:
+                        del self._waiters[seq]
+
+    def settled_through(self) -> int:
+        """此序号及之前提交的消息都已发出或转入死信；等待发送、发送中和停止时丢弃的消息不算"""
+        return min(self._unsettled) - 1 if self._unsettled else self.submitted
+
+    def pending_count(self) -> int:
+        return sum(len(channel.pending) + len(channel.bulk) for channel in self._channels.values())
+
+    def stats(self) -> Dict[str, Any]:
+        """发送统计：排队延迟、合并数量、限流次数"""
+        return {
+            "pending": self.pending_count(),
+            "sent": self.sent_count,
+            "digests": self.digest_count,
+            "merged": self.merged_count,
+            "rate_limited": self.rate_limited_count,
+            "failed": self.failed_count,
+            "retried": self.retried_count,
+            "dead_lettered": self.dead_lettered_count,
+            "latency_avg": round(self.latency_total / self._delivered, 3) if self._delivered else 0.0,
+            "latency_max": round(self.latency_max, 3),
+        }
+
+    async def close(self, timeout: float = 5.0):
+        """等待待发送消息发出（最多timeout秒）后停止"""
+        deadline = time.monotonic() + timeout
+        while self.pending_count() and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        if self.pending_count():
+            logger.warning(f"停止时仍有 {self.pending_count()} 条通知未发送")
+        tasks = [channel.task for channel in self._channels.values() if channel.task]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._channels.clear()
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
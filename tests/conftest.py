@@ -0,0 +1,81 @@
+"""
+测试公共配置
+
+src.config 在导入时读取配置文件，这里在任何 src 模块导入之前写入测试专用的配置：
+SQLite数据放在临时目录，leader使用进程内租约，不依赖本地的 config.toml
+"""
+import os
+import tempfile
+from pathlib import Path
+
+import httpx
+import pytest
+
+TEST_DIR = Path(tempfile.mkdtemp(prefix="gitlab-webhook-tests-"))
+WEBHOOK_SECRET = "test-secret"
+
+CONFIG = f"""
+[gitlab]
+api_url = "http://gitlab.test/api/v4"
+url = "http://gitlab.test"
+access_token = "test-token"
+webhook_secret = "{WEBHOOK_SECRET}"
+project_id = 110
+page_concurrency = 2
+
+[wechat]
+bot_key = "test-bot-key"
+base_url = "http://wechat.test"
+rate_limit = 0
+
+[server]
+host = "127.0.0.1"
+port = 8000
+workers = 1
+
+[log]
+level = "info"
+max_size = 10485760
+backup_count = 1
+
+[app]
+debug = false
+
+[branches_regex]
+versions = ["main"]
+
+[resilience]
+dead_letter_path = "{(TEST_DIR / 'dead_letters.db').as_posix()}"
+
+[leader]
+backend = "memory"
+"""
+
+(TEST_DIR / "config.toml").write_text(CONFIG, encoding="utf-8")
+os.environ["GITLAB_WEBHOOK_CONFIG"] = str(TEST_DIR / "config.toml")
+
+from src.utils import gitlab_api  # noqa: E402
+from src.utils.resilience import CircuitBreaker, gitlab_breaker, wechat_breaker  # noqa: E402
+
+@pytest.fixture(autouse=True)
+def reset_breakers():
+    """熔断器是模块级单例，每个测试前恢复到关闭状态"""
+    for breaker in (gitlab_breaker, wechat_breaker):
+        breaker.state = CircuitBreaker.CLOSED
+        breaker.failures = 0
+        breaker._trial_in_flight = False
+    yield
+
+@pytest.fixture
+def gitlab():
+    """
+    用 httpx.MockTransport 代替GitLab
+
+    用法: gitlab(handler)，handler接收httpx.Request，返回httpx.Response（可以是协程函数）
+    """
+    def install(handler):
+        gitlab_api._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+    yield install
+    gitlab_api._client = None
+    gitlab_api._bulk_semaphore = None
@@ -0,0 +1,28 @@
+"""测试共用的GitLab数据和MockTransport处理函数"""
+import httpx
+
+def make_mr(iid: int, project_id: int = 110) -> dict:
+    return {
+        "iid": iid,
+        "project_id": project_id,
+        "references": {"full": f"group/project!{iid}"},
+        "title": f"MR {iid}",
+        "web_url": f"http://gitlab.test/group/project/-/merge_requests/{iid}",
+        "target_branch": "main",
+        "created_at": "2024-01-01T00:00:00Z",
+        "updated_at": "2024-01-01T00:00:00Z",
+        "state": "opened",
+        "author": {"name": "dev"},
+    }
+
+def paged_handler(pages: int, failing_page=None, status: int = 404, total_pages: bool = True):
+    """每页10个MR，failing_page返回错误"""
+    def handler(request: httpx.Request) -> httpx.Response:
+        page = int(request.url.params.get("page", 1))
+        if page == failing_page:
+            return httpx.Response(status, json={"message": "error"})
+        headers = {"X-Next-Page": str(page + 1) if page < pages else ""}
+        if total_pages:
+            headers["X-Total-Pages"] = str(pages)
+        return httpx.Response(200, json=[make_mr(page * 10 + i) for i in range(10)], headers=headers)
+    return handler
@@ -0,0 +1,47 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from src import main
+from src.utils.dead_letter import KIND_WECHAT, redact
+from tests.conftest import WEBHOOK_SECRET
+
+BOT_KEY = "0123456789abcdef-secret"
+
+@pytest.fixture
+def letter_id():
+    store = main.dead_letters
+    letter_id = store.add(
+        KIND_WECHAT,
+        {"content": "MR已合并", "mentioned_users": None, "bot_key": BOT_KEY},
+        f"ConnectError for url 'http://wechat.test/cgi-bin/webhook/send?key={BOT_KEY}'",
+        3,
+    )
+    yield letter_id
+    store.delete(letter_id)
+
+@pytest.fixture
+def client():
+    # 不进入lifespan，只测试接口本身
+    return TestClient(main.app)
+
+@pytest.mark.parametrize("path", ["/dead-letters", "/dead-letters/{id}"])
+@pytest.mark.parametrize("headers", [{}, {"X-Gitlab-Token": "wrong"}])
+def test_dead_letter_reads_require_token(client, letter_id, path, headers):
+    response = client.get(path.format(id=letter_id), headers=headers)
+    assert response.status_code == 403
+
+def test_dead_letter_responses_hide_bot_key(client, letter_id):
+    headers = {"X-Gitlab-Token": WEBHOOK_SECRET}
+    detail = client.get(f"/dead-letters/{letter_id}", headers=headers)
+    listing = client.get("/dead-letters", headers=headers)
+    assert detail.status_code == listing.status_code == 200
+    assert detail.json()["payload"]["bot_key"] == "***"
+    assert detail.json()["payload"]["content"] == "MR已合并"
+    for response in (detail, listing):
+        assert BOT_KEY not in response.text
+        assert BOT_KEY[:8] not in response.text
+
+def test_redact_masks_webhook_urls():
+    assert redact({"url": "https://qyapi.weixin.qq.com/cgi-bin/webhook/send?key=abc&debug=1"}) == {
+        "url": "https://qyapi.weixin.qq.com/cgi-bin/webhook/send?key=***&debug=1"
+    }
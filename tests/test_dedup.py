@@ -0,0 +1,121 @@
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from src import main
+from src.utils import dedup
+from src.utils.dedup import DeliveryDeduplicator, get_delivery_key
+from src.utils.queue_handler import QueueFullError
+from tests.conftest import WEBHOOK_SECRET
+from tests.test_webhook_handler import mr_event
+
+class Clock:
+    """代替time.time，测试去重窗口"""
+
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(dedup.time, "time", clock)
+    return clock
+
+def test_delivery_key_prefers_idempotency_key():
+    headers = {"Idempotency-Key": "a", "X-Gitlab-Event-UUID": "b"}
+    assert get_delivery_key(headers, b"{}") == "Idempotency-Key:a"
+    assert get_delivery_key({"X-Gitlab-Event-UUID": "b"}, b"{}") == "X-Gitlab-Event-UUID:b"
+
+def test_delivery_key_falls_back_to_event_type_and_body_hash():
+    key = get_delivery_key({"X-Gitlab-Event": "Note Hook"}, b"{}")
+    assert key.startswith("sha256:")
+    assert key == get_delivery_key({"X-Gitlab-Event": "Note Hook"}, b"{}")
+    assert key != get_delivery_key({"X-Gitlab-Event": "Merge Request Hook"}, b"{}")
+    assert key != get_delivery_key({"X-Gitlab-Event": "Note Hook"}, b"{ }")
+
+def test_duplicate_within_window(clock):
+    deduplicator = DeliveryDeduplicator(window=60)
+    assert not deduplicator.check_and_mark("a")
+    clock.now += 30
+    assert deduplicator.check_and_mark("a")
+    assert deduplicator.stats()["duplicates"] == 1
+
+def test_delivery_expires_after_window(clock):
+    deduplicator = DeliveryDeduplicator(window=60)
+    assert not deduplicator.check_and_mark("a")
+    clock.now += 61
+    assert not deduplicator.check_and_mark("a")
+
+def test_oldest_delivery_evicted_at_capacity(clock):
+    deduplicator = DeliveryDeduplicator(window=60, max_size=2)
+    for key in ("a", "b", "c"):
+        assert not deduplicator.check_and_mark(key)
+    assert deduplicator.stats()["size"] == 2
+    assert not deduplicator.check_and_mark("a")
+    assert deduplicator.check_and_mark("c")
+
+def test_forget_allows_redelivery(clock):
+    deduplicator = DeliveryDeduplicator(window=60)
+    deduplicator.check_and_mark("a")
+    deduplicator.forget("a")
+    assert not deduplicator.check_and_mark("a")
+
+def test_shared_state_between_workers(clock, tmp_path):
+    """配置shared_path时，一个worker记录的投递在另一个worker中也是重复的"""
+    path = str(tmp_path / "dedup.db")
+    first, second = DeliveryDeduplicator(window=60, shared_path=path), DeliveryDeduplicator(window=60, shared_path=path)
+    try:
+        assert not first.check_and_mark("a")
+        assert second.check_and_mark("a")
+        first.forget("a")
+        assert not second.check_and_mark("a")
+        clock.now += 61
+        assert not first.check_and_mark("a")
+    finally:
+        first.close()
+        second.close()
+
+@pytest.fixture
+def ingress(monkeypatch, clock):
+    """webhook接口使用新的去重器，入队的事件记录下来而不处理；queue_full为True时模拟队列已满"""
+    queued = []
+    state = {"queue_full": False}
+
+    async def add_task(handler, data, event_type):
+        if state["queue_full"]:
+            raise QueueFullError()
+        queued.append(data)
+        return True
+
+    monkeypatch.setattr(main, "delivery_deduplicator", DeliveryDeduplicator(window=60))
+    monkeypatch.setattr(main, "payload_archive", None)
+    monkeypatch.setattr(main.webhook_queue, "add_task", add_task)
+    return TestClient(main.app), queued, state
+
+def post(client: TestClient, uuid: str):
+    headers = {
+        "X-Gitlab-Token": WEBHOOK_SECRET,
+        "X-Gitlab-Event": "Merge Request Hook",
+        "X-Gitlab-Event-UUID": uuid,
+    }
+    return client.post("/gitlab-hook", content=json.dumps(mr_event("open")), headers=headers)
+
+def test_redelivered_webhook_is_not_queued_again(ingress):
+    client, queued, _ = ingress
+    assert post(client, "delivery-1").json() == {"status": "accepted"}
+    assert post(client, "delivery-1").json() == {"status": "duplicate"}
+    assert post(client, "delivery-2").json() == {"status": "accepted"}
+    assert len(queued) == 2
+
+def test_rejected_delivery_can_be_retried(ingress):
+    """队列已满返回503的投递没有被接收，GitLab重试时不能被当作重复丢弃"""
+    client, queued, state = ingress
+    state["queue_full"] = True
+    assert post(client, "delivery-1").status_code == 503
+    state["queue_full"] = False
+    assert post(client, "delivery-1").json() == {"status": "accepted"}
+    assert len(queued) == 1
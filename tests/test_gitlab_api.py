@@ -0,0 +1,32 @@
+import asyncio
+
+import pytest
+
+from src.tasks import mr_summary
+from src.utils.gitlab_api import GitlabAPI, GitLabAPIError
+from tests.helpers import paged_handler
+
+async def collect(project_id: int = 110) -> list:
+    return [mr async for mr in GitlabAPI.iter_project_merge_requests(project_id)]
+
+def test_iter_pages_returns_all_pages(gitlab):
+    gitlab(paged_handler(3))
+    assert len(asyncio.run(collect())) == 30
+
+@pytest.mark.parametrize("total_pages", [True, False])
+def test_iter_pages_raises_when_a_later_page_fails(gitlab, total_pages):
+    gitlab(paged_handler(3, failing_page=2, total_pages=total_pages))
+    with pytest.raises(GitLabAPIError):
+        asyncio.run(collect())
+
+def test_iter_pages_raises_when_first_page_is_forbidden(gitlab):
+    gitlab(paged_handler(3, failing_page=1, status=403))
+    with pytest.raises(GitLabAPIError):
+        asyncio.run(collect())
+
+def test_summary_reports_incomplete_source(gitlab, monkeypatch):
+    gitlab(paged_handler(3, failing_page=2))
+    monkeypatch.setattr(mr_summary, "mr_index", None)
+    project_groups, failed_sources = asyncio.run(mr_summary.collect_open_mrs())
+    assert project_groups == {}
+    assert failed_sources == ["project 110"]
@@ -0,0 +1,71 @@
+import asyncio
+
+import httpx
+import pytest
+
+from src.utils import gitlab_api
+from src.utils.gitlab_api import GitlabAPI
+from src.utils.http_cache import ResponseCache
+
+TTL = {"/users/:id": 3600, "/projects/:id/merge_requests/:id": 0}
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = ResponseCache(TTL, disk_path=str(tmp_path / "http_cache.db"))
+    monkeypatch.setattr(gitlab_api, "http_cache", cache)
+    yield cache
+    cache.close()
+
+def test_ttl_hit_and_conditional_revalidation(gitlab, cache):
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        if request.headers.get("If-None-Match") == '"v1"':
+            return httpx.Response(304)
+        return httpx.Response(200, json={"iid": 1}, headers={"ETag": '"v1"'})
+
+    gitlab(handler)
+    for _ in range(2):
+        assert asyncio.run(GitlabAPI.get_merge_request_details(110, 1)) == {"iid": 1}
+    # TTL为0：第二次带ETag重新验证，304时使用缓存
+    assert len(requests) == 2
+    assert requests[1].headers["If-None-Match"] == '"v1"'
+    assert cache.revalidated == 1
+
+def test_webhook_invalidation_reaches_other_workers(tmp_path):
+    path = str(tmp_path / "shared.db")
+    worker_a = ResponseCache(TTL, disk_path=path)
+    worker_b = ResponseCache(TTL, disk_path=path)
+    key = "/projects/110/merge_requests/1/approvals"
+    worker_a.store(key, {"approved": False}, {"ETag": '"v1"'}, 3600)
+    assert worker_b.get(key).value == {"approved": False}
+
+    worker_a.invalidate_from_webhook({"object_kind": "merge_request", "project": {"id": 110}, "object_attributes": {"iid": 1}})
+    assert worker_b.get(key) is None
+    # 清除之后重新写入的缓存正常使用
+    worker_b.store(key, {"approved": True}, {"ETag": '"v2"'}, 3600)
+    assert worker_b.get(key).value == {"approved": True}
+    worker_a.close()
+    worker_b.close()
+
+def test_client_error_on_revalidation_drops_entry(gitlab, cache):
+    responses = iter([
+        httpx.Response(200, json={"iid": 1}, headers={"ETag": '"v1"'}),
+        httpx.Response(404, json={"message": "404 Not found"}),
+    ])
+    gitlab(lambda request: next(responses))
+    asyncio.run(GitlabAPI.get_merge_request_details(110, 1))
+    assert cache.get("/projects/110/merge_requests/1") is not None
+    assert asyncio.run(GitlabAPI.get_merge_request_details(110, 1)) == {}
+    assert cache.get("/projects/110/merge_requests/1") is None
+
+def test_stale_entry_served_when_gitlab_is_down(gitlab, cache):
+    responses = iter([
+        httpx.Response(200, json={"iid": 1}, headers={"ETag": '"v1"'}),
+        httpx.Response(503),
+    ])
+    gitlab(lambda request: next(responses))
+    asyncio.run(GitlabAPI.get_merge_request_details(110, 1))
+    assert asyncio.run(GitlabAPI.get_merge_request_details(110, 1)) == {"iid": 1}
+    assert cache.stale == 1
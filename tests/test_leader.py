@@ -0,0 +1,28 @@
+import asyncio
+from typing import Optional
+
+import pytest
+
+from src.utils.leader import LeaseBackend, MemoryLeaseBackend
+
+def test_backend_must_implement_lease_operations():
+    class IncompleteBackend(LeaseBackend):
+        async def acquire(self, name: str, owner: str, ttl: float) -> bool:
+            return True
+
+    with pytest.raises(TypeError):
+        LeaseBackend()
+    with pytest.raises(TypeError):
+        IncompleteBackend()
+
+def test_memory_backend_single_holder():
+    async def scenario() -> Optional[str]:
+        backend = MemoryLeaseBackend()
+        assert await backend.acquire("scheduler", "a", ttl=60)
+        assert not await backend.acquire("scheduler", "b", ttl=60)
+        holder = await backend.holder("scheduler")
+        await backend.release("scheduler", "a")
+        assert await backend.acquire("scheduler", "b", ttl=60)
+        return holder
+
+    assert asyncio.run(scenario()) == "a"
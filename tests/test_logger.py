@@ -0,0 +1,49 @@
+import logging
+from logging.handlers import QueueHandler
+
+import pytest
+
+from src.utils import logger as logger_module
+from src.utils.logger import setup_logger, stop_logger
+
+def reset_logger(root: logging.Logger):
+    stop_logger()
+    for handler in logger_module._handlers:
+        root.removeHandler(handler)
+        handler.close()
+    logger_module._handlers = []
+
+@pytest.fixture
+def root_logger(tmp_path, monkeypatch):
+    """导入src.main时已经配置过日志，先停止，日志文件写到临时目录"""
+    root = logging.getLogger()
+    reset_logger(root)
+    monkeypatch.chdir(tmp_path)
+    level = root.level
+    yield root
+    reset_logger(root)
+    root.setLevel(level)
+
+def queue_handlers(root: logging.Logger) -> list:
+    return [handler for handler in root.handlers if isinstance(handler, QueueHandler)]
+
+def test_logs_after_stop_are_written_directly(root_logger, tmp_path):
+    setup_logger()
+    logging.getLogger("test").info("before stop")
+    stop_logger()
+    assert queue_handlers(root_logger) == []
+    logging.getLogger("test").info("after stop")
+    for handler in logger_module._handlers:
+        handler.flush()
+    content = (tmp_path / "logs" / "webhook.log").read_text(encoding="utf-8")
+    assert "before stop" in content
+    assert "after stop" in content
+
+def test_setup_again_does_not_stack_handlers(root_logger):
+    setup_logger()
+    stop_logger()
+    setup_logger()
+    setup_logger()
+    assert len(queue_handlers(root_logger)) == 1
+    # 停止后直接挂上的处理器已换回队列
+    assert not any(handler in root_logger.handlers for handler in logger_module._handlers)
@@ -0,0 +1,39 @@
+from src.utils.markdown import Markdown, _split_oversized, md
+
+def build_report(items: int) -> Markdown:
+    message = md("标题").bold().new_line()
+    for index in range(items):
+        message.boundary()
+        message = message + md(f"第{index}项").info().new_line() + "内容\n"
+    return message
+
+def test_chunks_split_at_boundaries():
+    message = build_report(20)
+    chunks = message.chunks(80)
+    assert "".join(chunks) == str(message)
+    assert all(len(chunk.encode("utf-8")) <= 80 for chunk in chunks)
+    # 每条消息都以完整的项开始，不会在项中间拆开
+    assert all(chunk.startswith(("**标题**", "<font")) for chunk in chunks)
+
+def test_reading_content_keeps_boundaries():
+    message = build_report(20)
+    expected = message.chunks(80)
+    assert str(message) == message.val
+    assert message.chunks(80) == expected
+
+def test_wrap_wraps_whole_content():
+    assert str(md("a") + "b").startswith("a")
+    assert str((md("a") + "b").bold()) == "**ab**"
+    message = md("中文")
+    assert message.byte_length == 6
+    assert message.bold().byte_length == 10
+
+def test_oversized_line_is_cut_on_character_boundaries():
+    pieces = list(_split_oversized("中" * 10, 7))
+    assert "".join(pieces) == "中" * 10
+    assert all(len(piece.encode("utf-8")) <= 7 for piece in pieces)
+
+def test_limit_smaller_than_one_character_terminates():
+    pieces = list(_split_oversized("中文ab", 2))
+    assert pieces == ["中", "文", "ab"]
+    assert md("中文").chunks(1) == ["中", "文"]
@@ -0,0 +1,138 @@
+import asyncio
+import time
+from datetime import datetime, timezone
+
+import httpx
+import pytest
+
+from src.tasks import mr_summary
+from src.utils.markdown import WECHAT_MARKDOWN_LIMIT
+from src.utils.mr_index import MRIndex
+from tests.helpers import make_mr, paged_handler
+
+def webhook_event(iid: int, state: str, project_id: int = 110) -> dict:
+    return {
+        "project": {"id": project_id, "path_with_namespace": "group/project"},
+        "object_attributes": {
+            "iid": iid,
+            "state": state,
+            "title": f"MR {iid}",
+            "url": f"http://gitlab.test/group/project/-/merge_requests/{iid}",
+            "target_branch": "main",
+            "created_at": "2024-01-01 00:00:00 UTC",
+            "updated_at": "2024-01-02 00:00:00 UTC",
+        },
+    }
+
+def states(index: MRIndex) -> dict:
+    return dict(index._conn.execute("SELECT iid, state FROM merge_requests").fetchall())
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    index = MRIndex(str(tmp_path / "mr_index.db"))
+    for page in (1, 2, 3):
+        for i in range(10):
+            index.upsert_from_api(make_mr(page * 10 + i))
+    monkeypatch.setattr(mr_summary, "mr_index", index)
+    yield index
+    index.close()
+
+@pytest.mark.parametrize("failing_page, status", [(2, 404), (1, 403)])
+def test_reconcile_skips_incomplete_fetch(gitlab, index, failing_page, status):
+    gitlab(paged_handler(3, failing_page=failing_page, status=status))
+    asyncio.run(mr_summary.reconcile_mr_index())
+    assert set(states(index).values()) == {"opened"}
+
+def test_reconcile_closes_missing_mrs_after_complete_fetch(gitlab, index):
+    handler = paged_handler(3)
+
+    def without_mr_25(request: httpx.Request) -> httpx.Response:
+        response = handler(request)
+        mrs = [mr for mr in response.json() if mr["iid"] != 25]
+        return httpx.Response(200, json=mrs, headers=response.headers)
+
+    gitlab(without_mr_25)
+    asyncio.run(mr_summary.reconcile_mr_index())
+    assert states(index)[25] == "closed"
+    assert [iid for iid, state in states(index).items() if state != "opened"] == [25]
+
+def test_reconcile_keeps_webhook_updates_made_during_scan(gitlab, index):
+    handler = paged_handler(3)
+
+    def handler_with_concurrent_webhooks(request: httpx.Request) -> httpx.Response:
+        # 扫描期间收到webhook：MR 20被合并(API返回的仍是opened)，新建了MR 99(不在API结果中)
+        if request.url.params.get("page") == "3":
+            index.upsert_from_webhook(webhook_event(20, "merged"))
+            index.upsert_from_webhook(webhook_event(99, "opened"))
+        return handler(request)
+
+    gitlab(handler_with_concurrent_webhooks)
+    asyncio.run(mr_summary.reconcile_mr_index())
+    assert states(index)[20] == "merged"
+    assert states(index)[99] == "opened"
+
+def test_reconcile_does_not_touch_rows_synced_after_start(index):
+    started_at = time.time()
+    index.upsert_from_webhook(webhook_event(10, "merged"))
+    index.upsert_from_webhook(webhook_event(100, "opened"))
+    closed = index.reconcile({110}, [make_mr(10)], started_at)
+    current = states(index)
+    assert current[10] == "merged"
+    assert current[100] == "opened"
+    # 扫描开始前同步、且不在API结果中的记录被关闭
+    assert current[11] == "closed"
+    assert closed == 29
+
+def test_summary_from_index_only_includes_configured_sources(gitlab, index, monkeypatch):
+    foreign = make_mr(1, project_id=999)
+    foreign["references"] = {"full": "other/project!1"}
+    index.upsert_from_api(foreign)
+    subgroup = make_mr(2, project_id=500)
+    subgroup["references"] = {"full": "team/sub/project!2"}
+    index.upsert_from_api(subgroup)
+    monkeypatch.setattr(mr_summary.settings.gitlab, "group_ids", [5])
+    gitlab(lambda request: httpx.Response(200, json={"id": 5, "full_path": "team"}))
+
+    project_groups, failed_sources = asyncio.run(mr_summary.collect_open_mrs())
+    assert sorted(project_groups) == ["group/project", "team/sub/project"]
+    assert failed_sources == []
+
+def test_summary_from_index_reports_unknown_group(gitlab, index, monkeypatch):
+    monkeypatch.setattr(mr_summary.settings.gitlab, "group_ids", [5])
+    gitlab(lambda request: httpx.Response(404, json={"message": "404 Group Not Found"}))
+    project_groups, failed_sources = asyncio.run(mr_summary.collect_open_mrs())
+    assert list(project_groups) == ["group/project"]
+    assert failed_sources == ["group 5"]
+
+def test_older_webhook_does_not_regress_state(index):
+    merged = webhook_event(10, "merged")
+    merged["object_attributes"]["updated_at"] = "2024-01-03 00:00:00 UTC"
+    index.upsert_from_webhook(merged)
+    # 重放或乱序到达的旧事件
+    index.upsert_from_webhook(webhook_event(10, "opened"))
+    assert states(index)[10] == "merged"
+
+def test_summary_renders_mr_without_created_at():
+    mr = make_mr(1)
+    mr["created_at"] = None
+    other = make_mr(2)
+    chunks = mr_summary.build_summary_chunks(
+        {"group/project": {"main": [mr, other]}}, [], mr_summary.datetime.fromisoformat("2024-01-08T00:00:00+00:00")
+    )
+    text = "".join(chunks)
+    assert "创建时间: 未知" in text
+    assert "(7天)" in text
+
+def test_summary_chunks_fit_message_limit_and_keep_every_mr():
+    mrs = [make_mr(iid) for iid in range(200)]
+    mrs[0]["created_at"] = None
+    chunks = mr_summary.build_summary_chunks(
+        mr_summary.group_by_project(mrs), ["group 5"], datetime(2024, 1, 8, tzinfo=timezone.utc)
+    )
+    assert len(chunks) > 1
+    assert all(len(chunk.encode("utf-8")) <= WECHAT_MARKDOWN_LIMIT for chunk in chunks)
+    assert f"MR周报汇总（2/{len(chunks)}）" in chunks[1].split("\n", 1)[0]
+    text = "".join(chunks)
+    assert all(f"[MR {iid}](" in text for iid in range(200))
+    assert "创建时间: 未知" in text and "2024-01-01 (7天)" in text
+    assert "以下来源获取失败: group 5" in chunks[-1]
@@ -0,0 +1,42 @@
+import gzip
+import json
+
+from src.utils.payload_archive import SEGMENT_SUFFIX, PayloadArchive, iter_archive, iter_payloads
+
+def test_records_written_as_gzip_jsonl(tmp_path):
+    archive = PayloadArchive(tmp_path, flush_interval=0.05)
+    archive.record("Merge Request Hook", b'{"iid":1}', {"iid": 1})
+    # 多行请求体用解析后的数据重新序列化，保持每行一条记录
+    archive.record("Note Hook", b'{\n"iid": 2\n}', {"iid": 2})
+    archive.close()
+
+    segments = list(tmp_path.glob(f"*{SEGMENT_SUFFIX}"))
+    assert len(segments) == 1
+    records = list(iter_archive(segments))
+    assert [(r["event_type"], r["data"]) for r in records] == [
+        ("Merge Request Hook", {"iid": 1}), ("Note Hook", {"iid": 2}),
+    ]
+    assert archive.stats()["written"] == 2
+
+def test_truncated_segment_keeps_complete_records(tmp_path):
+    """进程异常退出导致分段结尾不完整时，读取已完整写入的记录"""
+    path = tmp_path / f"payloads-1{SEGMENT_SUFFIX}"
+    data = gzip.compress(b"".join(
+        json.dumps({"ts": i, "event_type": "Note Hook", "data": {"i": i}}).encode() + b"\n" for i in range(100)
+    ))
+    path.write_bytes(data[:-20])
+    records = list(iter_archive([path]))
+    assert records and [r["ts"] for r in records] == list(range(len(records)))
+
+def test_iter_payloads_merges_segments_and_legacy_dumps_by_time(tmp_path):
+    for name, timestamps in (("a", (1e9 + 1, 1e9 + 4)), ("b", (1e9 + 2, 1e9 + 3))):
+        with gzip.open(tmp_path / f"payloads-{name}{SEGMENT_SUFFIX}", "wb") as f:
+            for ts in timestamps:
+                f.write(json.dumps({"ts": ts, "event_type": "Note Hook", "data": {"ts": ts}}).encode() + b"\n")
+    (tmp_path / "20000101_000000_Merge_Request_Hook.json").write_text('{"legacy": true}')
+    (tmp_path / "notes.txt").write_text("ignored")
+
+    records = list(iter_payloads([tmp_path]))
+    assert records[0]["event_type"] == "Merge Request Hook"
+    assert records[0]["data"] == {"legacy": True}
+    assert [r["ts"] for r in records[1:]] == [1e9 + 1, 1e9 + 2, 1e9 + 3, 1e9 + 4]
@@ -0,0 +1,178 @@
+import asyncio
+
+import pytest
+
+from src.utils.event_journal import EventJournal
+from src.utils.queue_handler import WebhookQueue
+from src.utils.resilience import RetryableError
+
+def mr_event(iid: int, action: str) -> dict:
+    return {
+        "object_kind": "merge_request",
+        "project": {"id": 110},
+        "object_attributes": {"iid": iid, "action": action},
+    }
+
+class Recorder:
+    """记录处理顺序，fail_times中的事件前几次抛出RetryableError"""
+
+    def __init__(self, fail_times: dict):
+        self.fail_times = dict(fail_times)
+        self.calls = []
+        self.done = []
+
+    async def __call__(self, data: dict):
+        event = (data["object_attributes"]["iid"], data["object_attributes"]["action"])
+        self.calls.append(event)
+        if self.fail_times.get(event, 0) > 0:
+            self.fail_times[event] -= 1
+            raise RetryableError("GitLab不可用")
+        self.done.append(event)
+
+async def run_queue(
+    queue: WebhookQueue, handler: Recorder, events: list, expected: int, timeout: float = 5, event_type: str = None
+):
+    for data in events:
+        await queue.add_task(handler, data, event_type)
+    deadline = asyncio.get_running_loop().time() + timeout
+    while len(handler.calls) < expected and asyncio.get_running_loop().time() < deadline:
+        await asyncio.sleep(0.01)
+    await queue.stop()
+
+def test_retry_keeps_per_mr_order():
+    queue = WebhookQueue(workers=1, max_attempts=3, retry_base_delay=0.05, retry_max_delay=0.05)
+    handler = Recorder({(1, "open"): 1})
+    events = [mr_event(1, "open"), mr_event(1, "approved"), mr_event(2, "open"), mr_event(1, "merge")]
+    asyncio.run(run_queue(queue, handler, events, expected=5))
+    assert handler.done == [(2, "open"), (1, "open"), (1, "approved"), (1, "merge")]
+    # 等待重试期间其他MR的事件照常处理
+    assert handler.calls[:2] == [(1, "open"), (2, "open")]
+    assert queue.stats()["parked"] == 0
+
+def test_parked_events_run_after_retries_are_exhausted():
+    queue = WebhookQueue(workers=1, max_attempts=2, retry_base_delay=0.01, retry_max_delay=0.01)
+    handler = Recorder({(1, "open"): 2})
+    events = [mr_event(1, "open"), mr_event(1, "approved"), mr_event(1, "merge")]
+    asyncio.run(run_queue(queue, handler, events, expected=4))
+    assert handler.calls == [(1, "open"), (1, "open"), (1, "approved"), (1, "merge")]
+
+def test_parked_event_failure_parks_remaining_events():
+    queue = WebhookQueue(workers=1, max_attempts=3, retry_base_delay=0.01, retry_max_delay=0.01)
+    handler = Recorder({(1, "open"): 1, (1, "approved"): 1})
+    events = [mr_event(1, "open"), mr_event(1, "approved"), mr_event(1, "merge")]
+    asyncio.run(run_queue(queue, handler, events, expected=5))
+    assert handler.done == [(1, "open"), (1, "approved"), (1, "merge")]
+
+@pytest.fixture
+def journal(tmp_path):
+    journal = EventJournal(str(tmp_path / "journal.db"), lease_seconds=1, max_attempts=5)
+    yield journal
+    journal.close()
+
+def attach(queue: WebhookQueue, journal: EventJournal, handler):
+    queue.attach_journal(journal, lambda event_type: handler)
+
+@pytest.mark.parametrize("error", [KeyError("iid"), RetryableError("GitLab不可用")])
+def test_failed_event_is_not_replayed_from_journal(journal, error):
+    """不可重试的错误和重试用完的事件确认日志，不会被反复重放"""
+    queue = WebhookQueue(workers=1, max_attempts=2, retry_base_delay=0.01, retry_max_delay=0.01)
+    calls = []
+
+    async def handler(data):
+        calls.append(data)
+        raise error
+
+    attach(queue, journal, handler)
+
+    async def scenario():
+        await queue.add_task(handler, mr_event(1, "open"), "Merge Request Hook")
+        await asyncio.sleep(0.1)
+        assert await queue.replay_journal() == 0
+        await queue.stop()
+
+    asyncio.run(scenario())
+    assert len(calls) == (2 if isinstance(error, RetryableError) else 1)
+    assert journal.pending_count() == 0
+
+def test_lease_is_renewed_while_waiting_for_retry(journal):
+    queue = WebhookQueue(workers=1, max_attempts=2)
+    attempts = []
+
+    async def handler(data):
+        attempts.append(data)
+        if len(attempts) == 1:
+            raise RetryableError("GitLab限流", retry_after=2.5)
+
+    attach(queue, journal, handler)
+    other_worker = EventJournal(journal.path, lease_seconds=1)
+    other_worker.owner = "other-host:1"
+
+    async def scenario():
+        await queue.add_task(handler, mr_event(1, "open"), "Merge Request Hook")
+        await asyncio.sleep(1.5)
+        # 租约已超过lease_seconds，但持有进程一直在续约
+        assert other_worker.claim_orphans() == []
+        await queue.stop()
+
+    asyncio.run(scenario())
+    # 停止时释放等待重试的事件，其他worker可以立即认领
+    assert [event_id for event_id, _, _ in other_worker.claim_orphans()] == [1]
+    other_worker.close()
+
+def test_journal_is_acked_only_after_messages_are_delivered(journal):
+    from src.utils.wechat_dispatcher import WeChatDispatcher
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def sender(content, mentioned_users, bot_key):
+            await release.wait()
+            return {"errcode": 0, "errmsg": "ok"}
+
+        dispatcher = WeChatDispatcher(sender, rate_per_minute=600, burst=10)
+
+        async def handler(data):
+            await dispatcher.submit("MR已合并", None, "bot")
+
+        queue = WebhookQueue(workers=1)
+        queue.attach_journal(journal, lambda event_type: handler, dispatcher=dispatcher)
+        await queue.add_task(handler, mr_event(1, "merge"), "Merge Request Hook")
+        await queue.add_task(handler, mr_event(2, "merge"), "Merge Request Hook")
+        await queue.join()
+        # 处理函数已返回，但消息还在分发器中
+        assert journal.pending_count() == 2
+
+        release.set()
+        for _ in range(100):
+            if journal.pending_count() == 0:
+                break
+            await asyncio.sleep(0.01)
+        assert journal.pending_count() == 0
+        await queue.stop()
+        await dispatcher.close()
+
+    asyncio.run(scenario())
+
+def test_undelivered_events_are_released_on_stop(journal):
+    from src.utils.wechat_dispatcher import WeChatDispatcher
+
+    async def scenario():
+        async def sender(content, mentioned_users, bot_key):
+            await asyncio.sleep(10)
+
+        dispatcher = WeChatDispatcher(sender, rate_per_minute=600, burst=10)
+
+        async def handler(data):
+            await dispatcher.submit("MR已合并", None, "bot")
+
+        queue = WebhookQueue(workers=1)
+        queue.attach_journal(journal, lambda event_type: handler, dispatcher=dispatcher)
+        await queue.add_task(handler, mr_event(1, "merge"), "Merge Request Hook")
+        await queue.stop(timeout=0.1)
+        await dispatcher.close(timeout=0)
+
+    asyncio.run(scenario())
+    other_worker = EventJournal(journal.path)
+    other_worker.owner = "other-host:1"
+    assert len(other_worker.claim_orphans()) == 1
+    other_worker.close()
@@ -0,0 +1,73 @@
+import asyncio
+import json
+
+from src.replay import Checkpoint
+from src.utils.wechat_dispatcher import WeChatDispatcher
+
+def saved_position(path) -> int:
+    return json.loads(path.read_text(encoding="utf-8"))["position"]
+
+async def wait_settled(dispatcher: WeChatDispatcher, seq: int):
+    for _ in range(100):
+        if dispatcher.settled_through() >= seq:
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("消息未发出")
+
+def make_dispatcher(release: asyncio.Event) -> WeChatDispatcher:
+    async def sender(content, mentioned_users, bot_key):
+        await release.wait()
+        return {"errcode": 0, "errmsg": "ok"}
+    return WeChatDispatcher(sender, rate_per_minute=600, burst=10)
+
+def test_checkpoint_waits_for_queued_messages(tmp_path):
+    path = tmp_path / "replay.ckpt"
+
+    async def scenario():
+        release = asyncio.Event()
+        dispatcher = make_dispatcher(release)
+        checkpoint = Checkpoint(str(path), "fingerprint", dispatcher=dispatcher)
+        checkpoint.complete(0, 1.0)
+        await dispatcher.submit("event 1", None, "bot")
+        checkpoint.complete(1, 2.0)
+        checkpoint.save()
+        # 事件1的通知还在分发器中，断点不能越过它
+        assert saved_position(path) == -1
+
+        release.set()
+        await wait_settled(dispatcher, 1)
+        checkpoint.save()
+        assert saved_position(path) == 1
+        await dispatcher.close()
+
+    asyncio.run(scenario())
+
+def test_interrupted_replay_resumes_before_undelivered_messages(tmp_path):
+    path = tmp_path / "replay.ckpt"
+
+    async def scenario():
+        release = asyncio.Event()
+        dispatcher = make_dispatcher(release)
+        checkpoint = Checkpoint(str(path), "fingerprint", dispatcher=dispatcher)
+        for seq in range(3):
+            checkpoint.complete(seq, float(seq))
+            checkpoint.save()
+        await dispatcher.submit("event 3", None, "bot")
+        checkpoint.complete(3, 3.0)
+        checkpoint.complete(4, 4.0)
+        # 中断：分发器停止时消息仍未发出
+        await dispatcher.close(timeout=0)
+        checkpoint.save()
+
+    asyncio.run(scenario())
+    resumed = Checkpoint(str(path), "fingerprint")
+    assert resumed.position == 2
+    assert resumed.processed == 2
+
+def test_checkpoint_without_dispatcher_confirms_processed_events(tmp_path):
+    path = tmp_path / "replay.ckpt"
+    checkpoint = Checkpoint(str(path), "fingerprint")
+    checkpoint.complete(1, 1.0)
+    checkpoint.complete(0, 0.0)
+    checkpoint.save()
+    assert saved_position(path) == 1
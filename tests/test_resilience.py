@@ -0,0 +1,83 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from src.utils import wechat_bot
+from src.utils.gitlab_api import GitlabAPI
+from src.utils.resilience import CircuitBreaker, CircuitOpenError, backoff_delay, gitlab_breaker, wechat_breaker
+from src.utils.wechat_bot import WeChatBot
+
+def open_breaker(breaker: CircuitBreaker):
+    for _ in range(breaker.failure_threshold):
+        breaker.before_call()
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+def test_breaker_opens_after_threshold_and_rejects_calls():
+    breaker = CircuitBreaker("test", failure_threshold=2, recovery_timeout=60)
+    open_breaker(breaker)
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    assert breaker.rejected_count == 1
+
+def test_half_open_allows_single_trial():
+    breaker = CircuitBreaker("test", failure_threshold=1, recovery_timeout=0.01)
+    open_breaker(breaker)
+    time.sleep(0.02)
+    breaker.before_call()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # 试探请求未完成前，其他请求直接失败
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.before_call()
+
+def test_failed_trial_reopens():
+    breaker = CircuitBreaker("test", failure_threshold=3, recovery_timeout=0.01)
+    open_breaker(breaker)
+    time.sleep(0.02)
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+def test_backoff_delay_is_capped_and_honours_retry_after():
+    for attempt in range(1, 10):
+        assert 0 <= backoff_delay(attempt, base=1, cap=4) <= 4
+    assert backoff_delay(1, base=1, cap=4, retry_after=30) == 30
+
+async def hang(request: httpx.Request) -> httpx.Response:
+    await asyncio.sleep(10)
+    return httpx.Response(200, json={})
+
+def wait_for_half_open(breaker: CircuitBreaker, monkeypatch):
+    monkeypatch.setattr(breaker, "recovery_timeout", 0.01)
+    open_breaker(breaker)
+    time.sleep(0.02)
+
+def test_cancelled_gitlab_trial_releases_breaker(gitlab, monkeypatch):
+    wait_for_half_open(gitlab_breaker, monkeypatch)
+    gitlab(hang)
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(asyncio.wait_for(GitlabAPI.get_merge_request_details(110, 1), 0.05))
+    assert gitlab_breaker.state == CircuitBreaker.HALF_OPEN
+
+    # 下一个请求可以重新试探，成功后熔断器关闭
+    gitlab(lambda request: httpx.Response(200, json={"iid": 1}))
+    assert asyncio.run(GitlabAPI.get_merge_request_details(110, 1)) == {"iid": 1}
+    assert gitlab_breaker.state == CircuitBreaker.CLOSED
+
+def test_cancelled_wechat_trial_releases_breaker(monkeypatch):
+    wait_for_half_open(wechat_breaker, monkeypatch)
+    monkeypatch.setattr(wechat_bot, "_client", httpx.AsyncClient(transport=httpx.MockTransport(hang), base_url="http://wechat.test"))
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(asyncio.wait_for(WeChatBot.post_message("test"), 0.05))
+
+    ok = httpx.MockTransport(lambda request: httpx.Response(200, json={"errcode": 0, "errmsg": "ok"}))
+    monkeypatch.setattr(wechat_bot, "_client", httpx.AsyncClient(transport=ok, base_url="http://wechat.test"))
+    assert asyncio.run(WeChatBot.post_message("test"))["errcode"] == 0
+    assert wechat_breaker.state == CircuitBreaker.CLOSED
@@ -0,0 +1,99 @@
+import asyncio
+
+import httpx
+import pytest
+
+from src.config import RouteConfig
+from src.utils import router as router_module
+from src.utils.gitlab_api import user_cache
+from src.handlers.webhook_handler import resolve_route
+from src.utils.router import Router, route_event
+
+AUTHOR = {"id": 7, "username": "zhangsan", "name": "张三"}
+REVIEWER = {"id": 8, "username": "lisi", "name": "李四"}
+
+def mr_event(actor: dict, action: str = "approved") -> dict:
+    return {
+        "object_kind": "merge_request",
+        "user": actor,
+        "project": {"id": 110, "path_with_namespace": "group/project"},
+        "object_attributes": {"iid": 1, "action": action, "target_branch": "main", "author_id": AUTHOR["id"]},
+    }
+
+@pytest.fixture
+def author_routes(monkeypatch):
+    """zhangsan作者的MR发送到author机器人；按ID配置的规则发送到by-id机器人"""
+    router = Router(
+        [RouteConfig(authors=["zhangsan"], bots=["author"]), RouteConfig(authors=[8], bots=["by-id"])],
+        {}, "default",
+    )
+    monkeypatch.setattr(router_module, "router", router)
+    user_cache.clear()
+    yield router
+    user_cache.clear()
+
+@pytest.fixture
+def users(gitlab):
+    """GitLab用户接口，记录请求的用户ID"""
+    requested = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        user_id = int(request.url.path.rsplit("/", 1)[-1])
+        requested.append(user_id)
+        user = {AUTHOR["id"]: AUTHOR, REVIEWER["id"]: REVIEWER}.get(user_id)
+        return httpx.Response(200, json=user) if user else httpx.Response(404)
+
+    gitlab(handler)
+    return requested
+
+def test_username_rule_matches_author_when_reviewer_acts(author_routes, users):
+    """评审人操作作者的MR：按用户名配置的作者规则匹配MR作者，而不是操作者"""
+    data = mr_event(REVIEWER)
+    assert asyncio.run(resolve_route(data, "approved", "main")) == ("author",)
+    assert users == [AUTHOR["id"]]
+
+def test_id_rule_does_not_match_acting_user(author_routes, users):
+    """作者ID规则不会因为操作者是该用户而匹配"""
+    data = mr_event(REVIEWER)
+    assert "by-id" not in asyncio.run(resolve_route(data, "approved", "main"))
+
+def test_author_acting_needs_no_lookup(author_routes, users):
+    """操作者就是作者时直接使用webhook中的用户名"""
+    assert asyncio.run(resolve_route(mr_event(AUTHOR, "open"), "open", "main")) == ("author",)
+    assert users == []
+
+def test_other_author_does_not_match(author_routes, users):
+    data = mr_event(REVIEWER)
+    data["object_attributes"]["author_id"] = 9
+    assert asyncio.run(resolve_route(data, "approved", "main")) == ()
+
+def test_note_event_uses_merge_request_author(author_routes, users):
+    data = {
+        "object_kind": "note",
+        "user": REVIEWER,
+        "project": {"id": 110, "path_with_namespace": "group/project"},
+        "merge_request": {"iid": 1, "target_branch": "main", "author_id": AUTHOR["id"]},
+    }
+    assert asyncio.run(resolve_route(data, "note", "main")) == ("author",)
+
+def test_prefilter_keeps_events_with_unresolved_author(author_routes, users):
+    """入队前不访问GitLab：作者用户名未知时不能按用户名规则丢弃事件"""
+    data = mr_event(REVIEWER)
+    data["object_attributes"]["author_id"] = 9
+    assert route_event(data, "approved", "main") == ("author",)
+    assert users == []
+
+def test_route_filters_by_branch_action_and_project():
+    router = Router(
+        [
+            RouteConfig(projects=["group/project"], branches=["^release/"], actions=["merge"], bots=["release"]),
+            RouteConfig(projects=[110], actions=["note"], bots=["notes"]),
+        ],
+        {"release": "release-key"}, "default",
+    )
+    assert router.route(110, "group/project", "release/1.0", "merge") == ("release-key",)
+    assert router.route(110, "group/project", "main", "merge") == ()
+    assert router.route(111, "group/other", "release/1.0", "merge") == ()
+    assert router.route(110, "group/project", "main", "note") == ("notes",)
+    assert router.is_target_branch("release/1.0")
+    assert not router.is_target_branch("main")
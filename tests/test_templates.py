@@ -0,0 +1,28 @@
+import pytest
+
+from src.utils.router import MR_ACTIONS, NOTE_ACTION
+from src.utils.templates import REMINDER_ACTION, Template, load_templates
+
+def test_render_escapes_and_fills_missing_fields():
+    template = Template("open", "{title} by {author} ({reviewer})")
+    assert template.fields == {"title", "author", "reviewer"}
+    assert template.render({"title": 'Fix "login"', "author": "dev"}) == "Fix 'login' by dev ()"
+
+@pytest.mark.parametrize("source", ["{unknown}", "{title!r}", "{title:>10}"])
+def test_invalid_template_rejected(source):
+    with pytest.raises(ValueError):
+        Template("open", source)
+
+def test_defaults_cover_every_action():
+    templates = load_templates()
+    assert set(templates) == {*MR_ACTIONS, NOTE_ACTION, REMINDER_ACTION}
+    assert "{" not in templates["merge"].render({"title": "t"})
+
+def test_override_replaces_default():
+    templates = load_templates({"merge": "已合并: {title}"})
+    assert templates["merge"].render({"title": "t"}) == "已合并: t"
+    assert templates["open"].source == load_templates()["open"].source
+
+def test_unknown_template_name_rejected():
+    with pytest.raises(ValueError):
+        load_templates({"push": "{title}"})
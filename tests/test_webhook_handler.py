@@ -0,0 +1,157 @@
+import asyncio
+
+import pytest
+
+from src.handlers import webhook_handler
+from src.utils.gitlab_api import GitlabAPI
+from src.utils.mr_index import MRIndex
+from src.utils.reminders import ReminderScheduler, ReminderStore
+from src.utils.wechat_bot import WeChatBot
+
+EVENT_TYPE = "Merge Request Hook"
+
+def mr_event(action: str, state: str = "opened", iid: int = 7) -> dict:
+    return {
+        "object_kind": "merge_request",
+        "event_type": "merge_request",
+        "user": {"id": 1, "name": "dev"},
+        "project": {"id": 110, "name": "project", "namespace": "group", "path_with_namespace": "group/project"},
+        "object_attributes": {
+            "iid": iid,
+            "action": action,
+            "state": state,
+            "title": "Fix login",
+            "description": "",
+            "target_branch": "main",
+            "author_id": 1,
+            "url": f"http://gitlab.test/group/project/-/merge_requests/{iid}",
+            "created_at": "2024-01-01 00:00:00 UTC",
+            "updated_at": "2024-01-02 00:00:00 UTC",
+        },
+    }
+
+@pytest.fixture
+def sent(monkeypatch):
+    """只有 open/reopen/update/approved 匹配通知规则（自定义 [[routes]] 没有包含 merge/close）"""
+    messages = []
+
+    async def broadcast(content, bot_keys, mentioned_users=None):
+        messages.append(content)
+
+    async def get_user_info(user_id):
+        return {"name": "dev"}
+
+    routed = {"open", "reopen", "update", "approved"}
+
+    def route_event(data, action, branch):
+        return ("bot",) if action in routed else ()
+
+    async def resolve_route(data, action, branch):
+        return route_event(data, action, branch)
+
+    monkeypatch.setattr(webhook_handler, "route_event", route_event)
+    monkeypatch.setattr(webhook_handler, "resolve_route", resolve_route)
+    monkeypatch.setattr(WeChatBot, "broadcast", broadcast)
+    monkeypatch.setattr(GitlabAPI, "get_user_info", get_user_info)
+    return messages
+
+@pytest.fixture
+def reminders(tmp_path, monkeypatch):
+    store = ReminderStore(str(tmp_path / "reminders.db"))
+    scheduler = ReminderScheduler(store, timeout=3600)
+    monkeypatch.setattr(webhook_handler, "reminders", scheduler)
+    yield scheduler
+    store.close()
+
+def handle(action: str, state: str = "opened"):
+    data = mr_event(action, state)
+    if webhook_handler.get_ignore_reason(EVENT_TYPE, data):
+        return False
+    asyncio.run(webhook_handler.handle_merge_request(data))
+    return True
+
+def test_routed_out_merge_still_cancels_reminder(sent, reminders):
+    assert handle("open")
+    assert reminders.store.pending_count() == 1
+    assert handle("merge", state="merged")
+    assert reminders.store.pending_count() == 0
+    # merge 没有匹配的规则，不发送通知
+    assert len(sent) == 1
+
+def test_routed_out_events_are_ignored_without_state_tracking(sent, monkeypatch):
+    monkeypatch.setattr(webhook_handler, "reminders", None)
+    assert webhook_handler.get_ignore_reason(EVENT_TYPE, mr_event("merge", "merged")) == "no matching route"
+
+def test_update_after_approval_does_not_rearm(sent, reminders):
+    handle("open")
+    handle("approved")
+    assert reminders.store.pending_count() == 0
+    handle("update")
+    assert reminders.store.pending_count() == 0
+    # 撤销评审通过后，后续更新重新开始计时
+    handle("unapproved")
+    handle("update")
+    assert reminders.store.pending_count() == 1
+
+def test_routed_out_close_updates_index(sent, tmp_path, monkeypatch):
+    index = MRIndex(str(tmp_path / "mr_index.db"))
+    monkeypatch.setattr(webhook_handler, "mr_index", index)
+    monkeypatch.setattr(webhook_handler, "reminders", None)
+    handle("open")
+    assert handle("close", state="closed")
+    assert index.open_merge_requests([110]) == []
+    index.close()
+
+def test_reopen_after_approve_and_close_rearms(sent, reminders):
+    handle("open")
+    handle("approved")
+    handle("close", state="closed")
+    # 关闭的MR不保留评审通过标记
+    assert not reminders.store.is_suppressed((110, 7))
+    handle("reopen")
+    assert reminders.store.pending_count() == 1
+
+def test_store_does_not_arm_suppressed_mr(tmp_path):
+    store = ReminderStore(str(tmp_path / "reminders.db"))
+    key = (110, 7)
+    assert store.arm(key, 100.0, {}) == 100.0
+    assert store.cancel(key, suppress=True)
+    assert store.arm(key, 200.0, {}) is None
+    assert store.pending_count() == 0
+    store.unsuppress(key)
+    assert store.arm(key, 300.0, {}) == 300.0
+    store.close()
+
+def run_replay(events, dry_run=False):
+    from src.replay import Checkpoint, replay
+
+    records = [{"event_type": EVENT_TYPE, "data": data, "ts": float(index)} for index, data in enumerate(events)]
+    return asyncio.run(replay(records, Checkpoint(None, "fingerprint"), concurrency=1, dry_run=dry_run))
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    index = MRIndex(str(tmp_path / "mr_index.db"))
+    monkeypatch.setattr(webhook_handler, "mr_index", index)
+    yield index
+    index.close()
+
+def test_replayed_events_do_not_arm_reminders(sent, reminders, index):
+    stats = run_replay([mr_event("open")])
+    assert stats["replayed"] == 1
+    assert reminders.store.pending_count() == 0
+    assert [mr["iid"] for mr in index.open_merge_requests([110])] == [7]
+
+def test_replayed_old_event_does_not_reopen_merged_mr(sent, index):
+    merged = mr_event("merge", state="merged")
+    merged["object_attributes"]["updated_at"] = "2024-01-05 00:00:00 UTC"
+    asyncio.run(webhook_handler.handle_merge_request(merged))
+    run_replay([mr_event("open")])
+    assert index.open_merge_requests([110]) == []
+
+def test_dry_run_leaves_local_state_untouched(sent, reminders, index):
+    run_replay([mr_event("open")], dry_run=True)
+    assert index.open_merge_requests([110]) == []
+    assert reminders.store.pending_count() == 0
+    # 演练不再修改其他模块的全局变量
+    assert webhook_handler.mr_index is index
+    assert webhook_handler.reminders is reminders
@@ -0,0 +1,126 @@
+import asyncio
+
+from src.utils.wechat_dispatcher import WeChatDispatcher
+
+def test_workers_share_one_rate_limit(tmp_path):
+    """两个worker共享令牌桶：合计发送次数不超过一个机器人的配额"""
+    shared_path = str(tmp_path / "rate_limit.db")
+
+    async def scenario():
+        sent = []
+
+        async def sender(content, mentioned_users, bot_key):
+            sent.append(content)
+            return {"errcode": 0, "errmsg": "ok"}
+
+        # 每分钟3条：测试期间不会补充新的令牌
+        workers = [
+            WeChatDispatcher(sender, rate_per_minute=3, burst=3, digest_threshold=0, shared_path=shared_path)
+            for _ in range(2)
+        ]
+        for index, dispatcher in enumerate(workers):
+            for n in range(3):
+                await dispatcher.submit(f"worker {index} message {n}", None, "bot")
+        await asyncio.sleep(0.2)
+        pending = sum(dispatcher.pending_count() for dispatcher in workers)
+        for dispatcher in workers:
+            await dispatcher.close(timeout=0)
+        return sent, pending
+
+    sent, pending = asyncio.run(scenario())
+    assert len(sent) == 3
+    assert pending == 3
+
+def test_separate_buckets_without_shared_path():
+    async def scenario():
+        sent = []
+
+        async def sender(content, mentioned_users, bot_key):
+            sent.append(content)
+            return {"errcode": 0, "errmsg": "ok"}
+
+        workers = [WeChatDispatcher(sender, rate_per_minute=3, burst=3, digest_threshold=0) for _ in range(2)]
+        for dispatcher in workers:
+            for n in range(3):
+                await dispatcher.submit(f"message {n}", None, "bot")
+        await asyncio.sleep(0.2)
+        for dispatcher in workers:
+            await dispatcher.close(timeout=0)
+        return sent
+
+    assert len(asyncio.run(scenario())) == 6
+
+def send_all(submissions, **options):
+    """提交消息后等待全部发出，返回发送顺序"""
+    async def scenario():
+        sent = []
+
+        async def sender(content, mentioned_users, bot_key):
+            sent.append(content)
+            return {"errcode": 0, "errmsg": "ok"}
+
+        dispatcher = WeChatDispatcher(sender, rate_per_minute=600, burst=10, digest_threshold=0, **options)
+        for content, bulk, key in submissions:
+            await dispatcher.submit(content, None, "bot", bulk=bulk, key=key)
+        for _ in range(100):
+            if not dispatcher.pending_count():
+                break
+            await asyncio.sleep(0.01)
+        await dispatcher.close(timeout=0)
+        return sent
+
+    return asyncio.run(scenario())
+
+def test_realtime_message_keeps_mr_order_with_earlier_bulk_message():
+    sent = send_all([
+        ("update !1", True, (110, 1)),
+        ("update !2", True, (110, 2)),
+        ("note !3", False, (110, 3)),
+        ("merge !1", False, (110, 1)),
+    ])
+    assert sent.index("update !1") < sent.index("merge !1")
+    # 其他MR的批量消息仍然让实时通知先发
+    assert sent == ["note !3", "update !1", "merge !1", "update !2"]
+
+def test_bulk_message_stops_yielding_after_max_wait():
+    sent = send_all([("weekly report", True, None), ("note !3", False, (110, 3))], bulk_max_wait=0)
+    assert sent == ["weekly report", "note !3"]
+
+def send_digests(contents, mentions=None, **options):
+    """令牌不足时提交多条消息，返回实际发送的(内容, @成员)"""
+    async def scenario():
+        sent = []
+
+        async def sender(content, mentioned_users, bot_key):
+            sent.append((content, mentioned_users))
+            return {"errcode": 0, "errmsg": "ok"}
+
+        # 只有1个令牌，低于digest_threshold，排队的消息合并发送
+        dispatcher = WeChatDispatcher(sender, rate_per_minute=600, burst=1, digest_threshold=5, **options)
+        for index, content in enumerate(contents):
+            await dispatcher.submit(content, (mentions or {}).get(index), "bot")
+        for _ in range(100):
+            if not dispatcher.pending_count():
+                break
+            await asyncio.sleep(0.01)
+        await dispatcher.close(timeout=0)
+        return sent, dispatcher.digest_count
+
+    return asyncio.run(scenario())
+
+def test_low_tokens_merge_pending_messages_into_digest():
+    sent, digests = send_digests(["a", "b", "c"], mentions={0: ["dev"], 2: ["dev", "lead"]})
+    assert digests == 1
+    content, mentioned_users = sent[0]
+    assert len(sent) == 1
+    assert content.split("\n", 1)[1] == "a\n---\nb\n---\nc"
+    assert mentioned_users == ["dev", "lead"]
+
+def test_digest_respects_max_bytes():
+    contents = [f"message {n} " + "x" * 100 for n in range(6)]
+    sent, _ = send_digests(contents, max_bytes=400)
+    assert len(sent) > 1
+    assert all(len(content.encode("utf-8")) <= 400 for content, _ in sent)
+    # 拆成多条摘要后所有消息按顺序发出
+    delivered = [line for content, _ in sent for line in content.split("\n") if line.startswith("message")]
+    assert delivered == contents